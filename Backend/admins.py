@@ -0,0 +1,90 @@
+# Admin accounts
+
+# Admin rights (/admin/*, request profiling) come from users.is_admin, which
+# signup cannot set; the userType a user picks at signup grants nothing.
+# Grant or revoke them here:
+#
+# python admins.py grant someone@example.com
+# python admins.py revoke someone@example.com
+# python admins.py list
+#
+# /query only needs the flag for queue priority, so it reads it through
+# AdminFlagCache (ADMIN_CACHE_SECONDS); access checks always read the column.
+
+import argparse
+import os
+import time
+
+from sqlalchemy import text
+
+
+ADMIN_CACHE_SECONDS = float(os.getenv("ADMIN_CACHE_SECONDS", 60))
+ADMIN_CACHE_SIZE = int(os.getenv("ADMIN_CACHE_SIZE", 10000))
+
+
+async def is_admin(db, user_id: int) -> bool:
+    """Whether the user currently holds admin rights (read on every check, so a revoke applies at once)."""
+    result = await db.execute(text("SELECT is_admin FROM users WHERE user_id = :user_id"), {"user_id": user_id})
+    return bool(result.scalar())
+
+
+class AdminFlagCache:
+    """
+    users.is_admin per user for `ttl` seconds, so a cached lookup costs no
+    pool checkout. Used from the event loop only. A grant or revoke shows up
+    within `ttl`, which is fine for priority but not for access checks.
+    """
+
+    def __init__(self, ttl: float = ADMIN_CACHE_SECONDS, max_entries: int = ADMIN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._flags = {}  # user_id -> (admin, fetched_at), oldest fetch first
+
+    async def get(self, db, user_id: int) -> bool:
+        now = time.monotonic()
+        cached = self._flags.get(user_id)
+        if cached and now - cached[1] < self.ttl:
+            return cached[0]
+
+        admin = await is_admin(db, user_id)
+        self._flags.pop(user_id, None)
+        self._flags[user_id] = (admin, now)
+        while len(self._flags) > self.max_entries:
+            del self._flags[next(iter(self._flags))]
+        return admin
+
+    def __len__(self):
+        return len(self._flags)
+
+
+def set_admin(engine, email: str, admin: bool = True) -> bool:
+    """Grant or revoke admin rights. False when no user has that email."""
+    with engine.begin() as conn:
+        return conn.execute(text("UPDATE users SET is_admin = :admin WHERE email = :email"), {
+            "admin": admin, "email": email
+        }).rowcount > 0
+
+
+def list_admins(engine) -> list[str]:
+    with engine.connect() as conn:
+        return [r.email for r in conn.execute(text("SELECT email FROM users WHERE is_admin = :admin ORDER BY email"), {
+            "admin": True
+        })]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["grant", "revoke", "list"])
+    parser.add_argument("email", nargs="?")
+    args = parser.parse_args()
+
+    from tax_database import engine
+
+    if args.command == "list":
+        print("\n".join(list_admins(engine)) or "No admins")
+    elif not args.email:
+        parser.error(f"{args.command} needs an email")
+    elif not set_admin(engine, args.email, args.command == "grant"):
+        raise SystemExit(f"No user with email {args.email}")
+    else:
+        print(f"{args.email}: admin {'granted' if args.command == 'grant' else 'revoked'}")
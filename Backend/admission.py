@@ -0,0 +1,151 @@
+# Admission control for LLM-bound requests
+
+# At most MAX_CONCURRENT_QUERIES graph executions run at once. Excess requests
+# wait in a priority queue (admins first, then by userType) until a slot frees
+# up or their queue deadline passes. When the queue is full they are rejected
+# straight away.
+#
+# Waiting happens on the event loop, before the graph run is handed to the
+# threadpool: a queued request holds no worker thread, so the queue can be far
+# longer than the threadpool and the 429/503 paths stay reachable.
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", 8))
+MAX_QUEUED_QUERIES = int(os.getenv("MAX_QUEUED_QUERIES", 64))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", 15))
+
+# Lower value = served first. Admin rights come from users.is_admin (admins.py);
+# unknown or missing userType gets the lowest priority.
+ADMIN_PRIORITY = 0
+USER_PRIORITY = {
+    "consultant": 1,
+    "business": 2,
+    "student": 2,
+    "taxpayer": 2,
+}
+DEFAULT_PRIORITY = 3
+
+
+def user_priority(user_type: str | None, admin: bool = False) -> int:
+    if admin:
+        return ADMIN_PRIORITY
+    return USER_PRIORITY.get((user_type or "").lower(), DEFAULT_PRIORITY)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Slots and queue live on the event loop that calls acquire/release, so no
+    lock is needed. A freed slot is handed straight to the head of the queue.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_QUERIES,
+                 max_queued: int = MAX_QUEUED_QUERIES,
+                 queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+        self._queue = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self.active = 0
+
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_service_time = 1.0  # seconds, moving average
+
+    def _retry_after(self) -> int:
+        backlog = len(self._queue) + self.active
+        return max(1, int(backlog * self.avg_service_time / max(1, self.max_concurrent)))
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY, timeout: float | None = None):
+        timeout = self.queue_timeout if timeout is None else timeout
+
+        if self.active < self.max_concurrent and not self._queue:
+            self.active += 1
+            self.admitted += 1
+            metrics.admission_wait.observe(0, priority=priority)
+            return
+
+        if len(self._queue) >= self.max_queued:
+            self.rejected += 1
+            raise AdmissionRejected(429, "Server is busy, please retry shortly", self._retry_after())
+
+        start = time.monotonic()
+        entry = (priority, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, entry)
+        try:
+            await asyncio.wait((entry[2],), timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not entry[2].done():
+            self._abandon(entry)
+            self.timed_out += 1
+            raise AdmissionRejected(503, "Request timed out waiting in queue", self._retry_after())
+
+        waited = time.monotonic() - start
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        metrics.admission_wait.observe(waited, priority=priority)
+
+    def _abandon(self, entry):
+        if entry[2].done():
+            # The slot was handed over just as the waiter gave up: pass it on
+            self.release()
+            return
+        entry[2].cancel()
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+
+    def release(self, service_time: float | None = None):
+        if service_time is not None:
+            self.avg_service_time = 0.9 * self.avg_service_time + 0.1 * service_time
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                self.admitted += 1
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = DEFAULT_PRIORITY, timeout: float | None = None):
+        await self.acquire(priority, timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queue_depth": len(self._queue),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": int(1000 * self.total_wait / self.admitted) if self.admitted else 0,
+            "max_wait_ms": int(1000 * self.max_wait),
+            "avg_service_ms": int(1000 * self.avg_service_time)
+        }
@@ -0,0 +1,2 @@
+# Offline benchmarks for the backend. Run from the Backend directory, e.g.
+# python -m benchmarks.checkpointer_memory
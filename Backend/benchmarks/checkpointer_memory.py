@@ -0,0 +1,97 @@
+# Memory footprint of MemorySaver vs the SQLite checkpointer
+
+# Drives a small graph (no LLM) with the same message shapes as the agent
+# through N synthetic threads and reports Python heap usage, checkpoint
+# rows and database size for each checkpointer.
+#
+# python -m benchmarks.checkpointer_memory --threads 10000 --turns 3
+
+import argparse
+import gc
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from langchain_core.messages import AIMessage
+from langgraph.graph import StateGraph, START, END, MessagesState
+from langgraph.checkpoint.memory import MemorySaver
+
+from checkpointer import CompactingSqliteSaver
+
+
+ANSWER = "Value Added Tax is charged on the supply of taxable goods and services. " * 8
+
+
+def build_graph(checkpointer):
+    def answer(state: MessagesState):
+        return {"messages": [AIMessage(content=ANSWER)]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("answer", answer)
+    builder.add_edge(START, "answer")
+    builder.add_edge("answer", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def drive(graph, threads: int, turns: int):
+    for t in range(threads):
+        config = {"configurable": {"thread_id": f"thread-{t}"}}
+        for turn in range(turns):
+            graph.invoke({"messages": [("user", f"Question {turn} on thread {t} about VAT")]}, config)
+
+
+def measure(name: str, make_saver, threads: int, turns: int):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    saver = make_saver()
+    drive(build_graph(saver), threads, turns)
+    elapsed = time.perf_counter() - start
+
+    extra = {}
+    if isinstance(saver, CompactingSqliteSaver):
+        with saver.cursor(transaction=False) as cur:
+            extra["rows_before_compaction"] = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        saver.compact()
+        with saver.cursor(transaction=False) as cur:
+            extra["rows_after_compaction"] = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:8} heap={current / 1e6:8.1f} MB  peak={peak / 1e6:8.1f} MB  time={elapsed:6.1f}s  {extra}")
+    return saver
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--keep-last", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.turns} turns")
+    measure("memory", MemorySaver, args.threads, args.turns)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "checkpoints.sqlite")
+        saver = measure(
+            "sqlite",
+            lambda: CompactingSqliteSaver(
+                sqlite3.connect(path, check_same_thread=False),
+                keep_last=args.keep_last
+            ),
+            args.threads,
+            args.turns
+        )
+        saver.conn.execute("VACUUM")
+        saver.conn.close()
+        print(f"sqlite file={os.path.getsize(path) / 1e6:.1f} MB (after compaction and VACUUM)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Database concurrency check
+
+# Calls the signup, login and chat persistence code paths of tax_app from N
+# concurrent tasks on one event loop, each operation with its own async
+# session from get_async_db(), and reports throughput, latency and errors per
+# operation as N grows. Database waits are awaited on the loop, so N can go
+# well past the size of the threadpool; only bcrypt runs in worker threads.
+#
+# Runs against a temporary SQLite database by default, or the database
+# configured in .env (DB_BACKEND, e.g. MySQL on aiomysql) with --configured.
+#
+# python -m benchmarks.db_concurrency --workers 1 16 256 1024 --ops 5
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import jwt
+
+from benchmarks.loadtest import percentile
+from benchmarks.offline import install_offline_agent, local_database
+
+
+CITATIONS = [
+    {"source_path": "synthetic/vat_act.pdf", "page_number": p, "document_type": "acts"} for p in (15, 17, 30)
+]
+
+
+def load_app(configured: bool):
+    workdir = tempfile.mkdtemp(prefix="tax-rag-db-")
+    os.environ.setdefault("secret_key", "offline-benchmark-secret")
+    if not configured:
+        local_database(os.path.join(workdir, "tax.sqlite"))
+    install_offline_agent(workdir)
+
+    import tax_app
+    return tax_app
+
+
+async def run_level(tax_app, workers: int, ops: int) -> dict:
+    session = asynccontextmanager(tax_app.get_async_db)
+    password = "concurrency-pw"
+    samples = {"signup": [], "login": [], "persist": []}
+    errors = {name: 0 for name in samples}
+
+    async def timed(name, fn):
+        start = time.perf_counter()
+        try:
+            async with session() as db:
+                result = await fn(db)
+        except Exception as e:
+            errors[name] += 1
+            print(f"  {name} error: {e}")
+            return None
+        samples[name].append((time.perf_counter() - start) * 1000)
+        return result
+
+    async def persist(db, user_id: int, i: int):
+        await db.run_sync(tax_app.write_turns, [tax_app.turn_record(
+            user_id, f"thread-{i}", "What is the VAT rate?", "VAT is 7.5 percent.", CITATIONS, 1200, {}
+        )])
+        await db.commit()
+
+    async def worker(w: int):
+        for i in range(ops):
+            email = f"db-{w}-{i}-{uuid.uuid4().hex[:8]}@example.com"
+            await timed("signup", lambda db: tax_app.signup(tax_app.RegDetails(
+                name=f"Worker {w}", email=email, password=password, userType="taxpayer", gender="male"
+            ), db=db))
+            login = await timed("login", lambda db: tax_app.login(
+                tax_app.LoginRequest(email=email, password=password), db=db
+            ))
+            user_id = jwt.decode(login["token"], options={"verify_signature": False})["user_id"] if login else 1
+            await timed("persist", lambda db: persist(db, user_id, i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(workers)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        name: {
+            "ops": len(values),
+            "errors": errors[name],
+            "ops_per_s": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+        }
+        for name, values in samples.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 16, 256, 1024], help="concurrent tasks")
+    parser.add_argument("--ops", type=int, default=10, help="signup/login/persist rounds per worker")
+    parser.add_argument("--configured", action="store_true", help="use the database configured in .env")
+    args = parser.parse_args()
+
+    tax_app = load_app(args.configured)
+
+    # One event loop for every level: the async pool's connections belong to it
+    async def run_levels():
+        try:
+            for workers in args.workers:
+                result = await run_level(tax_app, workers, args.ops)
+                print(f"workers={workers:4}  " + "  ".join(
+                    f"{name}: {r['ops_per_s']:7.1f}/s p50={r['p50_ms']:7.1f}ms p95={r['p95_ms']:7.1f}ms "
+                    f"errors={r['errors']}"
+                    for name, r in result.items()
+                ))
+        finally:
+            await tax_app.async_engine.dispose()
+
+    asyncio.run(run_levels())
+
+if __name__ == "__main__":
+    main()
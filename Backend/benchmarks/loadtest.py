@@ -0,0 +1,176 @@
+# Load test for the FastAPI service
+
+# Runs tax_app.app in-process (see benchmarks/offline.py: fake LLM and
+# embeddings, seeded temp Chroma, temp SQLite database) and drives it
+# with scripted virtual users:
+#
+#   signup -> login -> multi-turn /query chat -> /session fetch
+#
+# at increasing concurrency. Throughput, p50/p95/p99 latency and error rate
+# are reported per endpoint and written as JSON for comparison across commits.
+#
+# python -m benchmarks.loadtest --concurrency 1 4 16 --sessions 5 --output loadtest.json
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+
+from benchmarks.offline import BACKEND_DIR, load_offline_app
+
+
+# One conversation per virtual user session; identical first turns across
+# users exercise request coalescing the way popular questions do in production.
+CONVERSATIONS = [
+    ["What is the VAT rate in Nigeria?", "Which goods are exempt from it?", "When are VAT returns due?"],
+    ["How are companies taxed?", "What do small companies pay?", "Explain it in Pidgin"],
+    ["What is the consolidated relief allowance?", "How is personal income tax charged?"],
+    ["What does the Nigeria Tax Administration Bill do?", "Who replaces FIRS under the reform?"],
+    ["Compare the current VAT sharing with the proposed derivation formula",
+     "What is the impact on my state?"],
+    ["Define withholding tax", "Which payments attract it?", "What are the penalties for not remitting?"],
+]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)  # endpoint -> [(latency_s, ok)]
+
+    async def call(self, client, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.samples[endpoint].append((time.perf_counter() - start, ok))
+        return response if ok else None
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [s[0] * 1000 for s in samples]
+            errors = sum(1 for s in samples if not s[1])
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50), 1),
+                "p95_ms": round(percentile(latencies, 95), 1),
+                "p99_ms": round(percentile(latencies, 99), 1),
+                "max_ms": round(max(latencies), 1),
+            }
+        return endpoints
+
+
+async def virtual_user(client, recorder: Recorder, worker: int, sessions: int, password: str):
+    email = f"load-{worker}-{uuid.uuid4().hex[:8]}@example.com"
+    user = {"name": f"Load {worker}", "email": email, "password": password,
+            "userType": "taxpayer", "gender": "female"}
+
+    if await recorder.call(client, "POST /signup", "POST", "/signup", json=user) is None:
+        return
+    login = await recorder.call(client, "POST /login", "POST", "/login",
+                                json={"email": email, "password": password})
+    if login is None:
+        return
+    headers = {"Authorization": f"Bearer {login.json()['token']}"}
+
+    for s in range(sessions):
+        conversation = CONVERSATIONS[(worker + s) % len(CONVERSATIONS)]
+        thread_id = f"load-{worker}-{s}"
+        for question in conversation:
+            await recorder.call(client, "POST /query", "POST", "/query", headers=headers,
+                                json={"question": question, "thread_id": thread_id})
+        await recorder.call(client, "GET /session/{thread_id}", "GET", f"/session/{thread_id}", headers=headers)
+
+
+async def run_level(app, concurrency: int, sessions: int, password: str) -> dict:
+    import httpx
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_user(client, recorder, worker, sessions, password) for worker in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    total = sum(len(s) for s in recorder.samples.values())
+    errors = sum(1 for s in recorder.samples.values() for x in s if not x[1])
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "endpoints": recorder.report(elapsed),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--sessions", type=int, default=3, help="chat sessions per virtual user")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--embed-latency-ms", type=float, default=20)
+    parser.add_argument("--output", default="loadtest.json")
+    args = parser.parse_args()
+
+    tax_app = load_offline_app(llm_latency_ms=args.llm_latency_ms, embed_latency_ms=args.embed_latency_ms)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "levels": [],
+    }
+    # One event loop for every level: the async database pool belongs to it
+    async def run_levels():
+        try:
+            for concurrency in args.concurrency:
+                level = await run_level(tax_app.app, concurrency, args.sessions, "load-test-pw")
+                results["levels"].append(level)
+
+                print(f"\nconcurrency={concurrency}  {level['throughput_rps']} req/s  "
+                      f"errors={level['error_rate']:.1%}  elapsed={level['elapsed_s']}s")
+                for endpoint, r in level["endpoints"].items():
+                    print(f"  {endpoint:24} n={r['requests']:5}  p50={r['p50_ms']:8.1f}  p95={r['p95_ms']:8.1f}  "
+                          f"p99={r['p99_ms']:8.1f} ms  errors={r['error_rate']:.1%}")
+        finally:
+            # ASGITransport does not run the app's lifespan, which would do this
+            await tax_app.async_engine.dispose()
+
+    asyncio.run(run_levels())
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Lookup cost as the chat tables grow
+
+# Fills two SQLite databases with synthetic users, sessions, messages,
+# citations and query logs, one with the current tables but none of the
+# lookup indexes (migrations 2 and 3) and one fully migrated, and times the
+# hot read paths at each size:
+#
+#   session    chat_sessions row of (user_id, title), as write_turns looks it up
+#   page       newest /session page with its citations (session_store.fetch_session_page)
+#   logs       a user's most recent query logs
+#
+# Without the indexes every lookup scans its table and grows with it; with
+# them the cost stays roughly flat from thousands to millions of rows.
+#
+# python -m benchmarks.lookup_scaling --messages 10000 100000 1000000
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from benchmarks.loadtest import percentile
+from benchmarks.offline import local_database
+from migrations import MIGRATIONS, documents_table, initial_schema
+from session_store import fetch_session_page
+
+
+MESSAGES_PER_SESSION = 10
+SESSIONS_PER_USER = 10
+CITATIONS_PER_ANSWER = 2
+DOCUMENTS = 7
+
+
+def _session_of(message_id: int) -> int:
+    return (message_id - 1) // MESSAGES_PER_SESSION + 1
+
+
+def _user_of(session_id: int) -> int:
+    return (session_id - 1) // SESSIONS_PER_USER + 1
+
+
+def grow(engine, messages: int):
+    """Add rows until the database holds `messages` messages (and proportional other tables)."""
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        have = cur.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        sessions = max(1, messages // MESSAGES_PER_SESSION)
+        messages = sessions * MESSAGES_PER_SESSION
+        first_session = _session_of(have + 1) if have else 1
+
+        cur.executemany(
+            "INSERT INTO users (user_id, name, email, password, userType, gender) "
+            "VALUES (?, ?, ?, 'x', 'taxpayer', 'male')",
+            ((u, f"User {u}", f"user{u}@example.com")
+             for u in range(_user_of(_session_of(have)) + 1 if have else 1, _user_of(sessions) + 1))
+        )
+        cur.executemany(
+            "INSERT INTO chat_sessions (session_id, user_id, title) VALUES (?, ?, ?)",
+            ((s, _user_of(s), f"thread-{(s - 1) % SESSIONS_PER_USER}") for s in range(first_session, sessions + 1))
+        )
+        cur.executemany(
+            "INSERT INTO messages (message_id, session_id, role, content) VALUES (?, ?, ?, ?)",
+            ((m, _session_of(m), "user" if m % 2 else "assistant", f"message {m}") for m in range(have + 1, messages + 1))
+        )
+        answers = range(have + 2, messages + 1, 2)
+        cur.executemany(
+            "INSERT OR IGNORE INTO documents (document_id, source_path, document_type) VALUES (?, ?, 'acts')",
+            ((d + 1, f"synthetic/act_{d}.pdf") for d in range(DOCUMENTS))
+        )
+        cur.executemany(
+            "INSERT INTO citations (message_id, document_id, page_number) VALUES (?, ?, ?)",
+            ((m, m % DOCUMENTS + 1, c + 1) for m in answers for c in range(CITATIONS_PER_ANSWER))
+        )
+        cur.executemany(
+            "INSERT INTO query_logs (user_id, question, retrieved_docs, response_time_ms) VALUES (?, ?, 2, 1000)",
+            ((_user_of(_session_of(m)), f"question {m}") for m in answers)
+        )
+        raw.commit()
+        cur.execute("ANALYZE")
+    finally:
+        raw.close()
+
+
+def baseline_schema(engine):
+    """The current tables without the lookup indexes."""
+    with engine.begin() as conn:
+        initial_schema(conn)
+        documents_table(conn)
+
+
+def timed(fn, repeat: int) -> dict:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95)}
+
+
+def measure(engine, messages: int, repeat: int) -> dict:
+    users = max(1, messages // MESSAGES_PER_SESSION // SESSIONS_PER_USER)
+    rng = random.Random(0)
+    picks = [(rng.randint(1, users), f"thread-{rng.randrange(SESSIONS_PER_USER)}") for _ in range(repeat)]
+    it = iter(picks * 3)
+
+    with engine.connect() as db:
+        def session():
+            user_id, title = next(it)
+            db.execute(text("SELECT session_id FROM chat_sessions WHERE user_id = :u AND title = :t"),
+                       {"u": user_id, "t": title}).fetchall()
+
+        def page():
+            user_id, title = next(it)
+            fetch_session_page(db, user_id, title)
+
+        def logs():
+            user_id, _ = next(it)
+            db.execute(text("""
+                SELECT log_id, question, response_time_ms, created_at FROM query_logs
+                WHERE user_id = :u ORDER BY created_at DESC LIMIT 20
+            """), {"u": user_id}).fetchall()
+
+        return {"session": timed(session, repeat), "page": timed(page, repeat), "logs": timed(logs, repeat)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=50, help="timed lookups per path and size")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tax-rag-lookup-")
+    head = f"v{MIGRATIONS[-1][0]}"
+    tax_database = local_database(os.path.join(workdir, head + ".sqlite"))
+    engines = {
+        "no-idx": tax_database.create_engines("sqlite", os.path.join(workdir, "no-idx.sqlite"))[0],
+        head: tax_database.engine,
+    }
+    baseline_schema(engines["no-idx"])
+
+    print(f"{'messages':>10} {'schema':6} " + " ".join(f"{p + ' p50/p95':>22}" for p in ("session", "page", "logs")))
+    for messages in sorted(args.messages):
+        for name, engine in engines.items():
+            grow(engine, messages)
+            r = measure(engine, messages, args.repeat)
+            print(f"{messages:>10} {name:6} " + " ".join(
+                f"{r[p]['p50_ms']:>9.2f}/{r[p]['p95_ms']:>8.2f} ms" for p in ("session", "page", "logs")
+            ))
+
+
+if __name__ == "__main__":
+    main()
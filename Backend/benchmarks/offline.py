@@ -0,0 +1,260 @@
+# Offline stand-ins for benchmarks
+
+# Lets tax_app.app run without OpenAI or MySQL:
+#
+#   FakeChatModel      chat model that calls one retrieval tool per turn and
+#                      answers from the tool output, after a simulated latency
+#   HashingEmbeddings  deterministic bag-of-words embeddings (no network)
+#   SAMPLE_DOCUMENTS   small synthetic tax corpus indexed into a temp Chroma
+#   local_database()   tax_database on its SQLite backend, in a temp file
+#
+# install_offline_agent() points rag_core at the fakes; load_offline_app()
+# also sets up the local database and imports tax_app. Both have to run
+# before anything else imports rag_core or tax_app.
+
+import importlib
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+# --------------------------------------------------
+# LLM
+# --------------------------------------------------
+class FakeChatModel(BaseChatModel):
+    """
+    Routing calls (tools bound, no tool result yet this turn) ask for one
+    retrieval tool; every other call answers from the latest tool output.
+    """
+
+    model_name: str = "fake-chat"
+    temperature: float = 0.0
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def get_num_tokens_from_messages(self, messages, tools=None) -> int:
+        return sum(len(str(m.content)) for m in messages) // 4
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tool_names=[t.name for t in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, tool_names=None, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        turn = []
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                question = msg.content
+                break
+            turn.append(msg)
+        else:
+            question = messages[-1].content if messages else ""
+
+        tool_results = [m.content for m in turn if isinstance(m, ToolMessage)]
+        if tool_names and not tool_results:
+            q = question.lower()
+            if q.startswith(("what is", "define", "explain")) and "retrieve_definitions" in tool_names:
+                name, args = "retrieve_definitions", {"term": question}
+            else:
+                name, args = "retrieve_documents", {"query": question}
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": name, "args": args, "id": f"call_{zlib.crc32(question.encode()):x}"}]
+            )
+        else:
+            source = tool_results[0] if tool_results else question
+            message = AIMessage(content=f"Based on the retrieved documents: {source[:600]}")
+
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": len(message.content) // 4 + 10,
+            "total_tokens": input_tokens + len(message.content) // 4 + 10,
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+# --------------------------------------------------
+# EMBEDDINGS
+# --------------------------------------------------
+class HashingEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: similar wording gives similar vectors."""
+
+    def __init__(self, size: int = 384, latency_ms: float = 0.0):
+        self.size = size
+        self.latency_ms = latency_ms
+
+    def _embed(self, text: str) -> list[float]:
+        vec = [0.0] * self.size
+        for word in _WORD.findall(text.lower()):
+            vec[zlib.crc32(word.encode()) % self.size] += 1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_query(self, text: str) -> list[float]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._embed(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._embed(t) for t in texts]
+
+
+# --------------------------------------------------
+# CORPUS
+# --------------------------------------------------
+def _doc(text: str, file: str, page: int, doc_type: str, category: str) -> Document:
+    return Document(page_content=text, metadata={
+        "category": category,
+        "type": doc_type,
+        "file": file,
+        "page": page,
+        "source_path": f"synthetic/{file}",
+        "creation_date": "2025-01-01T00:00:00",
+        "chunk_index": page,
+    })
+
+
+SAMPLE_DOCUMENTS = [
+    _doc("Value Added Tax is charged on the supply of goods and services in Nigeria. The standard rate of "
+         "VAT is 7.5 percent of the value of taxable supplies.", "finance_act_2019.pdf", 12, "acts", "primary_law"),
+    _doc("A taxable person whose turnover in a calendar year is below the small company threshold is not "
+         "required to register for VAT or to charge VAT on supplies.", "finance_act_2019.pdf", 13, "acts", "primary_law"),
+    _doc("Basic food items, medical and pharmaceutical products, educational books and materials are exempt "
+         "from Value Added Tax.", "vat_act.pdf", 30, "acts", "primary_law"),
+    _doc("Input VAT paid on goods and services used for taxable supplies may be deducted from output VAT "
+         "before remittance to the tax authority.", "vat_act.pdf", 17, "acts", "primary_law"),
+    _doc("VAT returns and remittances are due on or before the 21st day of the month following the month "
+         "of the transaction.", "vat_act.pdf", 15, "acts", "primary_law"),
+    _doc("Companies Income Tax is charged on the profits of companies. Small companies with turnover below "
+         "the threshold pay 0 percent, medium companies pay 20 percent and large companies pay 30 percent.",
+         "cita.pdf", 41, "acts", "primary_law"),
+    _doc("Tertiary education tax is charged on the assessable profit of companies incorporated in Nigeria.",
+         "cita.pdf", 55, "acts", "primary_law"),
+    _doc("Personal Income Tax is charged on the income of individuals at graduated rates after the "
+         "consolidated relief allowance has been deducted from gross income.", "pita.pdf", 8, "acts", "primary_law"),
+    _doc("The consolidated relief allowance is the higher of 200,000 naira or 1 percent of gross income, plus "
+         "20 percent of gross income.", "pita.pdf", 9, "acts", "primary_law"),
+    _doc("Withholding tax is deducted at source from payments such as rent, dividends, interest, royalties "
+         "and contract fees, and is credited against the recipient's final tax liability.",
+         "wht_regulations.pdf", 3, "executive_guidance", "executive_guidance"),
+    _doc("Capital gains tax is charged at 10 percent on chargeable gains arising from the disposal of assets.",
+         "cgta.pdf", 2, "acts", "primary_law"),
+    _doc("The Nigeria Tax Bill consolidates the principal tax laws into a single statute and harmonises the "
+         "definitions used across income tax, VAT and stamp duties.", "nigeria_tax_bill.pdf", 1, "bills", "primary_law"),
+    _doc("The Nigeria Tax Administration Bill sets common rules for registration, filing, assessment, "
+         "collection and enforcement across federal, state and local tax authorities.",
+         "tax_administration_bill.pdf", 4, "bills", "primary_law"),
+    _doc("The Nigeria Revenue Service Bill replaces the Federal Inland Revenue Service with the Nigeria "
+         "Revenue Service as the federal tax authority.", "nrs_bill.pdf", 2, "bills", "primary_law"),
+    _doc("The Joint Revenue Board Bill establishes a board of federal and state tax authorities, a tax "
+         "appeal tribunal and an office of the tax ombudsman.", "jrb_bill.pdf", 3, "bills", "primary_law"),
+    _doc("Under the reform bills the VAT rate is proposed to rise gradually, while basic food, education "
+         "and health remain exempt or zero-rated.", "reform_analysis.pdf", 6, "analysis", "analysis"),
+    _doc("The reform proposes a new VAT sharing formula that weights derivation more heavily, so states "
+         "where consumption happens receive a larger share.", "reform_analysis.pdf", 9, "analysis", "analysis"),
+    _doc("Low income earners below the proposed threshold would be exempt from personal income tax under "
+         "the reform bills.", "reform_analysis.pdf", 11, "analysis", "analysis"),
+    _doc("A tax identification number is required to open a corporate bank account and is used for all "
+         "filings with the tax authority.", "tin_guidance.pdf", 1, "executive_guidance", "executive_guidance"),
+    _doc("Penalties apply for late filing of returns and for failure to deduct or remit withholding tax, "
+         "together with interest at the prevailing monetary policy rate.", "penalties_circular.pdf", 2,
+         "executive_guidance", "executive_guidance"),
+    _doc("Stamp duties are charged on instruments such as agreements, receipts and electronic transfers "
+         "above the prescribed threshold.", "stamp_duties_act.pdf", 5, "acts", "primary_law"),
+    _doc("The development levy proposed in the reform consolidates tertiary education tax and other levies "
+         "into a single charge on company profits.", "reform_analysis.pdf", 14, "analysis", "analysis"),
+]
+
+
+def seed_vectorstore(persist_dir: str, embeddings: Embeddings, documents=SAMPLE_DOCUMENTS):
+    from langchain_chroma import Chroma
+
+    store = Chroma(
+        collection_name="Tax_agentic_rag_docs",
+        persist_directory=persist_dir,
+        embedding_function=embeddings
+    )
+    store.add_documents(documents)
+    return store
+
+
+# --------------------------------------------------
+# DATABASE
+# --------------------------------------------------
+def local_database(path: str, schema_version: int | None = None):
+    """
+    Point tax_database at a SQLite file (DB_BACKEND=sqlite) and migrate it up
+    to schema_version (default: all migrations). Returns the module.
+    """
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = path
+    if "tax_database" in sys.modules:
+        tax_database = importlib.reload(sys.modules["tax_database"])
+    else:
+        tax_database = importlib.import_module("tax_database")
+
+    from migrations import migrate
+
+    migrate(tax_database.engine, target=schema_version)
+    return tax_database
+
+
+# --------------------------------------------------
+# APP
+# --------------------------------------------------
+def install_offline_agent(workdir: str, llm_latency_ms: float = 0.0, embed_latency_ms: float = 0.0) -> str:
+    """
+    Make rag_core build TaxRAGAgent with the fake LLM, fake embeddings and a
+    seeded Chroma collection under workdir. Returns the Chroma directory.
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+    import rag_core
+    from langchain_chroma import Chroma
+
+    chroma_dir = os.path.join(workdir, "chroma")
+    seed_vectorstore(chroma_dir, HashingEmbeddings())
+
+    rag_core.ChatOpenAI = lambda model, temperature, api_key=None, **client_options: FakeChatModel(
+        model_name=model, temperature=temperature, latency_ms=llm_latency_ms
+    )
+    rag_core.OpenAIEmbeddings = lambda model=None, api_key=None: HashingEmbeddings(latency_ms=embed_latency_ms)
+    rag_core.Chroma = lambda **kwargs: Chroma(**{**kwargs, "persist_directory": chroma_dir})
+    return chroma_dir
+
+
+def load_offline_app(workdir: str | None = None, llm_latency_ms: float = 0.0, embed_latency_ms: float = 0.0):
+    """Import tax_app with the fake LLM, fake embeddings, a seeded temp Chroma and SQLite."""
+    if "tax_app" in sys.modules or "rag_core" in sys.modules:
+        raise RuntimeError("load_offline_app() must run before rag_core or tax_app is imported")
+
+    workdir = workdir or tempfile.mkdtemp(prefix="tax-rag-offline-")
+    os.environ.setdefault("secret_key", "offline-benchmark-secret")
+
+    local_database(os.path.join(workdir, "tax.sqlite"))
+    install_offline_agent(workdir, llm_latency_ms, embed_latency_ms)
+
+    import tax_app
+    return tax_app
@@ -0,0 +1,236 @@
+# Retrieval quality and latency benchmark
+
+# Runs every retrieval tool of TaxRAGAgent (retrieve_documents,
+# retrieve_by_authority, retrieve_recent_documents, retrieve_definitions)
+# over a versioned golden question set and reports, per engine and tool:
+#
+#   recall@k            share of expected sources found in the tool's results
+#   MRR                 mean reciprocal rank of the first expected source
+#   p50/p95/p99 latency
+#   context tokens      size of the content the tool hands to the LLM
+#
+# Engines are swapped in as the agent's vector store, so the tools run
+# unchanged on each of them:
+#
+#   vector   the Chroma collection (as built by build_index.py)
+#   keyword  BM25 over the same chunks
+#   hybrid   reciprocal rank fusion of vector and keyword
+#
+# Offline (default): the sample corpus from benchmarks/offline.py with hashed
+# embeddings. Against the real index, with OPENAI_API_KEY set and a golden
+# set written for the real documents:
+#
+# python -m benchmarks.retrieval --index chroma_db_agentic_tax_rag --golden my_golden.json
+
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+from collections import Counter
+
+from langchain_core.documents import Document
+from langchain_core.messages import ToolMessage
+from langchain_core.vectorstores import VectorStore
+
+from benchmarks.loadtest import git_commit, percentile
+from benchmarks.offline import install_offline_agent
+from extractive import tokenize
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+DEFAULT_GOLDEN = os.path.join(GOLDEN_DIR, "sample_corpus_v1.json")
+
+RETRIEVAL_TOOLS = ["retrieve_documents", "retrieve_by_authority", "retrieve_recent_documents", "retrieve_definitions"]
+
+
+def _matches(metadata: dict, where: dict | None) -> bool:
+    """The subset of Chroma's metadata filter syntax the tools use."""
+    if not where:
+        return True
+    for key, value in where.items():
+        if key == "$or":
+            if not any(_matches(metadata, w) for w in value):
+                return False
+        elif key == "$and":
+            if not all(_matches(metadata, w) for w in value):
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+class KeywordStore(VectorStore):
+    """BM25 over an in-memory list of chunks."""
+
+    def __init__(self, documents: list[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.terms = [Counter(tokenize(d.page_content)) for d in documents]
+        self.lengths = [sum(t.values()) for t in self.terms]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if documents else 0
+        df = Counter(term for t in self.terms for term in t)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - f + 0.5) / (f + 0.5)) for term, f in df.items()}
+
+    @classmethod
+    def from_texts(cls, texts, embedding=None, metadatas=None, **kwargs):
+        metadatas = metadatas or [{}] * len(texts)
+        return cls([Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)])
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> list[Document]:
+        query_terms = set(tokenize(query))
+        scored = []
+        for i, doc in enumerate(self.documents):
+            if not _matches(doc.metadata, filter):
+                continue
+            terms = self.terms[i]
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avg_length or 1))
+            score = sum(
+                self.idf[t] * terms[t] * (self.k1 + 1) / (terms[t] + norm)
+                for t in query_terms if t in terms
+            )
+            if score > 0:
+                scored.append((score, i))
+        scored.sort(reverse=True)
+        return [self.documents[i] for _, i in scored[:k]]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, filter: dict | None = None, **kwargs):
+        return self.similarity_search(query, k=k, filter=filter)
+
+
+class HybridStore(VectorStore):
+    """Reciprocal rank fusion of several stores."""
+
+    def __init__(self, stores: list[VectorStore], rrf_k: int = 60):
+        self.stores = stores
+        self.rrf_k = rrf_k
+
+    @classmethod
+    def from_texts(cls, texts, embedding=None, metadatas=None, **kwargs):
+        raise NotImplementedError("Build HybridStore from existing stores")
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> list[Document]:
+        scores = {}
+        docs = {}
+        for store in self.stores:
+            found = store.similarity_search(query, k=k * 2, filter=filter) if filter else \
+                store.similarity_search(query, k=k * 2)
+            for rank, doc in enumerate(found):
+                key = (doc.metadata.get("source_path"), doc.metadata.get("page"), doc.page_content)
+                docs[key] = doc
+                scores[key] = scores.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [docs[key] for key in best]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, filter: dict | None = None, **kwargs):
+        return self.similarity_search(query, k=k, filter=filter)
+
+
+def build_engines(vectorstore) -> dict:
+    found = vectorstore.get(include=["documents", "metadatas"])
+    chunks = [Document(page_content=t, metadata=m or {}) for t, m in zip(found["documents"], found["metadatas"])]
+    keyword = KeywordStore(chunks)
+    return {
+        "vector": vectorstore,
+        "keyword": keyword,
+        "hybrid": HybridStore([vectorstore, keyword]),
+    }
+
+
+def _relevant(citation: dict, expected: dict) -> bool:
+    if os.path.basename(citation.get("source_path") or "") != expected["file"]:
+        return False
+    return expected.get("page") is None or citation.get("page_number") == expected["page"]
+
+
+def run_tool(agent, tool_, golden: dict, repeat: int) -> dict:
+    latencies, tokens = [], []
+    recalls, reciprocal_ranks = [], []
+    k = 0
+    per_question = {}
+
+    for q in golden["questions"]:
+        args = {"term": q.get("term") or q["question"]} if tool_.name == "retrieve_definitions" \
+            else {"query": q["question"]}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = tool_.invoke(args)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        citations = result.get("citations", [])
+        k = max(k, len(citations))
+        tokens.append(agent._count_tokens([ToolMessage(content=result.get("content", ""), tool_call_id="bench")]))
+
+        found = [e for e in q["expected"] if any(_relevant(c, e) for c in citations)]
+        rank = next((i + 1 for i, c in enumerate(citations) if any(_relevant(c, e) for e in q["expected"])), None)
+        recalls.append(len(found) / len(q["expected"]))
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        per_question[q["id"]] = {"rank": rank, "recall": round(recalls[-1], 3)}
+
+    n = len(golden["questions"])
+    return {
+        "k": k,
+        "recall_at_k": round(sum(recalls) / n, 3),
+        "mrr": round(sum(reciprocal_ranks) / n, 3),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "avg_context_tokens": round(sum(tokens) / n, 1),
+        "questions": per_question,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--golden", default=DEFAULT_GOLDEN)
+    parser.add_argument("--index", help="Chroma directory built by build_index.py (needs OPENAI_API_KEY)")
+    parser.add_argument("--engines", nargs="+", default=["vector", "keyword", "hybrid"])
+    parser.add_argument("--tools", nargs="+", default=RETRIEVAL_TOOLS)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per question")
+    parser.add_argument("--output", default="retrieval_benchmark.json")
+    args = parser.parse_args()
+
+    with open(args.golden, encoding="utf-8") as f:
+        golden = json.load(f)
+
+    if args.index:
+        chroma_dir = args.index
+    else:
+        chroma_dir = install_offline_agent(tempfile.mkdtemp(prefix="tax-rag-retrieval-"))
+
+    from rag_core import TaxRAGAgent
+
+    agent = TaxRAGAgent(chroma_dir=chroma_dir)
+    engines = build_engines(agent.vectorstore)
+    tools = {t.name: t for t in agent.tools}
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "golden": {"name": golden["name"], "version": golden["version"], "questions": len(golden["questions"])},
+        "index": args.index or "offline sample corpus",
+        "results": [],
+    }
+
+    print(f"{golden['name']} v{golden['version']}: {len(golden['questions'])} questions, index={results['index']}")
+    print(f"{'engine':8} {'tool':26} {'k':>2} {'recall@k':>8} {'MRR':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'tokens':>7}")
+    for engine in args.engines:
+        agent.vectorstore = engines[engine]
+        for name in args.tools:
+            r = run_tool(agent, tools[name], golden, args.repeat)
+            results["results"].append({"engine": engine, "tool": name, **r})
+            print(f"{engine:8} {name:26} {r['k']:>2} {r['recall_at_k']:>8.3f} {r['mrr']:>6.3f} "
+                  f"{r['p50_ms']:>6.1f}ms {r['p95_ms']:>6.1f}ms {r['p99_ms']:>6.1f}ms {r['avg_context_tokens']:>7.0f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
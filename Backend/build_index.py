@@ -14,6 +14,9 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
+from tax_database import engine
+from migrations import migrate
+from documents import upsert_documents
 
 # Load API key
 load_dotenv()
@@ -100,6 +103,24 @@ class TaxIndexBuilder:
         print(f"Index built with {len(chunks)} chunks")
         print(f"Persisted to: {self.persist_dir}")
 
+        self.register_documents()
+
+    def register_documents(self):
+        # One documents row per PDF; citations reference it by document_id
+        documents = {}
+        for page in self.all_pages:
+            meta = page.metadata
+            documents[meta["source_path"]] = {
+                "source_path": meta["source_path"],
+                "document_type": meta["type"],
+                "document_date": meta["creation_date"],
+            }
+
+        migrate(engine)
+        with engine.begin() as conn:
+            upsert_documents(conn, list(documents.values()))
+        print(f"Registered {len(documents)} documents")
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+# Checkpointer selection for the agent graph
+
+# MemorySaver (default) keeps every checkpoint in the process heap.
+# The SQLite option keeps them in a local file, trims old checkpoints
+# and evicts idle threads in a background job.
+
+import os
+import sqlite3
+import threading
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+CHECKPOINTER = os.getenv("CHECKPOINTER", "memory")  # "memory" or "sqlite"
+CHECKPOINT_DB = os.getenv(
+    "CHECKPOINT_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints.sqlite")
+)
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", 2))
+THREAD_TTL_SECONDS = int(os.getenv("THREAD_TTL_SECONDS", 7 * 24 * 3600))
+COMPACTION_INTERVAL = int(os.getenv("COMPACTION_INTERVAL", 300))
+
+
+class CompactingSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver that records per-thread activity so old checkpoints
+    and idle threads can be removed.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, keep_last: int = CHECKPOINT_KEEP_LAST,
+                 thread_ttl: int = THREAD_TTL_SECONDS):
+        super().__init__(conn)
+        self.keep_last = max(1, keep_last)
+        self.thread_ttl = thread_ttl
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript("""
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                last_active REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_thread_activity_last_active
+                ON thread_activity (last_active);
+        """)
+        # Threads checkpointed before activity was tracked: their TTL starts now
+        self.conn.execute(
+            "INSERT OR IGNORE INTO thread_activity (thread_id, last_active) SELECT DISTINCT thread_id, ? FROM checkpoints",
+            (time.time(),)
+        )
+        self.conn.commit()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, last_active) VALUES (?, ?)",
+                (str(config["configurable"]["thread_id"]), time.time())
+            )
+        return saved
+
+    def compact(self) -> int:
+        """Keep only the latest `keep_last` checkpoints per thread. Returns rows deleted."""
+        with self.cursor() as cur:
+            cur.execute("""
+                DELETE FROM checkpoints
+                WHERE (thread_id, checkpoint_ns, checkpoint_id) IN (
+                    SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+                        SELECT thread_id, checkpoint_ns, checkpoint_id,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY thread_id, checkpoint_ns
+                                   ORDER BY checkpoint_id DESC
+                               ) AS rn
+                        FROM checkpoints
+                    ) WHERE rn > ?
+                )
+            """, (self.keep_last,))
+            deleted = cur.rowcount
+
+            cur.execute("""
+                DELETE FROM writes
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                      AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id
+                )
+            """)
+        return deleted
+
+    def evict_idle(self) -> int:
+        """Delete threads idle for longer than `thread_ttl`. Returns threads evicted."""
+        cutoff = time.time() - self.thread_ttl
+        with self.cursor() as cur:
+            cur.execute(
+                "SELECT thread_id FROM thread_activity WHERE last_active < ?",
+                (cutoff,)
+            )
+            idle = [row[0] for row in cur.fetchall()]
+            for thread_id in idle:
+                cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+        return len(idle)
+
+    def delete_thread(self, thread_id: str):
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+
+def start_compaction(saver: CompactingSqliteSaver, interval: int = COMPACTION_INTERVAL):
+    """Run compaction and idle eviction every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                deleted = saver.compact()
+                evicted = saver.evict_idle()
+                if deleted or evicted:
+                    print(f"Checkpoint compaction: {deleted} checkpoints removed, {evicted} idle threads evicted")
+            except Exception as e:
+                print(f"Checkpoint compaction error: {e}")
+
+    threading.Thread(target=loop, name="checkpoint-compaction", daemon=True).start()
+    return stop
+
+
+def build_checkpointer(kind: str = CHECKPOINTER, path: str = CHECKPOINT_DB):
+    """Create the checkpointer selected by the CHECKPOINTER setting."""
+    if kind == "sqlite":
+        # check_same_thread=False is safe: SqliteSaver serializes access with a lock
+        conn = sqlite3.connect(path, check_same_thread=False)
+        saver = CompactingSqliteSaver(conn)
+        saver.setup()
+        if COMPACTION_INTERVAL > 0:
+            saver.compaction_stop = start_compaction(saver)
+        return saver
+
+    if kind != "memory":
+        raise ValueError(f"Unknown CHECKPOINTER '{kind}' (expected 'memory' or 'sqlite')")
+    return MemorySaver()
+
+
+def checkpointer_stats(saver) -> dict:
+    """Thread and checkpoint counts held by the checkpointer."""
+    if isinstance(saver, CompactingSqliteSaver):
+        with saver.cursor(transaction=False) as cur:
+            threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+            checkpoints = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        return {"threads": threads, "checkpoints": checkpoints}
+    if isinstance(saver, MemorySaver):
+        return {
+            "threads": len(saver.storage),
+            "checkpoints": sum(len(c) for ns in saver.storage.values() for c in ns.values())
+        }
+    return {}
@@ -0,0 +1,73 @@
+# Circuit breaker for calls to the LLM provider
+
+# After FAILURE_THRESHOLD consecutive failures the breaker opens and calls are
+# refused for RESET_SECONDS. Then a single trial call is let through
+# (half-open); success closes the breaker, failure opens it again.
+
+import os
+import threading
+import time
+
+
+FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", 3))
+RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_seconds: float = RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"[circuit] {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    def call(self, fn):
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        try:
+            result = fn()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
@@ -0,0 +1,109 @@
+# Document dimension table
+
+# One documents row per indexed PDF (path, type, title, date). Citations
+# reference it by document_id instead of repeating the path and type on every
+# row. build_index.py registers the documents it indexes; the API resolves
+# citation paths to ids through a per-process cache and registers any path it
+# has not seen (e.g. an index built before the table existed).
+
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+
+def document_title(source_path: str) -> str:
+    return os.path.splitext(os.path.basename(source_path))[0].replace("_", " ")
+
+
+def _parse_date(value):
+    if not value or not isinstance(value, str):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def upsert_documents(conn, documents: list[dict]):
+    """Insert or refresh documents rows (source_path, document_type, title, document_date)."""
+    if not documents:
+        return
+    sqlite = conn.dialect.name == "sqlite"
+    conn.execute(text(
+        """
+        INSERT INTO documents (source_path, document_type, title, document_date)
+        VALUES (:source_path, :document_type, :title, :document_date)
+        ON CONFLICT (source_path) DO UPDATE SET
+            document_type = excluded.document_type,
+            title = excluded.title,
+            document_date = excluded.document_date
+        """ if sqlite else """
+        INSERT INTO documents (source_path, document_type, title, document_date)
+        VALUES (:source_path, :document_type, :title, :document_date)
+        ON DUPLICATE KEY UPDATE
+            document_type = VALUES(document_type),
+            title = VALUES(title),
+            document_date = VALUES(document_date)
+        """
+    ), [
+        {
+            "source_path": d["source_path"],
+            "document_type": d.get("document_type"),
+            "title": d.get("title") or document_title(d["source_path"]),
+            "document_date": _parse_date(d.get("document_date")),
+        }
+        for d in documents
+    ])
+
+
+class DocumentRegistry:
+    """Cached source_path -> document_id lookups."""
+
+    def __init__(self):
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, engine, sources: list[dict]) -> dict[str, int]:
+        """
+        document_id of each source_path in `sources` (citation dicts), registering
+        unknown paths first. Unknown paths are written and committed on their own
+        connection, so an id is only cached once its row exists for good.
+        """
+        paths = {s["source_path"]: s for s in sources if s.get("source_path")}
+        missing = [p for p in paths if p not in self._ids]
+        if missing:
+            with engine.begin() as conn:
+                found = self._load(conn, missing)
+                new = [p for p in missing if p not in found]
+                if new:
+                    upsert_documents(conn, [
+                        {
+                            "source_path": p,
+                            "document_type": paths[p].get("document_type"),
+                            "document_date": paths[p].get("creation_date"),
+                        }
+                        for p in new
+                    ])
+                    found.update(self._load(conn, new))
+            with self._lock:
+                self._ids.update(found)
+        return {p: self._ids[p] for p in paths}
+
+    @staticmethod
+    def _load(conn, paths: list[str]) -> dict[str, int]:
+        rows = conn.execute(text("""
+            SELECT document_id, source_path FROM documents WHERE source_path IN :paths
+        """).bindparams(bindparam("paths", expanding=True)), {"paths": paths}).fetchall()
+        return {r.source_path: r.document_id for r in rows}
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+    def __len__(self):
+        return len(self._ids)
+
+
+document_registry = DocumentRegistry()
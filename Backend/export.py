@@ -0,0 +1,164 @@
+# Bulk export of a user's conversation history
+
+# /export streams every chat_sessions -> messages -> citations row of a user
+# (optionally one thread, or a created_at range) as NDJSON or CSV. Sessions
+# are read in keyset pages of EXPORT_PAGE_SIZE (session_id > last seen), and
+# the messages of a page of sessions in keyset pages of their own, one query
+# per page ((session_id, message_id) > last seen). The connection goes back
+# to the pool before each page of messages is sent.
+# Memory holds at most two pages plus the output buffer, however long the
+# history, and a slow client never pins a pooled connection or keeps a read
+# transaction open. Output is sent in chunks of about
+# EXPORT_CHUNK_BYTES.
+#
+#   ndjson  one object per message, citations nested
+#   csv     one row per citation (one row with empty citation columns for
+#           messages without any)
+#
+# /export first waits for the user's turns still in the write-behind queue.
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+import metrics
+
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 1000))  # sessions or messages per query
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", 64 * 1024))  # response chunk size
+
+CSV_COLUMNS = [
+    "thread_id", "message_id", "role", "content", "created_at", "source_path", "page_number", "document_type"
+]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+exported_messages = metrics.registry.counter(
+    "export_messages_total", "Messages streamed by /export", ("format",)
+)
+
+
+def _isoformat(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+async def iter_messages(async_engine, user_id: int, thread_id: str | None = None,
+                        start: datetime | None = None, end: datetime | None = None,
+                        page_size: int = EXPORT_PAGE_SIZE):
+    """The user's messages, citations nested, one dict per message in (session, message) order."""
+    after_session = 0
+    while True:
+        async with async_engine.connect() as conn:
+            sessions = (await conn.execute(text(f"""
+                SELECT session_id, title FROM chat_sessions
+                WHERE user_id = :user_id AND session_id > :after
+                {"AND title = :thread_id" if thread_id is not None else ""}
+                ORDER BY session_id
+                LIMIT :limit
+            """), {"user_id": user_id, "after": after_session, "thread_id": thread_id, "limit": page_size})).fetchall()
+
+        # Messages of the whole page of sessions, keyset-paged on (session_id, message_id)
+        titles = {s.session_id: s.title for s in sessions}
+        after = (0, 0)
+        while titles:
+            async with async_engine.connect() as conn:
+                messages, after = await _message_page(conn, titles, after, start, end, page_size)
+            for message in messages:
+                yield message
+            if len(messages) < page_size:
+                break
+
+        if len(sessions) < page_size:
+            return
+        after_session = sessions[-1].session_id
+
+
+async def _message_page(conn, titles: dict[int, str], after: tuple[int, int], start, end,
+                        page_size: int) -> tuple[list[dict], tuple[int, int]]:
+    """
+    Up to page_size messages of the sessions in `titles` after (session_id, message_id)
+    `after`, with their citations. Returns the messages and the key of the last one.
+    """
+    rows = (await conn.execute(text(f"""
+        SELECT m.session_id, m.message_id, m.role, m.content, m.created_at,
+               c.citation_id, d.source_path, c.page_number, d.document_type
+        FROM (
+            SELECT session_id, message_id, role, content, created_at FROM messages
+            WHERE session_id IN :session_ids
+              AND (session_id > :after_session OR (session_id = :after_session AND message_id > :after_message))
+            {"AND created_at >= :start" if start else ""}
+            {"AND created_at < :end" if end else ""}
+            ORDER BY session_id, message_id
+            LIMIT :limit
+        ) m
+        LEFT JOIN citations c ON c.message_id = m.message_id
+        LEFT JOIN documents d ON d.document_id = c.document_id
+        ORDER BY m.session_id, m.message_id, c.citation_id
+    """).bindparams(bindparam("session_ids", expanding=True)), {
+        "session_ids": list(titles), "after_session": after[0], "after_message": after[1],
+        "start": start, "end": end, "limit": page_size
+    })).fetchall()
+
+    messages = []
+    for r in rows:
+        if not messages or messages[-1]["message_id"] != r.message_id:
+            messages.append({
+                "thread_id": titles[r.session_id],
+                "message_id": r.message_id,
+                "role": r.role,
+                "content": r.content,
+                "created_at": _isoformat(r.created_at),
+                "citations": [],
+            })
+            after = (r.session_id, r.message_id)
+        if r.citation_id is not None:
+            messages[-1]["citations"].append({
+                "source_path": r.source_path,
+                "page_number": r.page_number,
+                "document_type": r.document_type
+            })
+    return messages, after
+
+
+async def export_ndjson(messages, chunk_bytes: int = EXPORT_CHUNK_BYTES):
+    buffer = []
+    size = 0
+    async for message in messages:
+        line = json.dumps(message, ensure_ascii=False) + "\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            exported_messages.inc(len(buffer), format="ndjson")
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            size = 0
+    if buffer:
+        exported_messages.inc(len(buffer), format="ndjson")
+        yield "".join(buffer).encode("utf-8")
+
+
+async def export_csv(messages, chunk_bytes: int = EXPORT_CHUNK_BYTES):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    async for message in messages:
+        fields = [message[c] for c in CSV_COLUMNS[:5]]
+        for citation in message["citations"] or [{}]:
+            writer.writerow(fields + [citation.get(c) for c in CSV_COLUMNS[5:]])
+        count += 1
+        if buffer.tell() >= chunk_bytes:
+            exported_messages.inc(count, format="csv")
+            count = 0
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    exported_messages.inc(count, format="csv")
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+EXPORTERS = {"ndjson": export_ndjson, "csv": export_csv}
@@ -0,0 +1,87 @@
+# Extractive answers without the LLM
+
+# Picks the sentences from retrieved chunks that best match the question
+# using TF-IDF cosine similarity. Used as the low-latency /query mode and as
+# the fallback when the LLM is unavailable.
+
+import math
+import re
+from collections import Counter
+
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "by", "with", "is", "are",
+    "was", "were", "be", "been", "it", "its", "this", "that", "these", "those", "as", "at",
+    "from", "what", "which", "who", "whom", "how", "why", "when", "where", "does", "do", "did",
+    "can", "will", "shall", "may", "i", "my", "me", "we", "our", "you", "your", "about", "under",
+    "tell", "explain", "please", "there", "their", "they", "has", "have", "had", "not", "no",
+}
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?;])\s+|\n{2,}")
+_WORD = re.compile(r"[a-z0-9]+")
+
+MIN_SENTENCE_CHARS = 40
+MAX_SENTENCE_CHARS = 600
+
+
+def tokenize(text: str) -> list[str]:
+    return [w for w in _WORD.findall(text.lower()) if w not in STOPWORDS and len(w) > 1]
+
+
+def split_sentences(text: str) -> list[str]:
+    sentences = []
+    for part in _SENTENCE_SPLIT.split(text):
+        sentence = " ".join(part.split())
+        if MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS:
+            sentences.append(sentence)
+    return sentences
+
+
+def rank_sentences(question: str, chunks: list[str]) -> list[tuple[float, int, int, str]]:
+    """
+    Score every sentence of `chunks` against `question`.
+    Returns (score, chunk_index, sentence_index, sentence) sorted by score, best first.
+    """
+    candidates = []
+    for ci, chunk in enumerate(chunks):
+        for si, sentence in enumerate(split_sentences(chunk)):
+            candidates.append((ci, si, sentence, Counter(tokenize(sentence))))
+
+    query_terms = Counter(tokenize(question))
+    if not candidates or not query_terms:
+        return []
+
+    # Document frequency over candidate sentences
+    df = Counter()
+    for *_, terms in candidates:
+        df.update(terms.keys())
+    n = len(candidates)
+    idf = {term: math.log((n + 1) / (count + 1)) + 1 for term, count in df.items()}
+
+    def weights(terms):
+        return {t: (1 + math.log(c)) * idf.get(t, math.log(n + 1) + 1) for t, c in terms.items()}
+
+    q = weights(query_terms)
+    q_norm = math.sqrt(sum(v * v for v in q.values()))
+
+    ranked = []
+    for ci, si, sentence, terms in candidates:
+        w = weights(terms)
+        dot = sum(q[t] * w[t] for t in q if t in w)
+        if not dot:
+            continue
+        cosine = dot / (q_norm * math.sqrt(sum(v * v for v in w.values())))
+        # Retrieval order is a useful prior: earlier chunks are more relevant
+        ranked.append((cosine * (1 - 0.05 * ci), ci, si, sentence))
+
+    ranked.sort(key=lambda r: r[0], reverse=True)
+    return ranked
+
+
+def extract_answer(question: str, chunks: list[str], max_sentences: int = 4) -> str:
+    """Top sentences for the question, in their original reading order. Empty if nothing matches."""
+    top = rank_sentences(question, chunks)[:max_sentences]
+    if not top:
+        return ""
+    top.sort(key=lambda r: (r[1], r[2]))
+    return "\n".join(f"- {sentence}" for *_, sentence in top)
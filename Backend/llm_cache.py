@@ -0,0 +1,146 @@
+# Exact-prompt LLM response cache
+
+# Opt-in (LLM_CACHE=1). Responses are stored in a local SQLite file keyed by
+# a hash of (model, temperature, messages, tools). Only deterministic calls
+# (temperature 0) are cached unless LLM_CACHE_FORCE=1. Entries older than
+# LLM_CACHE_MAX_AGE_SECONDS are dropped, and the least recently used entries
+# are evicted once the store exceeds LLM_CACHE_MAX_MB.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.messages import BaseMessage, messages_to_dict, messages_from_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+LLM_CACHE = os.getenv("LLM_CACHE", "0") == "1"
+LLM_CACHE_FORCE = os.getenv("LLM_CACHE_FORCE", "0") == "1"
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.sqlite")
+)
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", 200))
+LLM_CACHE_MAX_AGE_SECONDS = int(os.getenv("LLM_CACHE_MAX_AGE_SECONDS", 7 * 24 * 3600))
+
+EVICT_EVERY = 100  # puts between eviction passes
+
+
+def _message_key(msg) -> list:
+    # Message and tool-call ids are random per run, so they are left out of the key
+    if not isinstance(msg, BaseMessage):
+        return ["human", str(msg)]
+    return [
+        msg.type,
+        msg.content,
+        [[c["name"], c["args"]] for c in getattr(msg, "tool_calls", None) or []],
+        getattr(msg, "name", None),
+    ]
+
+
+_tool_specs = {}  # id(tools list) -> (tools list, OpenAI tool schemas)
+
+
+def _tools_key(tools):
+    specs = _tool_specs.get(id(tools))
+    if specs is None or specs[0] is not tools:
+        specs = _tool_specs[id(tools)] = (tools, [convert_to_openai_tool(t) for t in tools])
+    return specs[1]
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, max_mb: float = LLM_CACHE_MAX_MB,
+                 max_age: int = LLM_CACHE_MAX_AGE_SECONDS, force: bool = LLM_CACHE_FORCE):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age
+        self.force = force
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit);
+        """)
+
+    def cacheable(self, llm) -> bool:
+        return self.force or not getattr(llm, "temperature", None)
+
+    @staticmethod
+    def key(model: str, temperature, prompt, tools=None) -> str:
+        messages = prompt if isinstance(prompt, list) else [prompt]
+        payload = {
+            "model": model,
+            "temperature": temperature,
+            "messages": [_message_key(m) for m in messages],
+            "tools": _tools_key(tools) if tools else None,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE llm_cache SET last_hit = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def put(self, key: str, message: BaseMessage):
+        value = json.dumps(messages_to_dict([message])[0], ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_hit) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self.conn.commit()
+            self._puts += 1
+            if self._puts % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under the size cap."""
+        self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.max_age,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            freed = 0
+            doomed = []
+            for key, size in self.conn.execute("SELECT key, size FROM llm_cache ORDER BY last_hit"):
+                doomed.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            self.conn.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+        self.conn.commit()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size_bytes": size}
@@ -0,0 +1,154 @@
+# Prometheus-style metrics
+
+# Small in-process registry rendered in the Prometheus text format by
+# GET /metrics. Counters and histograms are updated on the request path with a
+# lock and a few additions; gauges that describe other components (caches,
+# checkpointer, queues) are read from collector callbacks at scrape time only.
+
+import bisect
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, v in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, v):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {v[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {v[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {v[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """
+        Register fn() -> iterable of (name, type, help, [(labels dict, value), ...]),
+        called at scrape time.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+
+        for fn in self._collectors:
+            try:
+                families = list(fn())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, type_, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type_}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method")
+)
+stage_latency = registry.histogram(
+    "stage_duration_seconds", "Latency of request stages (retrieval, llm, embedding, multilingual, db_persist)",
+    ("stage",)
+)
+admission_wait = registry.histogram(
+    "admission_wait_seconds", "Time admitted /query requests waited for a slot, by priority", ("priority",)
+)
+
+# tracing span kind/name -> stage label
+_SPAN_STAGES = {"tool": "retrieval", "llm": "llm", "embedding": "embedding", "db": "db_persist"}
+
+
+def observe_trace(trace):
+    """Feed a finished trace's spans into the stage histogram."""
+    for s in trace.spans:
+        stage = "multilingual" if s.kind == "node" and s.name == "multilingual" else _SPAN_STAGES.get(s.kind)
+        if stage:
+            stage_latency.observe(s.duration_ms / 1000, stage=stage)
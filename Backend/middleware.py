@@ -4,9 +4,13 @@ import os
 from datetime import datetime, timedelta
 from fastapi import Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi import Security
+from fastapi import Security, Depends
 from jwt import ExpiredSignatureError, DecodeError
 from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from admins import is_admin
+from tax_database import get_async_db
 
 bearer = HTTPBearer()
 
@@ -64,3 +68,10 @@ def verify_token(request: HTTPAuthorizationCredentials = Security(bearer)):
         "userType": verified_token.get("userType"),
         "user_id": verified_token.get("user_id")
     }
+
+
+async def require_admin(user_data=Depends(verify_token), db: AsyncSession = Depends(get_async_db)):
+    # users.is_admin, not the userType claim: userType is whatever was sent to /signup
+    if not await is_admin(db, user_data["user_id"]):
+        raise HTTPException(status_code=403, detail="Admin users only")
+    return user_data
@@ -0,0 +1,321 @@
+# Versioned schema migrations
+
+# Each migration runs once, in order, and is recorded in schema_migrations.
+# Steps are written to be safe on databases that already have part of the
+# change (tables created by older releases, indexes added by hand), so the
+# first run on an existing database simply records what is already there.
+#
+# The app applies pending migrations at startup (DB_AUTO_MIGRATE=1); once the
+# schema is current that is a single SELECT. To run them by hand:
+#
+# python migrations.py
+
+import os
+
+from sqlalchemy import inspect, text
+
+from documents import document_title
+
+
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+
+INITIAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100),
+    email VARCHAR(100) UNIQUE,
+    password VARCHAR(100) NOT NULL,
+    userType VARCHAR(50) NOT NULL,
+    gender VARCHAR(10) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    title VARCHAR(150),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INT AUTO_INCREMENT PRIMARY KEY,
+    session_id INT,
+    role VARCHAR(20) CHECK (role IN ('user', 'assistant')),
+    content TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS citations (
+    citation_id INT AUTO_INCREMENT PRIMARY KEY,
+    message_id INT,
+    source_path TEXT,
+    page_number INT,
+    document_type VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (message_id) REFERENCES messages(message_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS query_logs (
+    log_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    question TEXT,
+    retrieved_docs INT,
+    response_time_ms INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+
+CREATE TABLE IF NOT EXISTS query_metrics (
+    metric_id INT AUTO_INCREMENT PRIMARY KEY,
+    log_id INT,
+    trace_id CHAR(32),
+    total_ms INT,
+    llm_ms INT,
+    llm_calls INT,
+    llm_cache_hits INT,
+    input_tokens INT,
+    output_tokens INT,
+    tool_ms INT,
+    tool_calls INT,
+    retrieved_chunks INT,
+    embedding_ms INT,
+    embedding_calls INT,
+    multilingual_ms INT,
+    db_ms INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (log_id) REFERENCES query_logs(log_id)
+);
+"""
+
+
+def _statements(sql: str):
+    return [s.strip() for s in sql.split(";") if s.strip()]
+
+
+def _has_index(conn, table: str, name: str) -> bool:
+    inspector = inspect(conn)
+    names = {i["name"] for i in inspector.get_indexes(table)}
+    names |= {u["name"] for u in inspector.get_unique_constraints(table)}
+    return name in names
+
+
+def _create_index(conn, name: str, table: str, columns: str, unique: bool = False):
+    if not _has_index(conn, table, name):
+        conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})"))
+
+
+# --------------------------------------------------
+# MIGRATIONS
+# --------------------------------------------------
+def initial_schema(conn):
+    for statement in _statements(INITIAL_SCHEMA):
+        if conn.dialect.name == "sqlite":
+            statement = statement.replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+        conn.execute(text(statement))
+
+
+def unique_chat_session(conn):
+    """One chat_sessions row per (user_id, title); the turn upserts rely on it."""
+    if _has_index(conn, "chat_sessions", "uq_chat_sessions_user_title"):
+        return
+    # Merge duplicates left by the old SELECT-then-INSERT into the oldest row
+    duplicates = """
+        SELECT s.session_id, MIN(k.session_id) AS keep_id
+        FROM chat_sessions s
+        JOIN chat_sessions k ON k.user_id = s.user_id AND k.title = s.title AND k.session_id < s.session_id
+        GROUP BY s.session_id
+    """
+    conn.execute(text(f"""
+        UPDATE messages SET session_id = (
+            SELECT d.keep_id FROM ({duplicates}) d WHERE d.session_id = messages.session_id
+        )
+        WHERE session_id IN (SELECT session_id FROM ({duplicates}) d2)
+    """))
+    conn.execute(text(f"""
+        DELETE FROM chat_sessions WHERE session_id IN (SELECT session_id FROM ({duplicates}) d)
+    """))
+    _create_index(conn, "uq_chat_sessions_user_title", "chat_sessions", "user_id, title", unique=True)
+
+
+def hot_lookup_indexes(conn):
+    """Indexes behind /session pages, citation loading and per-user query log scans."""
+    # Pages are read newest-first by message_id within a session
+    _create_index(conn, "idx_messages_session", "messages", "session_id, message_id")
+    _create_index(conn, "idx_citations_message", "citations", "message_id")
+    _create_index(conn, "idx_query_logs_user_created", "query_logs", "user_id, created_at")
+    _create_index(conn, "idx_query_metrics_log", "query_metrics", "log_id")
+
+
+def documents_table(conn):
+    """Citations reference a documents row instead of repeating source_path and document_type."""
+    sqlite = conn.dialect.name == "sqlite"
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS documents (
+            document_id {"INTEGER PRIMARY KEY AUTOINCREMENT" if sqlite else "INT AUTO_INCREMENT PRIMARY KEY"},
+            source_path VARCHAR(500) NOT NULL UNIQUE,
+            document_type VARCHAR(50),
+            title VARCHAR(255),
+            document_date DATETIME,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+    columns = {c["name"] for c in inspect(conn).get_columns("citations")}
+    if "document_id" not in columns:
+        conn.execute(text(
+            "ALTER TABLE citations ADD COLUMN document_id INT REFERENCES documents(document_id)" if sqlite else
+            "ALTER TABLE citations ADD COLUMN document_id INT, "
+            "ADD CONSTRAINT fk_citations_document FOREIGN KEY (document_id) REFERENCES documents(document_id)"
+        ))
+    if "source_path" not in columns:
+        return
+
+    # Existing citations: one documents row per distinct path, then point at it
+    conn.execute(text("""
+        INSERT INTO documents (source_path, document_type)
+        SELECT c.source_path, MAX(c.document_type) FROM citations c
+        WHERE c.source_path IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM documents d WHERE d.source_path = c.source_path)
+        GROUP BY c.source_path
+    """))
+    untitled = conn.execute(text("SELECT document_id, source_path FROM documents WHERE title IS NULL")).fetchall()
+    if untitled:
+        conn.execute(text("UPDATE documents SET title = :title WHERE document_id = :document_id"), [
+            {"title": document_title(r.source_path), "document_id": r.document_id} for r in untitled
+        ])
+    conn.execute(text("""
+        UPDATE citations SET document_id = (
+            SELECT d.document_id FROM documents d WHERE d.source_path = citations.source_path
+        )
+        WHERE document_id IS NULL AND source_path IS NOT NULL
+    """))
+    if sqlite:
+        conn.execute(text("ALTER TABLE citations DROP COLUMN source_path"))
+        conn.execute(text("ALTER TABLE citations DROP COLUMN document_type"))
+    else:
+        conn.execute(text("ALTER TABLE citations DROP COLUMN source_path, DROP COLUMN document_type"))
+
+
+def query_log_rollups(conn):
+    """Pre-aggregated query_logs buckets (rollups.py) and the log_id they are current to."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS query_log_rollups (
+            granularity VARCHAR(10) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            queries INT NOT NULL,
+            total_ms BIGINT NOT NULL,
+            max_ms INT NOT NULL,
+            latency_sketch TEXT NOT NULL,
+            retrieved_docs TEXT NOT NULL,
+            top_questions TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (granularity, bucket_start)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR(50) PRIMARY KEY,
+            last_log_id INT NOT NULL
+        )
+    """))
+    if conn.execute(text("SELECT COUNT(*) FROM rollup_state WHERE name = 'query_logs'")).scalar() == 0:
+        conn.execute(text("INSERT INTO rollup_state (name, last_log_id) VALUES ('query_logs', 0)"))
+
+
+def admin_flag(conn):
+    """
+    Admin rights as a users column only admins.py writes. Nobody is promoted:
+    userType is chosen freely at signup, so an existing 'admin' value proves nothing.
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns("users")}
+    if "is_admin" not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN NOT NULL DEFAULT 0"))
+
+
+def rollup_missing_ids(conn):
+    """log_ids below the rollup watermark that were not committed yet when it passed them."""
+    columns = {c["name"] for c in inspect(conn).get_columns("rollup_state")}
+    if "missing_log_ids" not in columns:
+        conn.execute(text("ALTER TABLE rollup_state ADD COLUMN missing_log_ids TEXT"))
+
+
+def rollup_missing_ids_mediumtext(conn):
+    """Room for missing-id ranges beyond TEXT's 64KB on MySQL (SQLite TEXT is unbounded)."""
+    if conn.dialect.name == "mysql":
+        conn.execute(text("ALTER TABLE rollup_state MODIFY missing_log_ids MEDIUMTEXT"))
+
+
+MIGRATIONS = [
+    (1, "initial schema", initial_schema),
+    (2, "unique (user_id, title) on chat_sessions", unique_chat_session),
+    (3, "indexes for hot lookups", hot_lookup_indexes),
+    (4, "documents table referenced by citations", documents_table),
+    (5, "query log rollups", query_log_rollups),
+    (6, "admin flag on users", admin_flag),
+    (7, "missing log ids in rollup state", rollup_missing_ids),
+    (8, "missing log ids as MEDIUMTEXT", rollup_missing_ids_mediumtext),
+]
+
+
+# --------------------------------------------------
+# RUNNER
+# --------------------------------------------------
+def current_version(conn) -> int:
+    if not inspect(conn).has_table("schema_migrations"):
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
+
+def migrate(engine, target: int | None = None) -> list[int]:
+    """Apply pending migrations up to `target` (default: all). Returns the versions applied."""
+    with engine.connect() as conn:
+        if current_version(conn) >= (target or MIGRATIONS[-1][0]):
+            return []
+
+    applied = []
+    with engine.connect() as conn:
+        mysql = conn.dialect.name == "mysql"
+        if mysql:
+            # Several app workers may start at once; one of them migrates
+            conn.execute(text("SELECT GET_LOCK('tax_rag_migrations', 120)"))
+        try:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(200) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.commit()
+
+            version = current_version(conn)
+            for number, name, step in MIGRATIONS:
+                if number <= version or (target and number > target):
+                    continue
+                print(f"Applying migration {number}: {name}")
+                step(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                    {"version": number, "name": name}
+                )
+                conn.commit()
+                applied.append(number)
+        finally:
+            if mysql:
+                conn.execute(text("SELECT RELEASE_LOCK('tax_rag_migrations')"))
+    return applied
+
+
+if __name__ == "__main__":
+    from tax_database import engine
+
+    applied = migrate(engine)
+    print(f"Applied migrations: {applied or 'none, schema is up to date'}")
@@ -0,0 +1,101 @@
+# Model tiering for the agent graph
+
+# Each LLM-calling step uses the "fast" or the "strong" model. Steps set to
+# "auto" use the tier picked per turn by classify_complexity(), which escalates
+# multi-document comparison questions to the strong model.
+#
+# Steps: routing (first assistant call, tool selection), synthesis (assistant
+# calls after tool results), fallback, summary, multilingual.
+
+import os
+import re
+import threading
+
+
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "gpt-4o")
+
+NODE_TIERS = {
+    "routing": "fast",
+    "synthesis": "auto",
+    "fallback": "fast",
+    "summary": "fast",
+    "multilingual": "fast",
+}
+
+# e.g. LLM_NODE_TIERS="synthesis=strong,fallback=auto"
+for _item in filter(None, os.getenv("LLM_NODE_TIERS", "").split(",")):
+    _node, _, _tier = _item.partition("=")
+    if _tier.strip() in ("fast", "strong", "auto"):
+        NODE_TIERS[_node.strip()] = _tier.strip()
+
+
+COMPARISON_PATTERNS = [re.compile(p) for p in (
+    r"\bcompar",
+    r"\bdiffer",
+    r"\bcontrast",
+    r"\bversus\b",
+    r"\bvs\.?\s",
+    r"\bderivation\b",
+    r"\b(old|previous|current|existing)\b.*\b(new|proposed|reform)",
+    r"\b(before|after)\b.*\breform",
+    r"\bimpact on (my |our |the )?states?\b",
+)]
+
+DOCUMENT_TERMS = [re.compile(p) for p in (
+    r"\bvat\b|value added tax",
+    r"\bpit\b|personal income tax",
+    r"\bcit\b|companies income tax",
+    r"\bfinance act\b",
+    r"\btax administration\b",
+    r"\brevenue service\b|\bfirs\b|\bnrs\b",
+    r"\bjoint revenue board\b",
+    r"\b(the )?(tax )?reform bills?\b",
+    r"\bconstitution\b",
+)]
+
+
+def classify_complexity(question: str) -> str:
+    """Return "strong" for multi-document comparison questions, otherwise "fast"."""
+    q = question.lower()
+    score = 0
+    if any(p.search(q) for p in COMPARISON_PATTERNS):
+        score += 2
+    if sum(1 for p in DOCUMENT_TERMS if p.search(q)) >= 2:
+        score += 1
+    if q.count("?") >= 2 or len(q.split()) > 60:
+        score += 1
+    return "strong" if score >= 2 else "fast"
+
+
+class TierStats:
+    """Per-tier call counts, latency and token usage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, tier: str, node: str, latency_ms: float, usage: dict | None):
+        usage = usage or {}
+        with self._lock:
+            s = self._stats.setdefault(tier, {
+                "calls": 0, "latency_ms": 0.0, "input_tokens": 0, "output_tokens": 0, "nodes": {}
+            })
+            s["calls"] += 1
+            s["latency_ms"] += latency_ms
+            s["input_tokens"] += usage.get("input_tokens", 0)
+            s["output_tokens"] += usage.get("output_tokens", 0)
+            s["nodes"][node] = s["nodes"].get(node, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                tier: {
+                    "calls": s["calls"],
+                    "avg_latency_ms": int(s["latency_ms"] / s["calls"]),
+                    "input_tokens": s["input_tokens"],
+                    "output_tokens": s["output_tokens"],
+                    "calls_by_node": dict(s["nodes"])
+                }
+                for tier, s in self._stats.items()
+            }
@@ -0,0 +1,119 @@
+# On-demand request profiling
+
+# A sampling profiler for single /query requests. Admins (users.is_admin,
+# see admins.py) turn it on per request with the "X-Profile: 1" header or
+# "?profile=1"; PROFILE_SAMPLE_RATE additionally profiles that fraction of all
+# /query traffic.
+#
+# Work for one request is spread over several threads (the request thread,
+# LangGraph node workers, tool and LLM workers). Every span opened under a
+# profiled trace registers its thread with the profiler, and a background
+# thread samples the stacks of exactly those threads every
+# PROFILE_INTERVAL_MS. Samples are wall-clock, so time spent waiting on the
+# network or a lock shows up too.
+#
+# Output is one file per request in PROFILE_DIR, in the collapsed-stack format
+# ("frame;frame;frame count" per line) read by flamegraph.pl and speedscope.
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # 0.01 = 1% of /query requests
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+
+def _frame_label(code) -> str:
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.sample_count = 0
+        self._threads = {}  # thread ident -> open spans on that thread
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enter(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def exit(self):
+        ident = threading.get_ident()
+        with self._lock:
+            if self._threads.get(ident, 0) <= 1:
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] -= 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                idents = list(self._threads)
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_request(trace, forced: bool = False):
+    """
+    Profile the request behind `trace` if forced or picked by PROFILE_SAMPLE_RATE.
+    Yields the output path, or None when the request is not profiled.
+    """
+    if not forced and random.random() >= PROFILE_SAMPLE_RATE:
+        yield None
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.trace_id}.collapsed")
+    profiler = SamplingProfiler()
+    trace.profiler = profiler
+    profiler.enter()
+    profiler.start()
+    try:
+        yield path
+    finally:
+        profiler.stop()
+        profiler.exit()
+        trace.profiler = None
+        trace.root.set(profile=path)
+        try:
+            profiler.write(path)
+            print(f"Profile written: {path} ({profiler.sample_count} samples)")
+        except OSError as e:
+            print(f"Profile write error: {e}")
@@ -12,17 +12,29 @@
 
 import os
 import json
+import uuid
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from typing import Literal
 from dotenv import load_dotenv
 
 from langgraph.graph import StateGraph, START, END, MessagesState
-from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import MemorySaver
 
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_chroma import Chroma
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage, RemoveMessage
 from langchain_core.tools import tool
+from langchain_core.documents import Document
+
+from checkpointer import build_checkpointer
+from singleflight import SingleFlight, normalize_question
+from circuit import CircuitBreaker
+from extractive import extract_answer, tokenize
+from llm_cache import LLMCache, LLM_CACHE
+import tracing
+from tracing import span, traced_node, TracedEmbeddings
+from model_tiers import FAST_MODEL, STRONG_MODEL, NODE_TIERS, TierStats, classify_complexity
 
 # Load environment variables
 load_dotenv()
@@ -31,19 +43,84 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY not set")
 
+# Conversation context limits (see TaxRAGAgent._manage_context)
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", 3))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.4))
+
+# Maximum concurrent calls to the LLM provider from this process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+
+# Per-call HTTP timeout and retries of the LLM client. A call the graph has
+# stopped waiting for keeps its worker thread and LLM slot until this ends it.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 20))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 1))
+
+# Latency budget per request (see TaxRAGAgent._tools and _fallback)
+REQUEST_SLO_SECONDS = float(os.getenv("REQUEST_SLO_SECONDS", 30))
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", 3))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", 10))
+MIN_LLM_SECONDS = 2.0  # below this remaining budget no new LLM call is started
+
+# Share one graph execution between identical first-turn questions
+COALESCE_FIRST_TURN = os.getenv("COALESCE_FIRST_TURN", "1") == "1"
+
+PRUNED_TOOL_CONTENT = "[tool output from an earlier turn removed]"
+
+
+class AgentState(MessagesState):
+    summary: str
+    prompt_tokens: int
+    deadline: float  # epoch seconds by which the turn must finish
+    tool_rounds: int
+    tier: str  # model tier picked for this turn by classify_complexity
+
+
+class NodeTimeout(Exception):
+    pass
+
 
 class TaxRAGAgent:
-    def __init__(self, chroma_dir: str):
+    def __init__(self, chroma_dir: str, keep_turns: int = CONTEXT_KEEP_TURNS,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET, checkpointer=None):
         self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.4,
-            api_key=api_key
+            model=FAST_MODEL,
+            temperature=LLM_TEMPERATURE,
+            api_key=api_key,
+            timeout=LLM_TIMEOUT_SECONDS,
+            max_retries=LLM_MAX_RETRIES
         )
 
-        self.embeddings = OpenAIEmbeddings(
+        # Model tiers (see model_tiers.py); self.llm is the fast tier
+        self.llms = {
+            "fast": self.llm,
+            "strong": ChatOpenAI(
+                model=STRONG_MODEL,
+                temperature=LLM_TEMPERATURE,
+                api_key=api_key,
+                timeout=LLM_TIMEOUT_SECONDS,
+                max_retries=LLM_MAX_RETRIES
+            )
+        }
+        self.tier_stats = TierStats()
+
+        # Optional exact-prompt response cache (see llm_cache.py)
+        self.llm_cache = LLMCache() if LLM_CACHE else None
+
+        self.llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        self.llm_breaker = CircuitBreaker("chat_openai")
+
+        # Tool calls and LLM calls run here so they can be abandoned at the deadline.
+        # An abandoned call keeps its worker until the client timeout ends it, so
+        # on top of the live calls there is room for as many abandoned ones.
+        self.executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY * 8, thread_name_prefix="agent")
+        self.max_tool_rounds = MAX_TOOL_ROUNDS
+
+        self.embeddings = TracedEmbeddings(OpenAIEmbeddings(
             model="text-embedding-3-small",
             api_key=api_key
-        )
+        ))
 
         self.vectorstore = Chroma(
             collection_name="Tax_agentic_rag_docs",
@@ -51,8 +128,20 @@ class TaxRAGAgent:
             embedding_function=self.embeddings
         )
 
-        # Session memory for frontend history
-        self.sessions = {}  # thread_id -> list of messages
+        # Context window limits for the graph state
+        self.keep_turns = max(1, keep_turns)
+        self.token_budget = token_budget
+
+        # Graph state persistence (MemorySaver or SQLite, see checkpointer.py)
+        self.checkpointer = checkpointer or build_checkpointer()
+
+        # Request coalescing for identical first-turn questions
+        self.coalesce = COALESCE_FIRST_TURN
+        self.single_flight = SingleFlight()
+
+        # Graph executions currently running
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
 
         # Tools and graph
         self.tools = self._build_tools()
@@ -282,7 +371,10 @@ Output format exactly:
 
 {output_format}
 """
-            response = self.llm.invoke(prompt)
+            # Called by the assistant as a tool: _tools bounds the wait, the breaker guards the call
+            response = self.llm_breaker.call(
+                lambda: self._invoke_model("multilingual", prompt, self._node_tier("multilingual"))
+            )
             return response.content.strip()
 
         return [
@@ -293,10 +385,192 @@ Output format exactly:
             multilingual_output_node
         ]
 
+    # --------------------------------------------------
+    # CONTEXT MANAGEMENT
+    # --------------------------------------------------
+    def _count_tokens(self, messages) -> int:
+        try:
+            return self.llm.get_num_tokens_from_messages(messages)
+        except Exception:
+            # Rough estimate when the tokenizer is unavailable
+            return sum(len(str(m.content)) for m in messages) // 4
+
+    def _summarize(self, summary: str, messages, timeout: float) -> str | None:
+        """Updated summary, or None when the LLM call fails or overruns `timeout`."""
+        lines = []
+        for msg in messages:
+            if isinstance(msg, HumanMessage):
+                lines.append(f"User: {msg.content}")
+            elif isinstance(msg, AIMessage) and not msg.tool_calls and msg.content:
+                lines.append(f"Assistant: {msg.content}")
+
+        if not lines:
+            return summary
+        if timeout < MIN_LLM_SECONDS:
+            print("[timeout] node=summary skipped, request budget exhausted")
+            return None
+
+        prompt = f"""
+You maintain a running summary of a conversation about Nigerian tax law.
+
+Current summary:
+{summary or "(empty)"}
+
+New conversation lines:
+{chr(10).join(lines)}
+
+Update the summary so it keeps the user's situation, the questions asked and the key facts
+already given. Be brief (at most 150 words). Return only the summary.
+"""
+        def call():
+            return self._invoke_model("summary", prompt, self._node_tier("summary"))
+
+        try:
+            return self._call_llm("summary", call, timeout).content.strip()
+        except Exception as e:
+            print(f"Summary error: {e!r}")
+            return None
+
+    def _manage_context(self, state: AgentState):
+        """
+        Keep the last `keep_turns` turns verbatim, fold older turns into a
+        running summary and drop tool output bodies from previous turns.
+        Also picks the model tier for the turn.
+        """
+        messages = state["messages"]
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if not turn_starts:
+            return {}
+
+        current_start = turn_starts[-1]
+        tier = classify_complexity(messages[current_start].content)
+        kept_turns = turn_starts[-self.keep_turns:]
+        keep_from = kept_turns[0]
+
+        def pruned(msg):
+            if isinstance(msg, ToolMessage) and msg.content != PRUNED_TOOL_CONTENT:
+                return ToolMessage(
+                    content=PRUNED_TOOL_CONTENT,
+                    tool_call_id=msg.tool_call_id,
+                    name=msg.name,
+                    id=msg.id
+                )
+            return msg
+
+        # Fold whole turns into the summary until the kept window fits the budget
+        for next_start in kept_turns[1:]:
+            window = [pruned(m) for m in messages[keep_from:current_start]] + messages[current_start:]
+            if self._count_tokens(window) <= self.token_budget:
+                break
+            keep_from = next_start
+
+        updates = []
+        summary = state.get("summary", "")
+
+        # The summary may use the budget beyond what the answer itself needs. Without
+        # a new summary the old turns stay (pruned) until a later turn folds them in.
+        old = messages[:keep_from]
+        if old:
+            new_summary = self._summarize(summary, old, self._remaining(state) - 2 * MIN_LLM_SECONDS)
+            if new_summary is not None:
+                summary = new_summary
+                updates.extend(RemoveMessage(id=m.id) for m in old)
+            else:
+                keep_from = 0
+
+        for msg in messages[keep_from:current_start]:
+            replacement = pruned(msg)
+            if replacement is not msg:
+                updates.append(replacement)
+
+        return {"messages": updates, "summary": summary, "tier": tier}
+
+    # --------------------------------------------------
+    # DEADLINES
+    # --------------------------------------------------
+    @staticmethod
+    def _remaining(state: AgentState) -> float:
+        deadline = state.get("deadline") or time.time() + REQUEST_SLO_SECONDS
+        return deadline - time.time()
+
+    def _call_with_deadline(self, node: str, fn, timeout: float):
+        """Run fn() in the executor; raise NodeTimeout if it overruns `timeout` seconds."""
+        future = tracing.submit(self.executor, fn)
+        try:
+            return future.result(timeout=max(0.0, timeout))
+        except FutureTimeout:
+            # Only stops a call that has not started; a running one ends at LLM_TIMEOUT_SECONDS
+            future.cancel()
+            print(f"[timeout] node={node} after {timeout:.1f}s")
+            raise NodeTimeout(node)
+
+    # --------------------------------------------------
+    # MODEL TIERS
+    # --------------------------------------------------
+    def _node_tier(self, node: str, state: AgentState | None = None) -> str:
+        tier = NODE_TIERS.get(node, "fast")
+        if tier == "auto":
+            tier = (state or {}).get("tier") or "fast"
+        return tier
+
+    def _invoke_model(self, node: str, prompt, tier: str, bind_tools: bool = False):
+        with span("llm", "llm", node=node, tier=tier) as current:
+            response, cache_hit = self._cached_model_call(node, prompt, tier, bind_tools)
+            if current is not None:
+                usage = getattr(response, "usage_metadata", None) or {}
+                current.set(
+                    cache_hit=cache_hit,
+                    input_tokens=0 if cache_hit else usage.get("input_tokens", 0),
+                    output_tokens=0 if cache_hit else usage.get("output_tokens", 0)
+                )
+            return response
+
+    def _cached_model_call(self, node: str, prompt, tier: str, bind_tools: bool):
+        llm = self.llms[tier]
+        start = time.perf_counter()
+
+        cache_key = None
+        if self.llm_cache and self.llm_cache.cacheable(llm):
+            cache_key = self.llm_cache.key(
+                getattr(llm, "model_name", tier),
+                getattr(llm, "temperature", None),
+                prompt,
+                self.tools if bind_tools else None
+            )
+            cached = self.llm_cache.get(cache_key)
+            if cached is not None:
+                print(f"[llm-cache] hit node={node} tier={tier} {(time.perf_counter() - start) * 1000:.1f}ms")
+                return cached, True
+
+        if bind_tools:
+            llm = llm.bind_tools(self.tools, tool_choice="auto")
+
+        # Don't queue for a slot longer than a call may take (e.g. after the caller gave up)
+        if not self.llm_slots.acquire(timeout=LLM_TIMEOUT_SECONDS):
+            raise TimeoutError(f"No LLM slot free after {LLM_TIMEOUT_SECONDS:.0f}s")
+        try:
+            response = llm.invoke(prompt)
+        finally:
+            self.llm_slots.release()
+        self.tier_stats.record(
+            tier, node, (time.perf_counter() - start) * 1000, getattr(response, "usage_metadata", None)
+        )
+
+        if cache_key:
+            self.llm_cache.put(cache_key, response)
+        return response, False
+
+    def _call_llm(self, node: str, fn, timeout: float):
+        """LLM call bounded by the deadline and guarded by the circuit breaker."""
+        # The breaker wraps the provider call itself, so running out of request
+        # budget (NodeTimeout) is not a provider failure. An abandoned call still
+        # records its own outcome when it finishes or hits LLM_TIMEOUT_SECONDS.
+        return self._call_with_deadline(node, lambda: self.llm_breaker.call(fn), timeout)
+
     # --------------------------------------------------
     # AGENT LOGIC
     # --------------------------------------------------
-    def _assistant(self, state: MessagesState):
+    def _assistant(self, state: AgentState):
         system_prompt = SystemMessage(content="""
 You are an expert Nigerian tax assistant powered by official tax documents. Your answers must be:
 
@@ -333,28 +607,186 @@ If multiple tools return content, synthesize the most relevant and authoritative
 Your final answer must always be derived exclusively from tool-retrieved content.
 """)
 
-        messages = [system_prompt] + state["messages"]
-        response = self.llm.bind_tools(self.tools, tool_choice="auto").invoke(messages)
-        return {"messages": state["messages"] + [response]}
+        messages = [system_prompt]
+        if state.get("summary"):
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{state['summary']}"))
+        messages += state["messages"]
+
+        # First call of the turn only selects tools; later calls synthesize the answer
+        node = "routing" if isinstance(state["messages"][-1], HumanMessage) else "synthesis"
+        tier = self._node_tier(node, state)
 
-    def _should_continue(self, state: MessagesState) -> Literal["tools", "__end__"]:
+        def call():
+            return self._invoke_model(node, messages, tier, bind_tools=True)
+
+        try:
+            response = self._call_llm("assistant", call, self._remaining(state))
+        except Exception as e:
+            # No new message: _should_continue routes to the fallback answer
+            print(f"Assistant LLM error: {e!r}")
+            return {}
+
+        usage = getattr(response, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens") or self._count_tokens(messages)
+
+        return {"messages": [response], "prompt_tokens": prompt_tokens}
+
+    def _should_continue(self, state: AgentState) -> Literal["tools", "fallback", "__end__"]:
         last = state["messages"][-1]
-        return "tools" if last.tool_calls else "__end__"
+        if not isinstance(last, AIMessage):
+            return "fallback"
+        if not last.tool_calls:
+            return "__end__"
+        if state.get("tool_rounds", 0) >= self.max_tool_rounds or self._remaining(state) < MIN_LLM_SECONDS:
+            return "fallback"
+        return "tools"
+
+    def _tools(self, state: AgentState):
+        """Run the requested tools in parallel; calls that overrun the budget get a timeout result."""
+        last = state["messages"][-1]
+        tools_by_name = {t.name: t for t in self.tools}
+        timeout = min(TOOL_TIMEOUT_SECONDS, self._remaining(state))
+
+        futures = [
+            (call, tracing.submit(self.executor, self._run_tool, tools_by_name[call["name"]], call))
+            for call in last.tool_calls
+            if call["name"] in tools_by_name
+        ]
+
+        results = []
+        answered = set()
+        wait_until = time.time() + max(0.0, timeout)
+        for call, future in futures:
+            try:
+                results.append(future.result(timeout=max(0.0, wait_until - time.time())))
+            except FutureTimeout:
+                future.cancel()
+                print(f"[timeout] node=tools tool={call['name']} after {timeout:.1f}s")
+                results.append(self._skipped_tool_message(call, "Tool timed out."))
+            except Exception as e:
+                results.append(self._skipped_tool_message(call, f"Tool error: {e}"))
+            answered.add(call["id"])
+
+        for call in last.tool_calls:
+            if call["id"] not in answered:
+                results.append(self._skipped_tool_message(call, f"Unknown tool '{call['name']}'."))
+
+        return {"messages": results, "tool_rounds": state.get("tool_rounds", 0) + 1}
+
+    @staticmethod
+    def _run_tool(tool_, call) -> ToolMessage:
+        with span(tool_.name, "tool") as current:
+            result = tool_.invoke({**call, "type": "tool_call"})
+            if current is not None:
+                try:
+                    current.set(retrieved_chunks=len(json.loads(result.content).get("citations", [])))
+                except (TypeError, ValueError, AttributeError):
+                    pass
+            return result
+
+    @staticmethod
+    def _skipped_tool_message(call, reason: str) -> ToolMessage:
+        return ToolMessage(
+            content=json.dumps({"content": reason, "citations": []}),
+            tool_call_id=call["id"],
+            name=call["name"],
+            status="error"
+        )
+
+    @staticmethod
+    def _turn_context(messages) -> list[str]:
+        """Retrieved text of the current turn's tool calls."""
+        contents = []
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                break
+            if isinstance(msg, ToolMessage) and msg.status != "error":
+                try:
+                    tool_out = json.loads(msg.content)
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(tool_out, dict) and tool_out.get("citations"):
+                    contents.append(tool_out.get("content", ""))
+        return list(reversed(contents))
+
+    def _fallback(self, state: AgentState):
+        """
+        Budget exhausted: close any pending tool calls and answer from what has
+        been retrieved so far.
+        """
+        messages = state["messages"]
+        last = messages[-1]
+
+        closing = [
+            self._skipped_tool_message(call, "Skipped: request budget exhausted.")
+            for call in (last.tool_calls if isinstance(last, AIMessage) else [])
+        ]
+        print(f"[fallback] tool_rounds={state.get('tool_rounds', 0)} remaining={self._remaining(state):.1f}s")
+
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+        context = self._turn_context(messages)
+        if not context and self._remaining(state) > 0:
+            # Nothing retrieved yet (e.g. the first LLM call failed): retrieve directly
+            call = {"name": "retrieve_documents", "args": {"query": question}, "id": f"fallback-{uuid.uuid4().hex}"}
+            retrieve = next(t for t in self.tools if t.name == "retrieve_documents")
+            try:
+                tool_msg = self._call_with_deadline(
+                    "fallback",
+                    lambda: retrieve.invoke({**call, "type": "tool_call"}),
+                    min(TOOL_TIMEOUT_SECONDS, self._remaining(state))
+                )
+                closing += [AIMessage(content="", tool_calls=[call]), tool_msg]
+                context = self._turn_context([tool_msg])
+            except Exception as e:
+                print(f"Fallback retrieval error: {e!r}")
+
+        if not context:
+            answer = "I couldn't find specific information on this in the current tax documents in time. Please try again."
+            return {"messages": closing + [AIMessage(content=answer)]}
+
+
+        remaining = self._remaining(state)
+        if remaining >= MIN_LLM_SECONDS and self.llm_breaker.state != "open":
+            prompt = f"""
+Answer the question about Nigerian tax law using ONLY the context below.
+Be clear and concise (4-8 sentences). Do not mention documents or page numbers.
+
+Question: {question}
+
+Context:
+{chr(10).join(context)}
+"""
+
+            def call():
+                return self._invoke_model("fallback", prompt, self._node_tier("fallback", state))
+
+            try:
+                response = self._call_llm("fallback", call, remaining)
+                return {"messages": closing + [AIMessage(content=response.content.strip())]}
+            except Exception as e:
+                print(f"Fallback LLM error: {e!r}")
+
+        excerpt = extract_answer(question, context) or "\n\n".join(context)[:1500].strip()
+        answer = "I couldn't generate a full answer right now. The most relevant information found is:\n\n" + excerpt
+        return {"messages": closing + [AIMessage(content=answer)]}
 
     # --------------------------------------------------
     # GRAPH WITH MULTILINGUAL FINAL STEP
     # --------------------------------------------------
     def _build_graph(self):
-        builder = StateGraph(MessagesState)
+        builder = StateGraph(AgentState)
 
-        builder.add_node("assistant", self._assistant)
-        builder.add_node("tools", ToolNode(self.tools))
+        builder.add_node("context", traced_node("context", self._manage_context))
+        builder.add_node("assistant", traced_node("assistant", self._assistant))
+        builder.add_node("tools", traced_node("tools", self._tools))
+        builder.add_node("fallback", traced_node("fallback", self._fallback))
 
         # Final multilingual node
-        def multilingual_node(state: MessagesState):
+        def multilingual_node(state: AgentState):
     # Get user's original question
             user_question = ""
-            for msg in state["messages"]:
+            for msg in reversed(state["messages"]):
                 if isinstance(msg, HumanMessage):
                     user_question = msg.content.lower()
                     break
@@ -376,90 +808,213 @@ Your final answer must always be derived exclusively from tool-retrieved content
             if not final_english:
                 return {"messages": state["messages"]}
 
+            if translation_requested and self._remaining(state) < MIN_LLM_SECONDS:
+                print("[timeout] node=multilingual skipped, request budget exhausted")
+                translation_requested = False
+
             # Only generate multilingual if user asked for it
             if translation_requested:
                 multilingual_tool = next((t for t in self.tools if t.name == "multilingual_output_node"), None)
                 if multilingual_tool:
-                    result = multilingual_tool.invoke({
-                        "text": final_english,
-                        "target_language": "all"  # or detect specific language if needed
-                    })
-                    multilingual_message = AIMessage(content=result)
-                    return {"messages": state["messages"] + [multilingual_message]}
+                    def call():
+                        return multilingual_tool.invoke({
+                            "text": final_english,
+                            "target_language": "all"  # or detect specific language if needed
+                        })
+
+                    try:
+                        result = self._call_with_deadline("multilingual", call, self._remaining(state))
+                        multilingual_message = AIMessage(content=result)
+                        return {"messages": state["messages"] + [multilingual_message]}
+                    except Exception as e:
+                        # Answer in English rather than fail the turn
+                        print(f"Multilingual error: {e!r}")
 
             # Default: just return English answer
             return {"messages": state["messages"] + [AIMessage(content=final_english)]}
 
-        builder.add_node("multilingual", multilingual_node)
+        builder.add_node("multilingual", traced_node("multilingual", multilingual_node))
 
         # Edges
-        builder.add_edge(START, "assistant")
+        builder.add_edge(START, "context")
+        builder.add_edge("context", "assistant")
         builder.add_conditional_edges(
             "assistant",
             self._should_continue,
-            {"tools": "tools", "__end__": "multilingual"}
+            {"tools": "tools", "fallback": "fallback", "__end__": "multilingual"}
         )
         builder.add_edge("tools", "assistant")
+        builder.add_edge("fallback", "multilingual")
         builder.add_edge("multilingual", END)
 
-        return builder.compile(checkpointer=MemorySaver())
+        return builder.compile(checkpointer=self.checkpointer)
 
     # --------------------------------------------------
-    # PUBLIC METHODS
+    # EXTRACTIVE MODE (no LLM)
     # --------------------------------------------------
-    def run_with_memory(self, question: str, thread_id: str = "default"):
-        if thread_id not in self.sessions:
-            self.sessions[thread_id] = []
-
-        user_entry = {"role": "user", "content": question}
-        self.sessions[thread_id].append(user_entry)
+    def _search(self, query: str, k: int = 5) -> list[Document]:
+        try:
+            return self.vectorstore.similarity_search(query, k=k)
+        except Exception as e:
+            # Embedding provider unavailable: fall back to keyword lookup in Chroma
+            print(f"Vector search error, using keyword search: {e!r}")
+
+        docs = []
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)[:3]
+        for term in terms:
+            found = self.vectorstore.get(
+                where_document={"$contains": term},
+                limit=k,
+                include=["documents", "metadatas"]
+            )
+            docs.extend(
+                Document(page_content=text, metadata=meta or {})
+                for text, meta in zip(found["documents"], found["metadatas"])
+            )
+            if len(docs) >= k:
+                break
+        return docs[:k]
+
+    def answer_extractive(self, question: str, k: int = 5):
+        """Answer with the best-matching sentences of the top chunks. Returns (answer, citations)."""
+        docs = self._search(question, k)
+        answer = extract_answer(question, [d.page_content for d in docs])
+        if not answer:
+            return "I couldn't find specific information on this in the current tax documents.", []
+
+        citations = []
+        seen = set()
+        for d in docs:
+            key = (d.metadata.get("source_path"), d.metadata.get("page"))
+            if key not in seen:
+                seen.add(key)
+                citations.append({
+                    "source_path": d.metadata.get("source_path"),
+                    "page_number": d.metadata.get("page"),
+                    "document_type": d.metadata.get("type"),
+                    "creation_date": d.metadata.get("creation_date"),
+                })
+        return answer, citations
 
+    # --------------------------------------------------
+    # PUBLIC METHODS
+    # --------------------------------------------------
+    @staticmethod
+    def _current_turn(messages, turn_id: str):
+        """Messages produced after (and including) the HumanMessage with id `turn_id`."""
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].id == turn_id:
+                return messages[i:]
+        return []
+
+    @staticmethod
+    def _extract_citations(turn_messages):
+        citations = []
+        seen = set()
+        for msg in turn_messages:
+            if not isinstance(msg, ToolMessage) or msg.content == PRUNED_TOOL_CONTENT:
+                continue
+            try:
+                tool_out = json.loads(msg.content)
+            except (TypeError, ValueError):
+                continue
+            if not isinstance(tool_out, dict):
+                continue
+
+            for c in tool_out.get("citations", []):
+                key = (c.get("source_path"), c.get("page_number"))
+                if key not in seen:
+                    seen.add(key)
+                    citations.append(c)
+        return citations
+
+    def _invoke_turn(self, question: str, config: dict, deadline: float):
+        """Run one turn and return (messages produced by the turn, prompt tokens)."""
+        turn_id = str(uuid.uuid4())
+        with self._in_flight_lock:
+            self.in_flight += 1
         try:
             result = self.graph.invoke(
-                {"messages": [HumanMessage(content=question)]},
-                config={"configurable": {"thread_id": thread_id}}
+                {
+                    "messages": [HumanMessage(content=question, id=turn_id)],
+                    "deadline": deadline,
+                    "tool_rounds": 0
+                },
+                config=config
             )
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+        # Only look at what this turn produced, not the whole thread history
+        return self._current_turn(result["messages"], turn_id), result.get("prompt_tokens")
+
+    def _is_new_thread(self, config: dict) -> bool:
+        return not self.graph.get_state(config).values.get("messages")
+
+    def _append_turn(self, question: str, config: dict, messages, prompt_tokens=None):
+        """Record a turn computed outside this thread's graph run in its state."""
+        messages = [HumanMessage(content=question, id=str(uuid.uuid4()))] + list(messages)
+        self.graph.update_state(
+            config,
+            {"messages": messages, "prompt_tokens": prompt_tokens},
+            as_node="multilingual"
+        )
+
+    def run_with_memory(self, question: str, thread_id: str = "default", deadline: float | None = None,
+                        mode: str = "agent"):
+        config = {"configurable": {"thread_id": thread_id}}
+        deadline = deadline or time.time() + REQUEST_SLO_SECONDS
+        prompt_tokens = None
+
+        if mode != "extractive" and self.llm_breaker.state == "open":
+            print("[circuit] LLM unavailable, answering extractively")
+            mode = "extractive"
+
+        try:
+            if mode == "extractive":
+                final_content, citations = self.answer_extractive(question)
+                self._append_turn(question, config, [AIMessage(content=final_content)])
+            else:
+                if self.coalesce and self._is_new_thread(config):
+                    # Identical first questions in flight share one graph execution
+                    (turn, prompt_tokens), shared = self.single_flight.do(
+                        normalize_question(question),
+                        lambda: self._invoke_turn(question, config, deadline)
+                    )
+                    if shared:
+                        self._append_turn(question, config, turn[1:], prompt_tokens)
+                else:
+                    turn, prompt_tokens = self._invoke_turn(question, config, deadline)
+
+                final_content = "No response generated."
+
+                # Final (multilingual) answer is the last plain AIMessage of the turn
+                for msg in reversed(turn):
+                    if isinstance(msg, AIMessage) and not msg.tool_calls:
+                        final_content = msg.content.strip()
+                        break
+
+                citations = self._extract_citations(turn)
         except Exception as e:
             print(f"Graph invoke error: {e}")
-            final_content = "Sorry, an error occurred while processing your question."
-            citations = []
-        else:
-            final_content = "No response generated."
-            citations = []
-
-            # Extract final multilingual message
-            for msg in result["messages"]:
-                if isinstance(msg, AIMessage) and not msg.tool_calls:
-                    final_content = msg.content.strip()
-
-                if isinstance(msg, ToolMessage):
-                    try:
-                        tool_out = json.loads(msg.content)
-                        if isinstance(tool_out, dict) and "citations" in tool_out:
-                            citations.extend(tool_out["citations"])
-                    except:
-                        pass
-
-            # Deduplicate citations
-            seen = set()
-            unique_citations = []
-            for c in citations:
-                key = (c["source_path"], c.get("page_number"))
-                if key not in seen:
-                    seen.add(key)
-                    unique_citations.append(c)
-            citations = unique_citations
+            try:
+                final_content, citations = self.answer_extractive(question)
+                mode = "extractive"
+            except Exception as e:
+                print(f"Extractive answer error: {e}")
+                final_content = "Sorry, an error occurred while processing your question."
+                citations = []
 
         assistant_entry = {
             "role": "assistant",
             "content": final_content,
             "metadata": {
-                "citations": citations
+                "citations": citations,
+                "prompt_tokens": prompt_tokens,
+                "mode": mode
             }
         }
 
-        self.sessions[thread_id].append(assistant_entry)
-
         return {
             "messages": [
                 {"role": "user", "content": question},
@@ -467,10 +1022,6 @@ Your final answer must always be derived exclusively from tool-retrieved content
             ]
         }
 
-    def get_session(self, thread_id: str):
-        return self.sessions.get(thread_id, [])
-
     def reset_session(self, thread_id: str):
-        if thread_id in self.sessions:
-            self.sessions[thread_id] = []
+        self.checkpointer.delete_thread(thread_id)
 
@@ -0,0 +1,371 @@
+# Retention and archival of chat history and query logs
+
+# Messages (with their citations) and query logs (with their metrics) older
+# than RETENTION_DAYS are moved out of the live tables into compressed
+# archives, one file per table family and month:
+#
+#   ARCHIVE_DIR/messages-2025-01.jsonl.zst
+#   ARCHIVE_DIR/query_logs-2025-01.jsonl.zst
+#
+# Rows are taken oldest first along the primary key, ARCHIVE_BATCH_SIZE at a
+# time. Each batch is appended to its archive as a complete zstd frame and
+# fsynced before the rows are deleted in a short transaction, then the job
+# pauses ARCHIVE_BATCH_PAUSE_MS so user traffic is never queued behind a long
+# delete. A crash can at worst archive a batch twice; restore skips rows that
+# already exist. Sessions left without messages are dropped at the end.
+# Query-log rollups (rollups.py) are not touched, so analytics keep the
+# full history.
+#
+# The API runs the job every RETENTION_INTERVAL seconds when RETENTION_DAYS
+# is set. By hand, and to load an archive back for an audit (restored rows
+# still older than the window go out again on the next run):
+#
+# python retention.py run [--days 365]
+# python retention.py restore archives/messages-2025-01.jsonl.zst
+
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import zstandard
+from sqlalchemy import bindparam, text
+
+from documents import DocumentRegistry, document_registry
+from session_store import session_cache
+
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 0))  # 0 keeps everything
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 86400))  # seconds between runs
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archives"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_BATCH_PAUSE_MS = float(os.getenv("ARCHIVE_BATCH_PAUSE_MS", 50))
+
+
+def _as_datetime(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _expanding(sql: str, *names):
+    return text(sql).bindparams(*(bindparam(n, expanding=True) for n in names))
+
+
+# --------------------------------------------------
+# ARCHIVE FILES
+# --------------------------------------------------
+def archive_path(kind: str, created_at: datetime, archive_dir: str = ARCHIVE_DIR) -> str:
+    return os.path.join(archive_dir, f"{kind}-{created_at:%Y-%m}.jsonl.zst")
+
+
+def append_archive(path: str, records: list[dict]):
+    """Append records as one zstd frame and fsync, so they are durable before the rows are deleted."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = "".join(json.dumps(r, default=str) + "\n" for r in records).encode("utf-8")
+    with open(path, "ab") as f:
+        f.write(zstandard.ZstdCompressor(level=10).compress(data))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_archive(path: str):
+    """Yield the records of an archive file (all frames)."""
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        try:
+            for line in io.TextIOWrapper(reader, encoding="utf-8"):
+                if line.strip():
+                    yield json.loads(line)
+        except zstandard.ZstdError as e:
+            # Only the frame being written when a run was interrupted can be cut
+            # short, and its rows were not deleted
+            print(f"{path}: stopped at a truncated frame ({e})")
+
+
+def _write_by_month(kind: str, records: list[dict], archive_dir: str):
+    months = {}
+    for r in records:
+        months.setdefault(archive_path(kind, _as_datetime(r["created_at"]), archive_dir), []).append(r)
+    for path, month_records in months.items():
+        append_archive(path, month_records)
+
+
+# --------------------------------------------------
+# ARCHIVE
+# --------------------------------------------------
+def _old_prefix(rows, cutoff: datetime):
+    """Leading rows created before cutoff (ids grow with time, so stop at the first newer one)."""
+    old = []
+    for r in rows:
+        if _as_datetime(r.created_at) >= cutoff:
+            return old, True
+        old.append(r)
+    return old, False
+
+
+def archive_messages(engine, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE,
+                     archive_dir: str = ARCHIVE_DIR, pause_ms: float = ARCHIVE_BATCH_PAUSE_MS) -> int:
+    archived = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT m.message_id, m.role, m.content, m.created_at, s.user_id, s.title
+                FROM messages m
+                JOIN chat_sessions s ON s.session_id = m.session_id
+                ORDER BY m.message_id
+                LIMIT :limit
+            """), {"limit": batch_size}).fetchall()
+            old, reached_cutoff = _old_prefix(rows, cutoff)
+            if not old:
+                return archived
+
+            ids = [r.message_id for r in old]
+            citations = {}
+            for c in conn.execute(_expanding("""
+                SELECT c.message_id, c.page_number, c.created_at, d.source_path, d.document_type
+                FROM citations c
+                LEFT JOIN documents d ON d.document_id = c.document_id
+                WHERE c.message_id IN :ids
+                ORDER BY c.citation_id
+            """, "ids"), {"ids": ids}):
+                citations.setdefault(c.message_id, []).append({
+                    "source_path": c.source_path,
+                    "page_number": c.page_number,
+                    "document_type": c.document_type,
+                    "created_at": c.created_at,
+                })
+
+        _write_by_month("messages", [
+            {
+                "message_id": r.message_id,
+                "user_id": r.user_id,
+                "thread_id": r.title,
+                "role": r.role,
+                "content": r.content,
+                "created_at": r.created_at,
+                "citations": citations.get(r.message_id, []),
+            }
+            for r in old
+        ], archive_dir)
+
+        with engine.begin() as conn:
+            conn.execute(_expanding("DELETE FROM citations WHERE message_id IN :ids", "ids"), {"ids": ids})
+            conn.execute(_expanding("DELETE FROM messages WHERE message_id IN :ids", "ids"), {"ids": ids})
+        for key in {(r.user_id, r.title) for r in old}:
+            session_cache.invalidate(*key)
+
+        archived += len(old)
+        if reached_cutoff or len(rows) < batch_size:
+            return archived
+        time.sleep(pause_ms / 1000)
+
+
+def archive_query_logs(engine, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE,
+                       archive_dir: str = ARCHIVE_DIR, pause_ms: float = ARCHIVE_BATCH_PAUSE_MS) -> int:
+    archived = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT log_id, user_id, question, retrieved_docs, response_time_ms, created_at
+                FROM query_logs
+                ORDER BY log_id
+                LIMIT :limit
+            """), {"limit": batch_size}).fetchall()
+            old, reached_cutoff = _old_prefix(rows, cutoff)
+            if not old:
+                return archived
+
+            ids = [r.log_id for r in old]
+            metrics = {
+                m["log_id"]: {k: v for k, v in m.items() if k not in ("metric_id", "log_id")}
+                for m in conn.execute(_expanding(
+                    "SELECT * FROM query_metrics WHERE log_id IN :ids", "ids"
+                ), {"ids": ids}).mappings()
+            }
+
+        _write_by_month("query_logs", [
+            {**r._asdict(), "metrics": metrics.get(r.log_id)} for r in old
+        ], archive_dir)
+
+        with engine.begin() as conn:
+            conn.execute(_expanding("DELETE FROM query_metrics WHERE log_id IN :ids", "ids"), {"ids": ids})
+            conn.execute(_expanding("DELETE FROM query_logs WHERE log_id IN :ids", "ids"), {"ids": ids})
+
+        archived += len(old)
+        if reached_cutoff or len(rows) < batch_size:
+            return archived
+        time.sleep(pause_ms / 1000)
+
+
+def run_retention(engine, days: int = RETENTION_DAYS, archive_dir: str = ARCHIVE_DIR,
+                  batch_size: int = ARCHIVE_BATCH_SIZE) -> dict | None:
+    """Archive and purge everything older than `days`. None when another worker is already running it."""
+    with engine.connect() as lock:
+        mysql = lock.dialect.name == "mysql"
+        if mysql and not lock.execute(text("SELECT GET_LOCK('tax_rag_retention', 0)")).scalar():
+            return None
+        try:
+            # Cutoff in database time, the clock created_at was stamped with
+            now = _as_datetime(lock.execute(text("SELECT CURRENT_TIMESTAMP")).scalar())
+            lock.rollback()
+            cutoff = now - timedelta(days=days)
+
+            result = {
+                "cutoff": cutoff.isoformat(),
+                "messages": archive_messages(engine, cutoff, batch_size, archive_dir),
+                "query_logs": archive_query_logs(engine, cutoff, batch_size, archive_dir),
+            }
+            with engine.begin() as conn:
+                result["sessions"] = conn.execute(text("""
+                    DELETE FROM chat_sessions
+                    WHERE last_active < :cutoff
+                      AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.session_id = chat_sessions.session_id)
+                """), {"cutoff": cutoff}).rowcount
+            return result
+        finally:
+            if mysql:
+                lock.execute(text("SELECT RELEASE_LOCK('tax_rag_retention')"))
+
+
+def start_retention(engine, interval: int = RETENTION_INTERVAL):
+    """Run run_retention() every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                result = run_retention(engine)
+                if result and (result["messages"] or result["query_logs"]):
+                    print(f"Retention: {result}")
+            except Exception as e:
+                print(f"Retention error: {e}")
+
+    threading.Thread(target=loop, name="retention", daemon=True).start()
+    return stop
+
+
+# --------------------------------------------------
+# RESTORE
+# --------------------------------------------------
+def _restore_messages(engine, records: list[dict], registry: DocumentRegistry) -> int:
+    document_ids = registry.resolve(engine, [c for r in records for c in r["citations"]])
+    with engine.begin() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        present = {row[0] for row in conn.execute(_expanding(
+            "SELECT message_id FROM messages WHERE message_id IN :ids", "ids"
+        ), {"ids": [r["message_id"] for r in records]})}
+        records = [r for r in records if r["message_id"] not in present]
+        if not records:
+            return 0
+
+        keys = sorted({(r["user_id"], r["thread_id"]) for r in records})
+        conn.execute(text(
+            "INSERT INTO chat_sessions (user_id, title) VALUES (:user_id, :thread_id) "
+            + ("ON CONFLICT (user_id, title) DO NOTHING" if sqlite else "ON DUPLICATE KEY UPDATE session_id = session_id")
+        ), [{"user_id": u, "thread_id": t} for u, t in keys])
+        session_ids = {
+            (row.user_id, row.title): row.session_id
+            for row in conn.execute(_expanding("""
+                SELECT session_id, user_id, title FROM chat_sessions WHERE user_id IN :user_ids AND title IN :titles
+            """, "user_ids", "titles"), {
+                "user_ids": sorted({u for u, _ in keys}), "titles": sorted({t for _, t in keys})
+            })
+        }
+
+        conn.execute(text("""
+            INSERT INTO messages (message_id, session_id, role, content, created_at)
+            VALUES (:message_id, :session_id, :role, :content, :created_at)
+        """), [
+            {
+                "message_id": r["message_id"],
+                "session_id": session_ids[(r["user_id"], r["thread_id"])],
+                "role": r["role"],
+                "content": r["content"],
+                "created_at": _as_datetime(r["created_at"]),
+            }
+            for r in records
+        ])
+        citations = [
+            {
+                "message_id": r["message_id"],
+                "document_id": document_ids.get(c.get("source_path")),
+                "page_number": c.get("page_number"),
+                "created_at": _as_datetime(c.get("created_at") or r["created_at"]),
+            }
+            for r in records
+            for c in r["citations"]
+        ]
+        if citations:
+            conn.execute(text("""
+                INSERT INTO citations (message_id, document_id, page_number, created_at)
+                VALUES (:message_id, :document_id, :page_number, :created_at)
+            """), citations)
+    for key in keys:
+        session_cache.invalidate(*key)
+    return len(records)
+
+
+def _restore_query_logs(engine, records: list[dict]) -> int:
+    with engine.begin() as conn:
+        present = {row[0] for row in conn.execute(_expanding(
+            "SELECT log_id FROM query_logs WHERE log_id IN :ids", "ids"
+        ), {"ids": [r["log_id"] for r in records]})}
+        records = [r for r in records if r["log_id"] not in present]
+        if not records:
+            return 0
+
+        conn.execute(text("""
+            INSERT INTO query_logs (log_id, user_id, question, retrieved_docs, response_time_ms, created_at)
+            VALUES (:log_id, :user_id, :question, :retrieved_docs, :response_time_ms, :created_at)
+        """), [{**{k: v for k, v in r.items() if k != "metrics"}, "created_at": _as_datetime(r["created_at"])}
+               for r in records])
+        metrics = [{"log_id": r["log_id"], **r["metrics"]} for r in records if r.get("metrics")]
+        if metrics:
+            columns = list(metrics[0])
+            conn.execute(text(f"""
+                INSERT INTO query_metrics ({", ".join(columns)}) VALUES ({", ".join(":" + c for c in columns)})
+            """), metrics)
+    return len(records)
+
+
+def restore(engine, path: str, batch_size: int = ARCHIVE_BATCH_SIZE, registry: DocumentRegistry = document_registry) -> int:
+    """Load an archive file back. Rows already present are skipped, so restoring twice is harmless."""
+    restored = 0
+    batch = []
+
+    def flush():
+        nonlocal restored
+        messages = [r for r in batch if "message_id" in r]
+        logs = [r for r in batch if "log_id" in r]
+        if messages:
+            restored += _restore_messages(engine, messages, registry)
+        if logs:
+            restored += _restore_query_logs(engine, logs)
+        batch.clear()
+
+    for record in read_archive(path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return restored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="archive and purge rows older than --days")
+    run_parser.add_argument("--days", type=int, default=RETENTION_DAYS or None, required=not RETENTION_DAYS)
+    restore_parser = commands.add_parser("restore", help="load archive files back")
+    restore_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    from tax_database import engine
+
+    if args.command == "run":
+        print(run_retention(engine, args.days))
+    else:
+        for path in args.paths:
+            print(f"{path}: {restore(engine, path)} rows restored")
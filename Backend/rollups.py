@@ -0,0 +1,367 @@
+# Query-log rollups
+
+# Per-minute, per-hour and per-day aggregates of query_logs, so dashboards
+# read a handful of small rows instead of scanning the log. Each bucket keeps:
+#
+#   queries, total_ms, max_ms exact
+#   latency sketch            log-spaced histogram with 1% relative error;
+#                             buckets merge by adding counts, so hourly and
+#                             daily percentiles come from the same sketches
+#   retrieved_docs            exact distribution {docs: count}
+#   top questions             normalized question counts, the most frequent
+#                             ROLLUP_TOP_QUESTIONS kept per bucket (approximate
+#                             once a bucket has more distinct questions)
+#
+# refresh() folds new query_logs rows in, in log_id order, and records in
+# rollup_state, within the same transaction, the highest log_id it consumed
+# plus the ranges of ids below it that were missing. log_ids are handed out at insert
+# but become visible at commit, so a slow transaction (e.g. a write-behind
+# batch stuck on a lock) can commit a lower id after a higher one was rolled
+# up. Missing ids are looked for again on every run and counted when they
+# show up; after ROLLUP_GAP_SECONDS they are taken to be rolled back. Each
+# row is counted once, whatever order rows commit in. At most
+# ROLLUP_MAX_MISSING_IDS ids in ROLLUP_MAX_GAPS ranges are tracked, oldest
+# dropped first: rolled-back batches burn ids on MySQL, and a burst of them
+# must not grow the state row without bound.
+#
+# The API runs refresh() every ROLLUP_INTERVAL seconds and before answering
+# /admin/analytics; to backfill or rebuild by hand:
+#
+# python rollups.py [--rebuild]
+
+import argparse
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+
+ROLLUP_INTERVAL = int(os.getenv("ROLLUP_INTERVAL", 60))  # seconds, 0 disables the background job
+ROLLUP_GAP_SECONDS = int(os.getenv("ROLLUP_GAP_SECONDS", 3600))  # how long a missing log_id is waited for
+ROLLUP_MAX_MISSING_IDS = int(os.getenv("ROLLUP_MAX_MISSING_IDS", 100000))
+ROLLUP_MAX_GAPS = int(os.getenv("ROLLUP_MAX_GAPS", 1000))
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", 5000))
+ROLLUP_TOP_QUESTIONS = int(os.getenv("ROLLUP_TOP_QUESTIONS", 50))
+
+GRANULARITIES = {
+    "minute": lambda t: t.replace(second=0, microsecond=0),
+    "hour": lambda t: t.replace(minute=0, second=0, microsecond=0),
+    "day": lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+class LatencySketch:
+    """Mergeable quantile sketch: counts per log-spaced bucket (relative error `alpha`)."""
+
+    def __init__(self, bins: dict | None = None, alpha: float = 0.01):
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.bins = Counter({int(k): v for k, v in (bins or {}).items()})
+
+    def add(self, value_ms: float, count: int = 1):
+        self.bins[math.ceil(math.log(max(value_ms, 1.0), self.gamma))] += count
+
+    def merge(self, other: "LatencySketch"):
+        self.bins.update(other.bins)
+
+    @property
+    def count(self) -> int:
+        return sum(self.bins.values())
+
+    def quantile(self, q: float) -> float | None:
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class Rollup:
+    """Aggregates of one bucket."""
+
+    def __init__(self):
+        self.queries = 0
+        self.total_ms = 0
+        self.max_ms = 0
+        self.sketch = LatencySketch()
+        self.retrieved_docs = Counter()
+        self.questions = Counter()
+
+    def add(self, response_time_ms: int, retrieved_docs: int, question: str):
+        response_time_ms = response_time_ms or 0
+        self.queries += 1
+        self.total_ms += response_time_ms
+        self.max_ms = max(self.max_ms, response_time_ms)
+        self.sketch.add(response_time_ms)
+        self.retrieved_docs[int(retrieved_docs or 0)] += 1
+        self.questions[normalize_question(question)] += 1
+
+    def merge(self, other: "Rollup"):
+        self.queries += other.queries
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.sketch.merge(other.sketch)
+        self.retrieved_docs.update(other.retrieved_docs)
+        self.questions.update(other.questions)
+
+    @classmethod
+    def from_row(cls, row) -> "Rollup":
+        rollup = cls()
+        rollup.queries = row.queries
+        rollup.total_ms = row.total_ms
+        rollup.max_ms = row.max_ms
+        rollup.sketch = LatencySketch(json.loads(row.latency_sketch))
+        rollup.retrieved_docs = Counter({int(k): v for k, v in json.loads(row.retrieved_docs).items()})
+        rollup.questions = Counter(json.loads(row.top_questions))
+        return rollup
+
+    def to_row(self) -> dict:
+        return {
+            "queries": self.queries,
+            "total_ms": self.total_ms,
+            "max_ms": self.max_ms,
+            "latency_sketch": json.dumps(self.sketch.bins),
+            "retrieved_docs": json.dumps(self.retrieved_docs),
+            "top_questions": json.dumps(dict(self.questions.most_common(ROLLUP_TOP_QUESTIONS))),
+        }
+
+    def summary(self, top: int = 10) -> dict:
+        quantile = self.sketch.quantile
+        return {
+            "queries": self.queries,
+            "avg_ms": round(self.total_ms / self.queries, 1) if self.queries else None,
+            "p50_ms": _round(quantile(0.50)),
+            "p95_ms": _round(quantile(0.95)),
+            "p99_ms": _round(quantile(0.99)),
+            "max_ms": self.max_ms,
+            "retrieved_docs": {str(k): v for k, v in sorted(self.retrieved_docs.items())},
+            "top_questions": [{"question": q, "count": c} for q, c in self.questions.most_common(top)],
+        }
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def normalize_question(question: str | None) -> str:
+    return " ".join((question or "").lower().split())[:200]
+
+
+def _as_datetime(value) -> datetime:
+    # SQLite returns TIMESTAMP columns as text through text() queries
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+# --------------------------------------------------
+# REFRESH
+# --------------------------------------------------
+def _merge_into(conn, buckets: dict):
+    sqlite = conn.dialect.name == "sqlite"
+    for granularity in GRANULARITIES:
+        keys = [start for g, start in buckets if g == granularity]
+        existing = conn.execute(text("""
+            SELECT * FROM query_log_rollups WHERE granularity = :granularity AND bucket_start IN :starts
+        """).bindparams(bindparam("starts", expanding=True)), {"granularity": granularity, "starts": keys}).fetchall()
+        for row in existing:
+            stored = Rollup.from_row(row)
+            stored.merge(buckets[(granularity, _as_datetime(row.bucket_start))])
+            buckets[(granularity, _as_datetime(row.bucket_start))] = stored
+
+    conn.execute(text(
+        """
+        INSERT INTO query_log_rollups
+            (granularity, bucket_start, queries, total_ms, max_ms, latency_sketch, retrieved_docs, top_questions)
+        VALUES
+            (:granularity, :bucket_start, :queries, :total_ms, :max_ms, :latency_sketch, :retrieved_docs, :top_questions)
+        ON CONFLICT (granularity, bucket_start) DO UPDATE SET
+            queries = excluded.queries, total_ms = excluded.total_ms, max_ms = excluded.max_ms,
+            latency_sketch = excluded.latency_sketch, retrieved_docs = excluded.retrieved_docs,
+            top_questions = excluded.top_questions, updated_at = CURRENT_TIMESTAMP
+        """ if sqlite else """
+        INSERT INTO query_log_rollups
+            (granularity, bucket_start, queries, total_ms, max_ms, latency_sketch, retrieved_docs, top_questions)
+        VALUES
+            (:granularity, :bucket_start, :queries, :total_ms, :max_ms, :latency_sketch, :retrieved_docs, :top_questions)
+        ON DUPLICATE KEY UPDATE
+            queries = VALUES(queries), total_ms = VALUES(total_ms), max_ms = VALUES(max_ms),
+            latency_sketch = VALUES(latency_sketch), retrieved_docs = VALUES(retrieved_docs),
+            top_questions = VALUES(top_questions), updated_at = CURRENT_TIMESTAMP
+        """
+    ), [
+        {"granularity": granularity, "bucket_start": start, **rollup.to_row()}
+        for (granularity, start), rollup in buckets.items()
+    ])
+
+
+def _load_gaps(value: str | None) -> list[list]:
+    """Missing ids as [lo, hi, first_seen] ranges; older releases stored {id: first_seen}."""
+    gaps = json.loads(value or "[]")
+    if isinstance(gaps, dict):
+        return [[int(i), int(i), t] for i, t in gaps.items()]
+    return gaps
+
+
+def _new_gaps(last: int, rows, now: float) -> list[list]:
+    """Ranges of ids above `last` that this batch skipped."""
+    gaps = []
+    for r in rows:
+        if r.log_id > last + 1:
+            gaps.append([last + 1, r.log_id - 1, now])
+        last = r.log_id
+    return gaps
+
+
+def _remove_ids(gaps: list[list], ids) -> list[list]:
+    """Split ranges around ids that have shown up."""
+    ids = sorted(ids)
+    remaining = []
+    for lo, hi, seen in gaps:
+        i = bisect.bisect_left(ids, lo)
+        while i < len(ids) and ids[i] <= hi:
+            if ids[i] > lo:
+                remaining.append([lo, ids[i] - 1, seen])
+            lo = ids[i] + 1
+            i += 1
+        if lo <= hi:
+            remaining.append([lo, hi, seen])
+    return remaining
+
+
+def _cap_gaps(gaps: list[list], max_ids: int, max_gaps: int) -> list[list]:
+    """Keep the newest `max_gaps` ranges and `max_ids` ids, dropping the oldest (lowest ids) first."""
+    gaps = sorted(gaps, key=lambda g: (g[2], g[0]))[-max_gaps:] if max_gaps > 0 else []
+    excess = sum(hi - lo + 1 for lo, hi, _ in gaps) - max_ids
+    capped = []
+    for lo, hi, seen in gaps:
+        if excess > 0:
+            dropped = min(excess, hi - lo + 1)
+            excess -= dropped
+            lo += dropped
+            if lo > hi:
+                continue
+        capped.append([lo, hi, seen])
+    return sorted(capped)
+
+
+def refresh(engine, batch_size: int = ROLLUP_BATCH_SIZE, gap_seconds: int = ROLLUP_GAP_SECONDS,
+            max_missing: int = ROLLUP_MAX_MISSING_IDS, max_gaps: int = ROLLUP_MAX_GAPS) -> int:
+    """Fold query_logs rows not yet rolled up into the rollups. Returns the number of rows consumed."""
+    consumed = 0
+    while True:
+        with engine.begin() as conn:
+            sqlite = conn.dialect.name == "sqlite"
+            # The row lock keeps two workers from consuming the same rows (SQLite has one writer anyway)
+            state = conn.execute(text(
+                "SELECT last_log_id, missing_log_ids FROM rollup_state WHERE name = 'query_logs'"
+                + ("" if sqlite else " FOR UPDATE")
+            )).one()
+            last = state.last_log_id
+            gaps = _load_gaps(state.missing_log_ids)
+
+            rows = conn.execute(text("""
+                SELECT log_id, question, retrieved_docs, response_time_ms, created_at FROM query_logs
+                WHERE log_id > :last
+                ORDER BY log_id
+                LIMIT :limit
+            """), {"last": last, "limit": batch_size}).fetchall()
+            late = conn.execute(text(f"""
+                SELECT log_id, question, retrieved_docs, response_time_ms, created_at FROM query_logs
+                WHERE {" OR ".join(f"log_id BETWEEN :lo_{i} AND :hi_{i}" for i in range(len(gaps)))}
+            """), {
+                key: value for i, (lo, hi, _) in enumerate(gaps) for key, value in ((f"lo_{i}", lo), (f"hi_{i}", hi))
+            }).fetchall() if gaps else []
+
+            # Ids skipped in this batch may still be in an open transaction
+            now = time.time()
+            if rows:
+                gaps.extend(_new_gaps(last, rows, now))
+                last = rows[-1].log_id
+            gaps = _remove_ids(gaps, [r.log_id for r in late])
+            gaps = _cap_gaps([g for g in gaps if now - g[2] < gap_seconds], max_missing, max_gaps)
+
+            buckets = {}
+            for r in rows + late:
+                created_at = _as_datetime(r.created_at)
+                for granularity, truncate in GRANULARITIES.items():
+                    key = (granularity, truncate(created_at))
+                    buckets.setdefault(key, Rollup()).add(r.response_time_ms, r.retrieved_docs, r.question)
+            if buckets:
+                _merge_into(conn, buckets)
+
+            conn.execute(text("""
+                UPDATE rollup_state SET last_log_id = :last, missing_log_ids = :missing WHERE name = 'query_logs'
+            """), {"last": last, "missing": json.dumps(gaps)})
+            consumed += len(rows) + len(late)
+
+        if len(rows) < batch_size:
+            return consumed
+
+
+def rebuild(engine) -> int:
+    """Drop all rollups and recompute them from query_logs."""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM query_log_rollups"))
+        conn.execute(text("""
+            UPDATE rollup_state SET last_log_id = 0, missing_log_ids = NULL WHERE name = 'query_logs'
+        """))
+    return refresh(engine)
+
+
+def start_rollups(engine, interval: int = ROLLUP_INTERVAL):
+    """Run refresh() every `interval` seconds in a daemon thread."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                refresh(engine)
+            except Exception as e:
+                print(f"Query-log rollup error: {e}")
+
+    threading.Thread(target=loop, name="query-log-rollups", daemon=True).start()
+    return stop
+
+
+# --------------------------------------------------
+# READ
+# --------------------------------------------------
+def read_rollups(db, granularity: str, start: datetime | None = None, end: datetime | None = None,
+                 limit: int = 60, top: int = 10) -> dict:
+    """The latest `limit` buckets of `granularity` in [start, end), oldest first, plus their merged total."""
+    rows = db.execute(text(f"""
+        SELECT * FROM query_log_rollups
+        WHERE granularity = :granularity
+        {"AND bucket_start >= :start" if start else ""}
+        {"AND bucket_start < :end" if end else ""}
+        ORDER BY bucket_start DESC
+        LIMIT :limit
+    """), {"granularity": granularity, "start": start, "end": end, "limit": limit}).fetchall()
+
+    total = Rollup()
+    buckets = []
+    for row in reversed(rows):
+        rollup = Rollup.from_row(row)
+        total.merge(rollup)
+        buckets.append({"bucket_start": _as_datetime(row.bucket_start).isoformat(), **rollup.summary(top)})
+    return {"granularity": granularity, "total": total.summary(top), "buckets": buckets}
+
+
+if __name__ == "__main__":
+    from tax_database import engine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild", action="store_true", help="recompute all rollups from query_logs")
+    args = parser.parse_args()
+
+    consumed = rebuild(engine) if args.rebuild else refresh(engine)
+    print(f"Rolled up {consumed} query log rows")
@@ -0,0 +1,157 @@
+# Conversation history read path
+
+# /session pages are read from chat_sessions/messages/citations and kept in a
+# small per-process LRU cache with a TTL. Writing a turn (write_behind.py)
+# invalidates the cached pages of its thread. A reader that fetched its page
+# before such an invalidation does not cache it: put() checks the generation
+# the reader started from.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text, bindparam
+
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1024))  # threads
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 60))  # seconds
+SESSION_PAGE_LIMIT = 50
+
+
+class SessionCache:
+    """
+    LRU cache of session pages keyed by (user_id, thread_id).
+    Each entry holds the pages fetched for that thread and expires after `ttl` seconds.
+    Invalidations are stamped with a generation, remembered for the `maxsize`
+    most recently invalidated threads; older stamps only raise `_floor`.
+    """
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: int = SESSION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (user_id, thread_id) -> (expires_at, {page_key: page})
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated = OrderedDict()  # (user_id, thread_id) -> generation of its last invalidation
+        self._floor = 0  # newest generation dropped from _invalidated
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, thread_id: str, page_key):
+        key = (user_id, thread_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic() and page_key in entry[1]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1][page_key]
+            self.misses += 1
+            return None
+
+    def generation(self) -> int:
+        """Take before fetching a page and pass to put(), so a page read before an invalidation is dropped."""
+        with self._lock:
+            return self._generation
+
+    def put(self, user_id: int, thread_id: str, page_key, page, generation: int | None = None):
+        key = (user_id, thread_id)
+        with self._lock:
+            if generation is not None and max(self._invalidated.get(key, 0), self._floor) > generation:
+                return
+            entry = self._entries.get(key)
+            if not entry or entry[0] <= time.monotonic():
+                entry = (time.monotonic() + self.ttl, {})
+                self._entries[key] = entry
+            entry[1][page_key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int, thread_id: str):
+        key = (user_id, thread_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, dropped = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, dropped)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+session_cache = SessionCache()
+
+
+def fetch_session_page(db, user_id: int, thread_id: str, before: int | None = None,
+                       limit: int = SESSION_PAGE_LIMIT):
+    """
+    Return up to `limit` messages of the user's thread older than message_id `before`
+    (newest page when `before` is None), in chronological order.
+    """
+    rows = db.execute(text(f"""
+        SELECT m.message_id, m.role, m.content, m.created_at
+        FROM chat_sessions s
+        JOIN messages m ON m.session_id = s.session_id
+        WHERE s.user_id = :user_id AND s.title = :thread_id
+        {"AND m.message_id < :before" if before is not None else ""}
+        ORDER BY m.message_id DESC
+        LIMIT :limit
+    """), {"user_id": user_id, "thread_id": thread_id, "before": before, "limit": limit + 1}).fetchall()
+
+    has_more = len(rows) > limit
+    rows = list(reversed(rows[:limit]))
+
+    citations = {}
+    assistant_ids = [r.message_id for r in rows if r.role == "assistant"]
+    if assistant_ids:
+        citation_rows = db.execute(text("""
+            SELECT c.message_id, d.source_path, c.page_number, d.document_type
+            FROM citations c
+            LEFT JOIN documents d ON d.document_id = c.document_id
+            WHERE c.message_id IN :ids
+            ORDER BY c.citation_id
+        """).bindparams(bindparam("ids", expanding=True)), {"ids": assistant_ids}).fetchall()
+        for c in citation_rows:
+            citations.setdefault(c.message_id, []).append({
+                "source_path": c.source_path,
+                "page_number": c.page_number,
+                "document_type": c.document_type
+            })
+
+    messages = []
+    for r in rows:
+        entry = {
+            "message_id": r.message_id,
+            "role": r.role,
+            "content": r.content,
+            "created_at": r.created_at.isoformat() if hasattr(r.created_at, "isoformat") else r.created_at
+        }
+        if r.role == "assistant":
+            entry["metadata"] = {"citations": citations.get(r.message_id, [])}
+        messages.append(entry)
+
+    return {
+        "messages": messages,
+        "next_before": rows[0].message_id if has_more and rows else None
+    }
+
+
+def get_session_history(db, user_id: int, thread_id: str, before: int | None = None,
+                        limit: int = SESSION_PAGE_LIMIT):
+    """Read-through cached version of fetch_session_page."""
+    page_key = (before, limit)
+    page = session_cache.get(user_id, thread_id, page_key)
+    if page is None:
+        generation = session_cache.generation()
+        page = fetch_session_page(db, user_id, thread_id, before, limit)
+        session_cache.put(user_id, thread_id, page_key, page, generation)
+    return page
+
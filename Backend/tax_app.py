@@ -1,22 +1,52 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, Literal
+from datetime import datetime
+from contextlib import asynccontextmanager, nullcontext
 from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 import bcrypt
 import os
 import time
 
-from rag_core import TaxRAGAgent
-from tax_database import db
-from middleware import create_token, verify_token
+from rag_core import TaxRAGAgent, REQUEST_SLO_SECONDS
+from tax_database import engine, async_engine, get_async_db, Session as SessionFactory
+from middleware import create_token, verify_token, require_admin
+from admins import AdminFlagCache, is_admin
+from admission import AdmissionController, AdmissionRejected, user_priority
+from tracing import start_trace, span, add_trace_listener, current_trace
+from profiler import profile_request
+from checkpointer import checkpointer_stats
+import metrics
+from session_store import get_session_history, session_cache, SESSION_PAGE_LIMIT
+from write_behind import WriteBehindQueue, WRITE_BEHIND, turn_record, write_turns
+from migrations import migrate, DB_AUTO_MIGRATE
+from documents import document_registry
+from rollups import read_rollups, start_rollups, refresh as refresh_rollups, ROLLUP_INTERVAL
+from retention import start_retention, RETENTION_DAYS
+from export import EXPORTERS, MEDIA_TYPES, iter_messages
 
 
 # App & Configuration
 load_dotenv()
 
-app = FastAPI(title="Nigeria Tax RAG Agent API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Replay turns journaled by an earlier run now, not on the first /query
+    if WRITE_BEHIND:
+        write_queue.start()
+    yield
+    # Drain queued turns (or journal them) before the worker thread can be killed
+    await run_in_threadpool(write_queue.close)
+    # Close pooled async connections while the event loop is still running
+    await async_engine.dispose()
+
+
+app = FastAPI(title="Nigeria Tax RAG Agent API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,24 +58,127 @@ app.add_middleware(
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Bring the schema up to date (a single SELECT when it already is)
+if DB_AUTO_MIGRATE:
+    migrate(engine)
+
+# Query-log rollups for /admin/analytics, kept current in the background
+if ROLLUP_INTERVAL > 0:
+    start_rollups(engine)
+
+# Archive and purge chat history and query logs past the retention window
+if RETENTION_DAYS > 0:
+    start_retention(engine)
+
 tax_agent = TaxRAGAgent(
     chroma_dir=os.path.join(BASE_DIR, "chroma_db_agentic_tax_rag")
 )
 
 TOKEN_TIME = int(os.getenv("TOKEN_TIME", 3600))
 
+admission = AdmissionController()
+admin_flags = AdminFlagCache()
+
+# Chat history and query logs are written after the response (see write_behind.py)
+write_queue = WriteBehindQueue(SessionFactory)
+
+
+# Metrics
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        metrics.http_requests.inc(route=path, method=request.method, status=status)
+        metrics.http_latency.observe(time.perf_counter() - start, route=path, method=request.method)
+
+
+add_trace_listener(metrics.observe_trace)
+
+
+@metrics.registry.collector
+def collect_runtime_metrics():
+    adm = admission.stats()
+    yield "graph_executions_in_flight", "gauge", "Agent graph executions running", [({}, tax_agent.in_flight)]
+    yield "admission_active", "gauge", "Admitted /query requests running", [({}, adm["active"])]
+    yield "admission_queue_depth", "gauge", "/query requests waiting for a slot", [({}, adm["queue_depth"])]
+    yield "admission_rejected_total", "counter", "/query requests rejected", [
+        ({"reason": "queue_full"}, adm["rejected"]), ({"reason": "timeout"}, adm["timed_out"])
+    ]
+
+    sf = tax_agent.single_flight.stats()
+    yield "coalesced_requests_total", "counter", "Requests that shared another request's graph execution", [
+        ({}, sf["coalesced"])
+    ]
+
+    yield "cache_requests_total", "counter", "Cache lookups by cache and result", [
+        ({"cache": "session", "result": "hit"}, session_cache.hits),
+        ({"cache": "session", "result": "miss"}, session_cache.misses),
+    ] + ([
+        ({"cache": "llm", "result": "hit"}, tax_agent.llm_cache.hits),
+        ({"cache": "llm", "result": "miss"}, tax_agent.llm_cache.misses),
+    ] if tax_agent.llm_cache else [])
+    yield "session_cache_threads", "gauge", "Threads held in the /session read cache", [({}, len(session_cache))]
+    yield "document_ids_cached", "gauge", "source_path -> document_id entries cached", [({}, len(document_registry))]
+
+    cp = checkpointer_stats(tax_agent.checkpointer)
+    yield "checkpointer_threads", "gauge", "Threads held by the graph checkpointer", [({}, cp.get("threads", 0))]
+    yield "checkpointer_checkpoints", "gauge", "Checkpoints held by the graph checkpointer", [
+        ({}, cp.get("checkpoints", 0))
+    ]
+
+    wb = write_queue.stats()
+    yield "write_behind_queue_depth", "gauge", "Turns waiting to be written", [({}, wb["queue_depth"])]
+    yield "write_behind_turns_total", "counter", "Turns by write-behind outcome", [
+        ({"outcome": "written"}, wb["written"]),
+        ({"outcome": "journaled"}, wb["journaled"]),
+        ({"outcome": "queue_full"}, wb["rejected"]),
+    ]
+
+    pools = [(name, e.pool) for name, e in (("sync", engine), ("async", async_engine)) if hasattr(e.pool, "checkedout")]
+    if pools:
+        yield "db_pool_connections", "gauge", "Database pool connections by engine and state", [
+            ({"engine": name, "state": state}, value)
+            for name, pool in pools
+            for state, value in (
+                ("checked_out", pool.checkedout()),
+                ("idle", pool.checkedin()),
+                ("overflow", max(pool.overflow(), 0)),
+            )
+        ]
+
+    tiers = tax_agent.tier_stats.snapshot()
+    yield "llm_tokens_total", "counter", "LLM tokens by model tier and direction", [
+        ({"tier": tier, "direction": direction}, t[f"{direction}_tokens"])
+        for tier, t in tiers.items()
+        for direction in ("input", "output")
+    ]
+    yield "llm_calls_total", "counter", "LLM calls by model tier", [
+        ({"tier": tier}, t["calls"]) for tier, t in tiers.items()
+    ]
+    yield "llm_circuit_open", "gauge", "1 while the LLM circuit breaker is open", [
+        ({}, int(tax_agent.llm_breaker.state == "open"))
+    ]
+
 
 # Models
 class QueryRequest(BaseModel):
     question: str = Field(..., example="What does the Nigerian Tax Reform Bill say about VAT?")
     thread_id: Optional[str] = "default"
+    mode: Literal["agent", "extractive"] = Field("agent", description="'extractive' answers from retrieved sentences without the LLM")
 
 
 class RegDetails(BaseModel):
     name: str = Field(..., example="Sherif Oke")
     email: str = Field(..., example="oke@gmail.com")
     password: str = Field(..., example="ade121")
-    userType: str = Field(..., example="taxpayer")
+    userType: Literal["taxpayer", "consultant", "business", "student"] = Field(..., example="taxpayer")
     gender: str = Field(..., example="male")
 
 
@@ -55,65 +188,17 @@ class LoginRequest(BaseModel):
 
 
 
-def save_chat_to_db(user_id: int, thread_id: str, question: str, answer: str, sources: list[dict]):
-    """
-    Save session, messages, citations, and metrics to the database.
-    """
-    # Create or get session
-    session_query = text("""
-        SELECT session_id FROM chat_sessions 
-        WHERE user_id = :user_id AND title = :thread_id
-    """)
-    session = db.execute(session_query, {"user_id": user_id, "thread_id": thread_id}).fetchone()
-
-    if session:
-        session_id = session.session_id
-        db.execute(text("""
-            UPDATE chat_sessions SET last_active = CURRENT_TIMESTAMP
-            WHERE session_id = :session_id
-        """), {"session_id": session_id})
-    else:
-        insert_session = text("""
-            INSERT INTO chat_sessions (user_id, title)
-            VALUES (:user_id, :thread_id)
-        """)
-        result = db.execute(insert_session, {"user_id": user_id, "thread_id": thread_id})
-        db.commit()
-        session_id = result.lastrowid
-
-    # Save user question
-    user_msg = db.execute(text("""
-        INSERT INTO messages (session_id, role, content)
-        VALUES (:session_id, 'user', :content)
-    """), {"session_id": session_id, "content": question})
-    db.commit()
-    user_msg_id = user_msg.lastrowid
-
-    # Save assistant answer
-    assistant_msg = db.execute(text("""
-        INSERT INTO messages (session_id, role, content)
-        VALUES (:session_id, 'assistant', :content)
-    """), {"session_id": session_id, "content": answer})
-    db.commit()
-    assistant_msg_id = assistant_msg.lastrowid
-
-    # Save citations (if any)
-    for source in sources:
-        db.execute(text("""
-            INSERT INTO citations (message_id, source_path, page_number, document_type)
-            VALUES (:message_id, :source_path, :page_number, :document_type)
-        """), {
-            "message_id": assistant_msg_id,
-        "source_path": source["source_path"],
-        "page_number": source["page_number"],
-        "document_type": source["document_type"]
-        })
-    db.commit()
-
-    return session_id, user_msg_id, assistant_msg_id
+def agent_thread_id(user_id: int, thread_id: str) -> str:
+    """Graph threads are namespaced per user so clients cannot share memory."""
+    return f"{user_id}:{thread_id}"
 
 
 # Routes
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return metrics.registry.render()
+
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Nigeria Tax RAG API"}
@@ -121,34 +206,37 @@ def root():
 
 # AUTH 
 @app.post("/signup")
-def signup(input: RegDetails):
+async def signup(input: RegDetails, db: AsyncSession = Depends(get_async_db)):
     try:
         check_query = text("""
             SELECT user_id FROM users WHERE email = :email
         """)
-        existing = db.execute(check_query, {"email": input.email}).fetchone()
+        existing = (await db.execute(check_query, {"email": input.email})).fetchone()
 
         if existing:
             raise HTTPException(status_code=400, detail="Email already exists")
 
-        hashed_pw = bcrypt.hashpw(
+        # bcrypt is CPU-bound by design: run it off the event loop, without holding a pooled connection
+        await db.close()
+        hashed_pw = (await run_in_threadpool(
+            bcrypt.hashpw,
             input.password.encode("utf-8"),
             bcrypt.gensalt()
-        ).decode("utf-8")
+        )).decode("utf-8")
 
         insert_query = text("""
             INSERT INTO users (name, email, password, userType, gender)
             VALUES (:name, :email, :password, :userType, :gender)
         """)
 
-        db.execute(insert_query, {
+        await db.execute(insert_query, {
             "name": input.name,
             "email": input.email,
             "password": hashed_pw,
             "userType": input.userType,
             "gender": input.gender
         })
-        db.commit()
+        await db.commit()
 
         return {
             "message": "User created successfully",
@@ -166,17 +254,20 @@ def signup(input: RegDetails):
 
 
 @app.post("/login")
-def login(input: LoginRequest):
+async def login(input: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     try:
         query = text("""
             SELECT * FROM users WHERE email = :email
         """)
-        user = db.execute(query, {"email": input.email}).fetchone()
+        user = (await db.execute(query, {"email": input.email})).fetchone()
 
         if not user:
             raise HTTPException(status_code=401, detail="Invalid email or password")
 
-        if not bcrypt.checkpw(
+        # bcrypt is CPU-bound by design: run it off the event loop, without holding a pooled connection
+        await db.close()
+        if not await run_in_threadpool(
+            bcrypt.checkpw,
             input.password.encode("utf-8"),
             user.password.encode("utf-8")
         ):
@@ -204,77 +295,170 @@ def login(input: LoginRequest):
 
 
 # TAX RAG
+def run_agent_turn(payload: QueryRequest, user_id: int, start_time: float, profile: bool):
+    """The blocking part of /query (the graph run), run in the threadpool once admitted."""
+    with profile_request(current_trace(), profile):
+        with span("agent", "agent"):
+            return tax_agent.run_with_memory(
+                payload.question,
+                agent_thread_id(user_id, payload.thread_id),
+                deadline=start_time + REQUEST_SLO_SECONDS,
+                mode=payload.mode
+            )
+
+
 @app.post("/query")
-def query_tax_agent(payload: QueryRequest, user_data=Depends(verify_token)):
+async def query_tax_agent(
+    payload: QueryRequest,
+    request: Request,
+    profile: bool = Query(False, description="Profile this request (admin only); same as the X-Profile: 1 header"),
+    user_data=Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
     Run TaxRAGAgent and save chat + citations + metrics.
     """
     user_id = user_data["user_id"]
     start_time = time.time()
 
-    try:
-        # Run RAG agent
-        result = tax_agent.run_with_memory(
-            payload.question,
-            payload.thread_id
-        )
+    profile = profile or request.headers.get("X-Profile") == "1"
 
-        # Extract structured response
-        messages = result.get("messages", [])
-
-        assistant_content = ""
-        citations = []
-
-        for msg in messages:
-            # Assistant message
-            if msg["role"] == "assistant":
-                assistant_content = msg["content"]
-                citations = msg.get("metadata", {}).get("citations", [])
-
-        # Save session + messages + citations
-        save_chat_to_db(
-            user_id=user_id,
-            thread_id=payload.thread_id,
-            question=payload.question,
-            answer=assistant_content,
-            sources=citations
-        )
-
-        # Save query metrics
-        duration_ms = int((time.time() - start_time) * 1000)
-
-        db.execute(text("""
-            INSERT INTO query_logs (user_id, question, retrieved_docs, response_time_ms)
-            VALUES (:user_id, :question, :retrieved_docs, :response_time_ms)
-        """), {
-            "user_id": user_id,
-            "question": payload.question,
-            "retrieved_docs": len(citations),
-            "response_time_ms": duration_ms
-        })
-        db.commit()
+    try:
+        # Profiling is an access check, so it reads the flag fresh; priority can use the cache
+        try:
+            admin = await (is_admin(db, user_id) if profile else admin_flags.get(db, user_id))
+        except Exception as e:
+            print(f"Admin lookup failed, queueing by userType: {e}")
+            admin = False
+        finally:
+            await db.close()  # don't hold a pooled connection for the whole graph run
+
+        if profile and not admin:
+            raise HTTPException(status_code=403, detail="Profiling is limited to admin users")
+
+        with start_trace("query", user_id=user_id, mode=payload.mode) as trace:
+            # LLM-bound requests queue on the event loop when busy, without holding a worker thread
+            slot = nullcontext() if payload.mode == "extractive" else admission.slot(
+                user_priority(user_data.get("userType"), admin)
+            )
+            async with slot:
+                result = await run_in_threadpool(run_agent_turn, payload, user_id, start_time, profile)
+
+            # Extract structured response
+            messages = result.get("messages", [])
+
+            assistant_content = ""
+            citations = []
+
+            for msg in messages:
+                # Assistant message
+                if msg["role"] == "assistant":
+                    assistant_content = msg["content"]
+                    citations = msg.get("metadata", {}).get("citations", [])
+
+            duration_ms = int((time.time() - start_time) * 1000)
+
+            # Session, messages, citations, query log and per-stage metrics for this turn
+            record = turn_record(
+                user_id=user_id,
+                thread_id=payload.thread_id,
+                question=payload.question,
+                answer=assistant_content,
+                sources=citations,
+                response_time_ms=duration_ms,
+                metrics=trace.summary()
+            )
+
+            # Written in the background; synchronously when write-behind is off or its queue is full
+            if not (WRITE_BEHIND and write_queue.submit(record)):
+                with span("persist_turn", "db"):
+                    await db.run_sync(write_turns, [record])
+                    await db.commit()
+                session_cache.invalidate(user_id, payload.thread_id)
 
         # Return response to frontend
         return result
 
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/session/{thread_id}")
-def get_session(thread_id: str, user_data=Depends(verify_token)):
+async def get_session(
+    thread_id: str,
+    before: Optional[int] = Query(None, description="Return messages older than this message_id"),
+    limit: int = Query(SESSION_PAGE_LIMIT, ge=1, le=200),
+    user_data=Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if write_queue.pending(user_data["user_id"], thread_id):
+        await run_in_threadpool(write_queue.wait_for, user_data["user_id"], thread_id)
+    page = await db.run_sync(get_session_history, user_data["user_id"], thread_id, before, limit)
     return {
         "thread_id": thread_id,
-        "messages": tax_agent.get_session(thread_id)
+        "messages": page["messages"],
+        "next_before": page["next_before"]
     }
 
 
 @app.post("/reset/{thread_id}")
-def reset_session(thread_id: str, user_data=Depends(verify_token)):
-    tax_agent.reset_session(thread_id)
+async def reset_session(thread_id: str, user_data=Depends(verify_token)):
+    """Clear the agent's memory of the thread. The persisted chat history is kept (see /export)."""
+    user_id = user_data["user_id"]
+    try:
+        await run_in_threadpool(tax_agent.reset_session, agent_thread_id(user_id, thread_id))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    session_cache.invalidate(user_id, thread_id)
     return {"status": f"Session '{thread_id}' reset successfully"}
 
 
+@app.get("/export")
+async def export_history(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    thread_id: Optional[str] = Query(None, description="Export only this thread"),
+    start: Optional[datetime] = Query(None, description="Messages created from this time on"),
+    end: Optional[datetime] = Query(None, description="Messages created before this time"),
+    user_data=Depends(verify_token)
+):
+    """Stream all of the user's threads, messages and citations (see export.py)."""
+    user_id = user_data["user_id"]
+    # Include turns still queued for writing, as /session does
+    if write_queue.pending(user_id, thread_id):
+        await run_in_threadpool(write_queue.wait_for, user_id, thread_id)
+    messages = iter_messages(async_engine, user_id, thread_id, start, end)
+    return StreamingResponse(
+        EXPORTERS[format](messages),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="chat-history-{user_id}.{format}"'}
+    )
+
+
+# ADMIN
+@app.get("/admin/analytics")
+async def query_analytics(
+    granularity: Literal["minute", "hour", "day"] = "hour",
+    start: Optional[datetime] = Query(None, description="First bucket to include"),
+    end: Optional[datetime] = Query(None, description="Exclude buckets from this time on"),
+    limit: int = Query(48, ge=1, le=1440, description="Latest buckets returned"),
+    top: int = Query(10, ge=0, le=50, description="Top questions per bucket"),
+    user_data=Depends(require_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Query volume, latency percentiles, retrieved_docs distribution and top questions per time bucket."""
+    # Fold in what was logged since the last background run (usually a few rows)
+    await run_in_threadpool(refresh_rollups, engine)
+    return await db.run_sync(read_rollups, granularity, start, end, limit, top)
+
+
 # DEBUG
 @app.get("/debug/retrieval")
 def debug_retrieval(user_data=Depends(verify_token)):
@@ -294,6 +478,32 @@ def debug_retrieval(user_data=Depends(verify_token)):
         ]
     }
 
+
+@app.get("/debug/coalescing")
+def debug_coalescing(user_data=Depends(verify_token)):
+    """Graph executions run vs. saved by sharing identical first-turn questions."""
+    return tax_agent.single_flight.stats()
+
+
+@app.get("/debug/tiers")
+def debug_tiers(user_data=Depends(verify_token)):
+    """Calls, average latency and token usage per model tier."""
+    return tax_agent.tier_stats.snapshot()
+
+
+@app.get("/debug/llm-cache")
+def debug_llm_cache(user_data=Depends(verify_token)):
+    """Hit/miss counters and size of the LLM response cache."""
+    if not tax_agent.llm_cache:
+        return {"enabled": False}
+    return {"enabled": True, **tax_agent.llm_cache.stats()}
+
+
+@app.get("/debug/admission")
+def debug_admission(user_data=Depends(verify_token)):
+    """Concurrency, queue depth and wait times of /query admission control."""
+    return admission.stats()
+
 # To run the app, use the command:
 # cd /c:/Users/USER/Desktop/Nig_Tax_Rag/nigeria_tax_rag/Backend
 # uvicorn tax_app:app --reload
\ No newline at end of file
@@ -1,83 +1,101 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from dotenv import load_dotenv
-from pymysql.constants import CLIENT
 import os 
 
 load_dotenv()
 
 
-# Build DB URL from environment variables
-db_url = f'mysql+pymysql://{os.getenv("dbuser")}:{os.getenv("dbpassword")}@{os.getenv("dbhost")}:{os.getenv("dbport")}/{os.getenv("dbname")}'
-
-# Create engine with support for multiple statements
-engine = create_engine(db_url, connect_args={"client_flag": CLIENT.MULTI_STATEMENTS})
-
-
-# Create session
-Session = sessionmaker(bind=engine)
-db = Session()
-
-
-# Define all create table queries
-create_table_query = text("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id INT AUTO_INCREMENT PRIMARY KEY,
-    name VARCHAR(100),
-    email VARCHAR(100) UNIQUE,
-    password VARCHAR(100) NOT NULL,
-    userType VARCHAR(50) NOT NULL,
-    gender VARCHAR(10) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
- 
-CREATE TABLE IF NOT EXISTS chat_sessions (
-    session_id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT,
-    title VARCHAR(150),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(user_id)
-);
-
-
-CREATE TABLE IF NOT EXISTS messages (
-    message_id INT AUTO_INCREMENT PRIMARY KEY,
-    session_id INT,
-    role VARCHAR(20) CHECK (role IN ('user', 'assistant')),
-    content TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id)
-);
-
-
-CREATE TABLE IF NOT EXISTS citations (
-    citation_id INT AUTO_INCREMENT PRIMARY KEY,
-    message_id INT,
-    source_path TEXT,
-    page_number INT,
-    document_type VARCHAR(50),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (message_id) REFERENCES messages(message_id)
-);
-
- 
-CREATE TABLE IF NOT EXISTS query_logs (
-    log_id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT,
-    question TEXT,
-    retrieved_docs INT,
-    response_time_ms INT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(user_id)
-);
-""")
-
-db.execute(create_table_query)
-db.commit()
-
-print("All Tax RAG tables created successfully.")
-
-# To run the app, use the command:
-# python tax_database.py
\ No newline at end of file
+# Backend: "mysql" (production) or "sqlite" (a local file, no server needed;
+# used for development and the benchmarks). The schema is the same on both,
+# see migrations.py.
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tax_rag.sqlite"))
+
+# Connection pool. Each request checks a connection out only while its
+# transaction is open, so the pool needs roughly as many connections as
+# requests writing to the database at the same moment.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # below MySQL's wait_timeout
+DB_ASYNC_DRIVER = os.getenv("DB_ASYNC_DRIVER", "aiomysql")  # or "asyncmy"
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 30))  # seconds a writer waits for the lock
+
+
+def _tune_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; synchronous=NORMAL
+    # only fsyncs at checkpoints, which is safe in WAL mode.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000}")
+    cursor.close()
+
+
+def create_engines(backend: str = DB_BACKEND, sqlite_path: str = SQLITE_PATH):
+    """The (sync, async) engine pair for `backend`."""
+    pool = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+    if backend == "sqlite":
+        sync_engine = create_engine(
+            f"sqlite:///{sqlite_path}",
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT},
+            **pool
+        )
+        async_engine = create_async_engine(
+            f"sqlite+aiosqlite:///{sqlite_path}", connect_args={"timeout": SQLITE_BUSY_TIMEOUT}, **pool
+        )
+        event.listen(sync_engine, "connect", _tune_sqlite)
+        event.listen(async_engine.sync_engine, "connect", _tune_sqlite)
+        return sync_engine, async_engine
+
+    if backend == "mysql":
+        credentials = f'{os.getenv("dbuser")}:{os.getenv("dbpassword")}@{os.getenv("dbhost")}:{os.getenv("dbport")}/{os.getenv("dbname")}'
+        return (
+            create_engine(f"mysql+pymysql://{credentials}", **pool),
+            # Async engine for the request path: endpoints await their queries on
+            # the event loop instead of holding a threadpool thread per open
+            # connection. The sync engine serves migrations, build_index.py and
+            # the write-behind worker thread.
+            create_async_engine(f"mysql+{DB_ASYNC_DRIVER}://{credentials}", **pool),
+        )
+
+    raise ValueError(f"Unknown DB_BACKEND {backend!r}, expected 'mysql' or 'sqlite'")
+
+
+engine, async_engine = create_engines()
+
+
+# Session factories: one session per request, never shared between threads or tasks
+Session = sessionmaker(bind=engine, autoflush=False)
+AsyncSession = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    """FastAPI dependency yielding a request-scoped session, rolled back on error."""
+    async with AsyncSession() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
+
+
+# Schema changes are versioned in migrations.py
+if __name__ == "__main__":
+    from migrations import migrate
+
+    applied = migrate(engine)
+    print(f"Applied migrations: {applied or 'none, schema is up to date'}")
+
+# To create or upgrade the tables, use the command:
+# python migrations.py
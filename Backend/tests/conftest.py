@@ -0,0 +1,44 @@
+# Tests run from the Backend directory without OpenAI or MySQL:
+# python -m pytest tests
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """tax_database pointed at a migrated temporary SQLite file."""
+    from benchmarks.offline import local_database
+    from documents import document_registry
+    from session_store import session_cache
+
+    document_registry.clear()
+    session_cache.clear()
+    tax_database = local_database(str(tmp_path / "tax.sqlite"))
+    yield tax_database
+    tax_database.engine.dispose()
+    asyncio.run(tax_database.async_engine.dispose())
+    document_registry.clear()
+    session_cache.clear()
+
+
+@pytest.fixture
+def make_agent(tmp_path):
+    """Build a TaxRAGAgent on the offline fake model, embeddings and corpus (benchmarks/offline.py)."""
+    from benchmarks.offline import install_offline_agent
+    from checkpointer import build_checkpointer
+
+    chroma_dir = install_offline_agent(str(tmp_path))
+    import rag_core
+
+    def make(**kwargs):
+        return rag_core.TaxRAGAgent(chroma_dir, checkpointer=build_checkpointer("memory"), **kwargs)
+
+    return make
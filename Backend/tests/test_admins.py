@@ -0,0 +1,58 @@
+import asyncio
+
+from admins import AdminFlagCache
+
+
+class FakeDB:
+    """Stands in for an AsyncSession: counts is_admin queries and answers from `admins`."""
+
+    def __init__(self, admins):
+        self.admins = admins
+        self.queries = 0
+
+    async def execute(self, statement, params):
+        self.queries += 1
+        admin = params["user_id"] in self.admins
+
+        class Result:
+            def scalar(self):
+                return admin
+
+        return Result()
+
+
+def test_flags_are_reused_within_the_ttl():
+    db = FakeDB({1})
+    cache = AdminFlagCache(ttl=60)
+
+    async def run():
+        return [await cache.get(db, user_id) for user_id in (1, 2, 1, 2)]
+
+    assert asyncio.run(run()) == [True, False, True, False]
+    assert db.queries == 2
+
+
+def test_expired_flags_are_read_again():
+    db = FakeDB({1})
+    cache = AdminFlagCache(ttl=0)
+
+    async def run():
+        first = await cache.get(db, 1)
+        db.admins = set()  # revoked
+        return first, await cache.get(db, 1)
+
+    assert asyncio.run(run()) == (True, False)
+    assert db.queries == 2
+
+
+def test_oldest_users_are_evicted_past_max_entries():
+    db = FakeDB(set())
+    cache = AdminFlagCache(ttl=60, max_entries=2)
+
+    async def run():
+        for user_id in (1, 2, 3, 1):
+            await cache.get(db, user_id)
+
+    asyncio.run(run())
+    assert len(cache) == 2
+    assert db.queries == 4  # user 1 was evicted by user 3
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+import metrics
+from admission import ADMIN_PRIORITY, DEFAULT_PRIORITY, AdmissionController, AdmissionRejected, user_priority
+
+
+async def _queue_behind_one_active(controller, priorities):
+    """Fill the single slot, then queue one waiter per priority; returns the order they are admitted in."""
+    await controller.acquire()
+    admitted = []
+
+    async def wait(priority, label):
+        await controller.acquire(priority)
+        admitted.append(label)
+
+    tasks = [asyncio.create_task(wait(p, label)) for label, p in priorities]
+    await asyncio.sleep(0)
+    assert controller.stats()["queue_depth"] == len(priorities)
+
+    for _ in priorities:
+        controller.release()
+        await asyncio.sleep(0)
+    controller.release()
+    await asyncio.gather(*tasks)
+    return admitted
+
+
+def test_queue_admits_by_priority_then_arrival():
+    controller = AdmissionController(max_concurrent=1, max_queued=10, queue_timeout=5)
+    order = asyncio.run(_queue_behind_one_active(controller, [
+        ("student", 2), ("admin", 0), ("consultant", 1), ("taxpayer", 2), ("unknown", DEFAULT_PRIORITY)
+    ]))
+    assert order == ["admin", "consultant", "student", "taxpayer", "unknown"]
+    assert controller.active == 0
+    assert controller.stats()["admitted"] == 6
+
+
+def test_full_queue_is_rejected_with_429():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queued=1, queue_timeout=5)
+        await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after >= 1
+
+        controller.release()
+        await waiter
+        controller.release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.stats()["rejected"] == 1
+    assert controller.active == 0
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queued=10, queue_timeout=5)
+        await controller.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire(timeout=0.05)
+        assert rejected.value.status_code == 503
+        assert controller.stats()["queue_depth"] == 0
+
+        # The timed-out waiter must not be handed the slot later
+        controller.release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.stats()["timed_out"] == 1
+    assert controller.active == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queued=10, queue_timeout=5)
+        async with controller.slot():
+            cancelled = asyncio.create_task(controller.acquire(ADMIN_PRIORITY))
+            waiter = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            assert controller.stats()["queue_depth"] == 1
+        await waiter
+        assert controller.active == 1
+        controller.release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.active == 0
+
+
+def test_user_priority():
+    assert user_priority("consultant", admin=True) == ADMIN_PRIORITY
+    assert user_priority("Consultant") < user_priority("taxpayer")
+    assert user_priority("admin") == DEFAULT_PRIORITY
+    assert user_priority(None) == DEFAULT_PRIORITY
+
+
+def test_waits_are_observed_in_the_histogram():
+    priority = 7  # a label no other test uses
+    before = metrics.admission_wait.render()
+
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queued=10, queue_timeout=5)
+        await controller.acquire(priority)
+        waiter = asyncio.create_task(controller.acquire(priority))
+        await asyncio.sleep(0.02)
+        controller.release()
+        await waiter
+        controller.release()
+
+    asyncio.run(run())
+    lines = [line for line in metrics.admission_wait.render() if f'priority="{priority}"' in line]
+    assert not [line for line in before if f'priority="{priority}"' in line]
+    assert f'admission_wait_seconds_count{{priority="{priority}"}} 2' in lines
+    # One immediate admission, one that queued for at least 20ms
+    assert f'admission_wait_seconds_bucket{{priority="{priority}",le="0.005"}} 1' in lines
@@ -0,0 +1,82 @@
+import sqlite3
+import time
+from typing import TypedDict
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, StateGraph
+
+from checkpointer import CompactingSqliteSaver
+
+
+class CounterState(TypedDict):
+    count: int
+
+
+def _graph(saver):
+    builder = StateGraph(CounterState)
+    builder.add_node("step", lambda state: {"count": state.get("count", 0) + 1})
+    builder.add_edge(START, "step")
+    builder.add_edge("step", END)
+    return builder.compile(checkpointer=saver)
+
+
+def _run(graph, thread_id: str, turns: int):
+    config = {"configurable": {"thread_id": thread_id}}
+    for _ in range(turns):
+        graph.invoke({"count": graph.get_state(config).values.get("count", 0)}, config)
+
+
+def _checkpoints(saver) -> dict:
+    with saver.cursor() as cur:
+        cur.execute("SELECT thread_id, COUNT(*) FROM checkpoints GROUP BY thread_id")
+        return dict(cur.fetchall())
+
+
+def _saver(path, **kwargs):
+    return CompactingSqliteSaver(sqlite3.connect(str(path), check_same_thread=False), **kwargs)
+
+
+def test_compaction_keeps_the_latest_checkpoints_per_thread(tmp_path):
+    saver = _saver(tmp_path / "checkpoints.sqlite", keep_last=2)
+    graph = _graph(saver)
+    _run(graph, "a", 4)
+    _run(graph, "b", 1)
+    before = _checkpoints(saver)
+    assert before["a"] > 2
+
+    assert saver.compact() == sum(before.values()) - sum(min(n, 2) for n in before.values())
+    assert _checkpoints(saver) == {thread: min(n, 2) for thread, n in before.items()}
+
+    # The latest state is intact and the thread carries on from it
+    assert graph.get_state({"configurable": {"thread_id": "a"}}).values["count"] == 4
+    _run(graph, "a", 1)
+    assert graph.get_state({"configurable": {"thread_id": "a"}}).values["count"] == 5
+
+
+def test_idle_threads_are_evicted(tmp_path):
+    saver = _saver(tmp_path / "checkpoints.sqlite", thread_ttl=3600)
+    graph = _graph(saver)
+    _run(graph, "idle", 2)
+    _run(graph, "active", 2)
+    with saver.cursor() as cur:
+        cur.execute("UPDATE thread_activity SET last_active = ? WHERE thread_id = 'idle'", (time.time() - 7200,))
+
+    assert saver.evict_idle() == 1
+    assert set(_checkpoints(saver)) == {"active"}
+    assert graph.get_state({"configurable": {"thread_id": "idle"}}).values == {}
+
+
+def test_threads_from_before_activity_tracking_are_backfilled(tmp_path):
+    path = tmp_path / "checkpoints.sqlite"
+    plain = SqliteSaver(sqlite3.connect(str(path), check_same_thread=False))
+    _run(_graph(plain), "legacy", 2)
+    plain.conn.close()
+
+    saver = _saver(path, thread_ttl=3600)
+    saver.setup()
+    with saver.cursor() as cur:
+        cur.execute("SELECT thread_id FROM thread_activity")
+        assert [row[0] for row in cur.fetchall()] == ["legacy"]
+        cur.execute("UPDATE thread_activity SET last_active = ?", (time.time() - 7200,))
+    assert saver.evict_idle() == 1
+    assert _checkpoints(saver) == {}
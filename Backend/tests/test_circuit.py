@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from circuit import CircuitBreaker, CircuitOpen
+
+
+def _fail():
+    raise RuntimeError("provider down")
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(RuntimeError):
+            breaker.call(_fail)
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            breaker.call(_fail)
+    assert breaker.state == "closed"
+
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: "never called")
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=60)
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.call(lambda: "ok") == "ok"
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.05)
+    _open(breaker)
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_again():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=0.05)
+    _open(breaker)
+    time.sleep(0.06)
+
+    with pytest.raises(RuntimeError):
+        breaker.call(_fail)  # a single failed trial is enough
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: "never called")
+
+
+def test_request_deadline_does_not_open_the_breaker(make_agent):
+    from rag_core import NodeTimeout
+
+    agent = make_agent()
+    threshold = agent.llm_breaker.failure_threshold
+    for _ in range(threshold + 1):
+        # The provider is fine, the request just ran out of budget
+        with pytest.raises(NodeTimeout):
+            agent._call_llm("assistant", lambda: time.sleep(0.1) or "late answer", timeout=0.01)
+    time.sleep(0.2)
+    assert agent.llm_breaker.state == "closed"
+    assert agent.llm_breaker.failures == 0
+
+    # Provider errors still count
+    for _ in range(threshold):
+        with pytest.raises(RuntimeError):
+            agent._call_llm("assistant", _fail, timeout=5)
+    assert agent.llm_breaker.state == "open"
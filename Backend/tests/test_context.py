@@ -0,0 +1,35 @@
+import pytest
+from langchain_core.messages import HumanMessage, ToolMessage
+
+
+@pytest.fixture
+def agent(make_agent):
+    return make_agent(keep_turns=2)
+
+
+def test_prompt_size_levels_off_once_turns_are_summarized(agent):
+    prompt_tokens = []
+    for _ in range(6):
+        result = agent.run_with_memory("How is VAT charged on goods?", "thread-1")
+        prompt_tokens.append(result["messages"][1]["metadata"]["prompt_tokens"])
+
+    # Grows while the window fills, then stays put (give or take the summary's wording)
+    assert prompt_tokens[0] < prompt_tokens[1] < prompt_tokens[2]
+    assert max(prompt_tokens[2:]) - min(prompt_tokens[2:]) <= 5
+
+    state = agent.graph.get_state({"configurable": {"thread_id": "thread-1"}}).values
+    assert state["summary"]
+    assert len([m for m in state["messages"] if isinstance(m, HumanMessage)]) == 2
+
+
+def test_tool_output_of_earlier_turns_is_pruned(agent):
+    from rag_core import PRUNED_TOOL_CONTENT
+
+    for question in ("How is VAT charged on goods?", "When are VAT returns due?"):
+        agent.run_with_memory(question, "thread-1")
+
+    state = agent.graph.get_state({"configurable": {"thread_id": "thread-1"}}).values
+    tool_messages = [m for m in state["messages"] if isinstance(m, ToolMessage)]
+    assert len(tool_messages) == 2
+    assert tool_messages[0].content == PRUNED_TOOL_CONTENT
+    assert tool_messages[1].content != PRUNED_TOOL_CONTENT
@@ -0,0 +1,46 @@
+import time
+
+from langchain_core.messages import ToolMessage
+
+QUESTION = "How is VAT charged on goods?"
+
+
+def _thread_messages(agent, thread_id: str):
+    return agent.graph.get_state({"configurable": {"thread_id": thread_id}}).values["messages"]
+
+
+def test_tool_round_cap_routes_to_the_fallback(make_agent):
+    agent = make_agent()
+    agent.max_tool_rounds = 0
+
+    answer = agent.run_with_memory(QUESTION, "thread-1")["messages"][1]
+
+    # The requested tool call was closed by the fallback, which retrieved and answered itself
+    skipped = [m for m in _thread_messages(agent, "thread-1")
+               if isinstance(m, ToolMessage) and "request budget exhausted" in m.content]
+    assert len(skipped) == 1
+    assert answer["metadata"]["mode"] == "agent"
+    assert "Value Added Tax" in answer["content"]
+    assert answer["metadata"]["citations"]
+
+
+def test_short_deadline_answers_from_retrieval_without_another_llm_call(make_agent):
+    agent = make_agent()
+
+    # Enough for the routing call, too little for synthesis (MIN_LLM_SECONDS)
+    answer = agent.run_with_memory(QUESTION, "thread-1", deadline=time.time() + 1)["messages"][1]
+
+    assert answer["metadata"]["mode"] == "agent"
+    assert answer["content"].startswith("I couldn't generate a full answer right now.")
+    assert "7.5 percent" in answer["content"]
+    assert answer["metadata"]["citations"]
+
+
+def test_expired_deadline_still_returns_an_answer(make_agent):
+    agent = make_agent()
+
+    answer = agent.run_with_memory(QUESTION, "thread-1", deadline=time.time() - 1)["messages"][1]
+
+    assert answer["metadata"]["mode"] == "agent"
+    assert "in time" in answer["content"]
+    assert answer["metadata"]["citations"] == []
@@ -0,0 +1,45 @@
+from sqlalchemy import text
+
+from documents import DocumentRegistry, document_title
+
+SOURCES = [
+    {"source_path": "acts/vat_act.pdf", "document_type": "acts", "creation_date": "2024-05-01T00:00:00"},
+    {"source_path": "bills/nigeria_tax_bill.pdf", "document_type": "bills"},
+    {"source_path": None},
+]
+
+
+def test_unknown_paths_are_registered_and_cached(database):
+    registry = DocumentRegistry()
+    ids = registry.resolve(database.engine, SOURCES)
+    assert set(ids) == {"acts/vat_act.pdf", "bills/nigeria_tax_bill.pdf"}
+    assert len(registry) == 2
+
+    with database.engine.connect() as conn:
+        rows = conn.execute(text("SELECT document_id, source_path, document_type, title FROM documents")).fetchall()
+    assert {r.source_path: (r.document_id, r.document_type, r.title) for r in rows} == {
+        "acts/vat_act.pdf": (ids["acts/vat_act.pdf"], "acts", "vat act"),
+        "bills/nigeria_tax_bill.pdf": (ids["bills/nigeria_tax_bill.pdf"], "bills", "nigeria tax bill"),
+    }
+
+    # Cached ids need no database at all
+    assert registry.resolve(None, SOURCES[:2]) == ids
+
+    # Another process (empty cache) finds the existing rows instead of adding new ones
+    assert DocumentRegistry().resolve(database.engine, SOURCES) == ids
+
+
+def test_registration_commits_separately_from_the_callers_transaction(database):
+    registry = DocumentRegistry()
+    with database.Session() as db:
+        db.execute(text("SELECT 1"))
+        ids = registry.resolve(db.get_bind(), SOURCES[:1])
+        db.rollback()  # the turn's own writes fail
+
+    with database.engine.connect() as conn:
+        stored = conn.execute(text("SELECT document_id FROM documents WHERE source_path = 'acts/vat_act.pdf'")).scalar()
+    assert stored == ids["acts/vat_act.pdf"]
+
+
+def test_document_title():
+    assert document_title("data/acts/personal_income_tax_act.pdf") == "personal income tax act"
@@ -0,0 +1,110 @@
+import asyncio
+import csv
+import io
+import json
+
+from sqlalchemy import event, text
+
+from export import CSV_COLUMNS, export_csv, export_ndjson, iter_messages
+from write_behind import turn_record, write_turns
+
+
+def _history(database) -> tuple[int, int]:
+    """Two users. The first has "vat" (two turns) and "pit"; turns interleave, so a thread's message ids have gaps."""
+    with database.engine.begin() as conn:
+        users = [
+            conn.execute(text("""
+                INSERT INTO users (name, email, password, userType, gender)
+                VALUES ('Test', :email, 'x', 'taxpayer', 'other')
+            """), {"email": email}).lastrowid
+            for email in ("a@example.com", "b@example.com")
+        ]
+    turns = [(users[0], "vat", 3), (users[0], "pit", 1), (users[1], "vat", 2), (users[0], "vat", 0)]
+    with database.Session() as db:
+        for n, (user_id, thread_id, sources) in enumerate(turns):
+            write_turns(db, [turn_record(
+                user_id, thread_id, f"question {n}", f"answer {n}",
+                [{"source_path": "acts/vat_act.pdf", "page_number": p, "document_type": "acts"} for p in range(sources)],
+                100, {}
+            )])
+        db.commit()
+    return users[0], users[1]
+
+
+async def _collect(messages) -> list[dict]:
+    return [m async for m in messages]
+
+
+async def _body(chunks) -> str:
+    return b"".join([c async for c in chunks]).decode("utf-8")
+
+
+def test_pages_of_any_size_give_the_same_export(database):
+    user_id, _ = _history(database)
+    full = asyncio.run(_collect(iter_messages(database.async_engine, user_id)))
+
+    assert [(m["thread_id"], m["message_id"], m["role"]) for m in full] == [
+        ("vat", 1, "user"), ("vat", 2, "assistant"), ("vat", 7, "user"), ("vat", 8, "assistant"),
+        ("pit", 3, "user"), ("pit", 4, "assistant"),
+    ]
+    assert [len(m["citations"]) for m in full] == [0, 3, 0, 0, 0, 1]
+    assert full[1]["citations"][2] == {"source_path": "acts/vat_act.pdf", "page_number": 2, "document_type": "acts"}
+
+    for page_size in (1, 2, 3):
+        paged = asyncio.run(_collect(iter_messages(database.async_engine, user_id, page_size=page_size)))
+        assert paged == full
+
+
+def test_thread_and_time_filters(database):
+    user_id, other_id = _history(database)
+    engine = database.async_engine
+
+    pit = asyncio.run(_collect(iter_messages(engine, user_id, thread_id="pit", page_size=1)))
+    assert [m["message_id"] for m in pit] == [3, 4]
+    other = asyncio.run(_collect(iter_messages(engine, other_id, thread_id="vat")))
+    assert [m["message_id"] for m in other] == [5, 6]
+
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE messages SET created_at = '2025-01-01 00:00:00' WHERE message_id <= 4"))
+    recent = asyncio.run(_collect(iter_messages(engine, user_id, start="2025-06-01", page_size=1)))
+    assert [m["message_id"] for m in recent] == [7, 8]
+    old = asyncio.run(_collect(iter_messages(engine, user_id, end="2025-06-01", page_size=1)))
+    assert [m["message_id"] for m in old] == [1, 2, 3, 4]
+
+
+def test_ndjson_and_csv_output(database):
+    user_id, _ = _history(database)
+    engine = database.async_engine
+
+    ndjson = asyncio.run(_body(export_ndjson(iter_messages(engine, user_id), chunk_bytes=64)))
+    lines = [json.loads(line) for line in ndjson.splitlines()]
+    assert lines == asyncio.run(_collect(iter_messages(engine, user_id)))
+
+    body = asyncio.run(_body(export_csv(iter_messages(engine, user_id, page_size=2), chunk_bytes=64)))
+    rows = list(csv.reader(io.StringIO(body)))
+    assert rows[0] == CSV_COLUMNS
+    # One row per citation, one row for each message without any
+    assert [int(r[1]) for r in rows[1:]] == [1, 2, 2, 2, 7, 8, 3, 4]
+    assert [r[6] for r in rows[1:]] == ["", "0", "1", "2", "", "", "", "0"]
+
+
+def test_one_message_query_per_page_of_sessions(database):
+    user_id, _ = _history(database)
+    with database.Session() as db:
+        write_turns(db, [turn_record(user_id, f"thread-{n}", "q", "a", [], 100, {}) for n in range(5)])
+        db.commit()
+
+    statements = []
+
+    def listen(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", listen)
+    try:
+        messages = asyncio.run(_collect(iter_messages(database.async_engine, user_id)))
+    finally:
+        event.remove(database.async_engine.sync_engine, "before_cursor_execute", listen)
+
+    assert len(messages) == 16  # 7 sessions
+    assert sum("FROM chat_sessions" in s for s in statements) == 1
+    assert sum("FROM messages" in s for s in statements) == 1
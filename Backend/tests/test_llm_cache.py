@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from llm_cache import LLMCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "llm_cache.sqlite"), max_mb=1, max_age=3600)
+    yield cache
+    cache.conn.close()
+
+
+def _turn(run: str) -> list:
+    return [
+        HumanMessage(content="What is the VAT rate?", id=f"human-{run}"),
+        AIMessage(content="", id=f"ai-{run}", tool_calls=[
+            {"name": "retrieve_documents", "args": {"query": "VAT rate"}, "id": f"call-{run}"}
+        ]),
+        ToolMessage(content="VAT is 7.5 percent", tool_call_id=f"call-{run}", name="retrieve_documents",
+                    id=f"tool-{run}"),
+    ]
+
+
+def test_key_ignores_message_and_tool_call_ids():
+    assert LLMCache.key("gpt-4o-mini", 0, _turn("a")) == LLMCache.key("gpt-4o-mini", 0, _turn("b"))
+
+    changed = _turn("a")
+    changed[-1] = ToolMessage(content="VAT is 10 percent", tool_call_id="call-a", name="retrieve_documents")
+    assert LLMCache.key("gpt-4o-mini", 0, _turn("a")) != LLMCache.key("gpt-4o-mini", 0, changed)
+    assert LLMCache.key("gpt-4o-mini", 0, _turn("a")) != LLMCache.key("gpt-4o", 0, _turn("a"))
+
+
+def test_non_zero_temperature_is_cached_only_when_forced(cache, tmp_path):
+    assert cache.cacheable(SimpleNamespace(temperature=0))
+    assert not cache.cacheable(SimpleNamespace(temperature=0.4))
+
+    forced = LLMCache(path=str(tmp_path / "forced.sqlite"), force=True)
+    assert forced.cacheable(SimpleNamespace(temperature=0.4))
+    forced.conn.close()
+
+
+def test_round_trip_and_age_eviction(cache):
+    key = LLMCache.key("gpt-4o-mini", 0, _turn("a"))
+    assert cache.get(key) is None
+    cache.put(key, AIMessage(content="7.5 percent"))
+    assert cache.get(key).content == "7.5 percent"
+
+    # Past max_age: a miss on read, and gone after an eviction pass
+    cache.conn.execute("UPDATE llm_cache SET created_at = created_at - 7200")
+    assert cache.get(key) is None
+    cache.evict()
+    assert cache.stats()["entries"] == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_size_eviction_drops_least_recently_used(cache):
+    big = "x" * (300 * 1024)
+    keys = [LLMCache.key("gpt-4o-mini", 0, f"question {n}") for n in range(4)]
+    for n, key in enumerate(keys):
+        cache.put(key, AIMessage(content=big))
+        cache.conn.execute("UPDATE llm_cache SET last_hit = ? WHERE key = ?", (n, key))
+    cache.conn.execute("UPDATE llm_cache SET last_hit = 10 WHERE key = ?", (keys[0],))  # recently read
+
+    cache.evict()
+    assert cache.stats()["size_bytes"] <= 1024 * 1024
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[3]) is not None
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from benchmarks.offline import local_database
+from migrations import MIGRATIONS, current_version, migrate
+
+
+@pytest.fixture
+def version_1(tmp_path):
+    """A database left at the initial schema, before sessions were unique per (user_id, title)."""
+    tax_database = local_database(str(tmp_path / "tax.sqlite"), schema_version=1)
+    yield tax_database
+    tax_database.engine.dispose()
+    asyncio.run(tax_database.async_engine.dispose())
+
+
+def test_duplicate_sessions_are_merged_into_the_oldest(version_1):
+    engine = version_1.engine
+    with engine.begin() as conn:
+        for email in ("a@example.com", "b@example.com"):
+            conn.execute(text("""
+                INSERT INTO users (name, email, password, userType, gender)
+                VALUES ('Test', :email, 'x', 'taxpayer', 'other')
+            """), {"email": email})
+        # user 1 has "vat" three times, user 2 has "vat" once
+        for session_id, user_id, title in ((1, 1, "vat"), (2, 1, "vat"), (3, 1, "pit"), (4, 2, "vat"), (5, 1, "vat")):
+            conn.execute(text("INSERT INTO chat_sessions (session_id, user_id, title) VALUES (:s, :u, :t)"),
+                         {"s": session_id, "u": user_id, "t": title})
+        for session_id in (1, 2, 2, 3, 4, 5):
+            conn.execute(text("INSERT INTO messages (session_id, role, content) VALUES (:s, 'user', 'q')"),
+                         {"s": session_id})
+
+    assert migrate(engine, target=2) == [2]
+
+    with engine.connect() as conn:
+        assert current_version(conn) == 2
+        sessions = conn.execute(text("SELECT session_id, user_id, title FROM chat_sessions ORDER BY session_id"))
+        assert [tuple(r) for r in sessions] == [(1, 1, "vat"), (3, 1, "pit"), (4, 2, "vat")]
+        messages = conn.execute(text("SELECT session_id FROM messages ORDER BY message_id")).scalars().all()
+        assert messages == [1, 1, 1, 3, 4, 1]
+
+    with pytest.raises(IntegrityError), engine.begin() as conn:
+        conn.execute(text("INSERT INTO chat_sessions (user_id, title) VALUES (1, 'vat')"))
+
+
+def test_migrate_is_idempotent(version_1):
+    engine = version_1.engine
+    assert migrate(engine) == [version for version, _, _ in MIGRATIONS[1:]]
+    assert migrate(engine) == []
+
+
+def test_citations_move_to_the_documents_table(tmp_path):
+    tax_database = local_database(str(tmp_path / "tax.sqlite"), schema_version=3)
+    engine = tax_database.engine
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO users (name, email, password, userType, gender)
+            VALUES ('Test', 'test@example.com', 'x', 'taxpayer', 'other')
+        """))
+        conn.execute(text("INSERT INTO chat_sessions (session_id, user_id, title) VALUES (1, 1, 'vat')"))
+        conn.execute(text("INSERT INTO messages (message_id, session_id, role, content) VALUES (1, 1, 'assistant', 'a')"))
+        for citation_id, path, page, doc_type in (
+            (1, "acts/vat_act.pdf", 3, "acts"),
+            (2, "bills/tax_bill.pdf", 1, "bills"),
+            (3, "acts/vat_act.pdf", 9, "acts"),
+            (4, None, None, None),
+        ):
+            conn.execute(text("""
+                INSERT INTO citations (citation_id, message_id, source_path, page_number, document_type)
+                VALUES (:citation_id, 1, :path, :page, :doc_type)
+            """), {"citation_id": citation_id, "path": path, "page": page, "doc_type": doc_type})
+
+    assert migrate(engine, target=4) == [4]
+
+    with engine.connect() as conn:
+        documents = conn.execute(text("""
+            SELECT document_id, source_path, document_type, title FROM documents ORDER BY source_path
+        """)).fetchall()
+        assert [tuple(d)[1:] for d in documents] == [
+            ("acts/vat_act.pdf", "acts", "vat act"),
+            ("bills/tax_bill.pdf", "bills", "tax bill"),
+        ]
+        ids = {d.source_path: d.document_id for d in documents}
+        citations = conn.execute(text(
+            "SELECT citation_id, document_id, page_number FROM citations ORDER BY citation_id"
+        )).fetchall()
+        assert [tuple(c) for c in citations] == [
+            (1, ids["acts/vat_act.pdf"], 3),
+            (2, ids["bills/tax_bill.pdf"], 1),
+            (3, ids["acts/vat_act.pdf"], 9),
+            (4, None, None),
+        ]
+        columns = {c["name"] for c in inspect(conn).get_columns("citations")}
+        assert "source_path" not in columns and "document_type" not in columns
+
+    tax_database.engine.dispose()
+    asyncio.run(tax_database.async_engine.dispose())
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from model_tiers import NODE_TIERS, classify_complexity
+
+
+@pytest.mark.parametrize("question, tier", [
+    # Single-topic lookups stay on the fast model
+    ("What is VAT?", "fast"),
+    ("Hello", "fast"),
+    ("Is VAT charged on basic food items?", "fast"),
+    ("What is the VAT rate and when are returns due?", "fast"),
+    ("How do I register for personal income tax with FIRS?", "fast"),  # two documents, no comparison
+    # Comparisons and reform before/after questions go to the strong model
+    ("What is the difference between PIT and CIT?", "strong"),
+    ("Compare VAT under the Finance Act with the reform bills", "strong"),
+    ("VAT vs sales tax", "strong"),
+    ("How does the new derivation formula work?", "strong"),
+    ("What changes for small companies after the reform?", "strong"),
+    ("How does the current VAT rate compare with the proposed one?", "strong"),
+    ("What is the impact on states of the VAT sharing formula?", "strong"),
+    # Several questions across documents add up
+    ("What is VAT? And how is personal income tax charged?", "strong"),
+])
+def test_classify_complexity(question, tier):
+    assert classify_complexity(question) == tier
+
+
+@pytest.mark.skipif(bool(os.getenv("LLM_NODE_TIERS")), reason="LLM_NODE_TIERS overrides the defaults")
+def test_only_synthesis_follows_the_turn_tier_by_default():
+    assert NODE_TIERS == {
+        "routing": "fast",
+        "synthesis": "auto",
+        "fallback": "fast",
+        "summary": "fast",
+        "multilingual": "fast",
+    }
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from retention import read_archive, restore, run_retention
+from write_behind import turn_record, write_turns
+
+OLD_MONTHS = [datetime(2024, 1, 15, 12, 0), datetime(2024, 2, 15, 12, 0)]
+
+
+def _write(database, user_id: int, thread_id: str, n: int):
+    with database.Session() as db:
+        write_turns(db, [turn_record(
+            user_id, thread_id, f"question {n}", f"answer {n}",
+            [{"source_path": f"acts/act_{n}.pdf", "page_number": n, "document_type": "acts"}],
+            100 + n, {"total_ms": 100 + n, "llm_calls": 1}
+        )])
+        db.commit()
+
+
+def _backdate(engine, log_id: int, created_at: datetime):
+    """Move turn `log_id` (messages 2 * log_id - 1 and 2 * log_id) and its rows back to created_at."""
+    with engine.begin() as conn:
+        params = {"q": 2 * log_id - 1, "a": 2 * log_id, "t": created_at}
+        conn.execute(text("UPDATE messages SET created_at = :t WHERE message_id IN (:q, :a)"), params)
+        conn.execute(text("UPDATE citations SET created_at = :t WHERE message_id IN (:q, :a)"), params)
+        conn.execute(text("UPDATE query_logs SET created_at = :t WHERE log_id = :id"), {"t": created_at, "id": log_id})
+        conn.execute(text("UPDATE query_metrics SET created_at = :t WHERE log_id = :id"), {"t": created_at, "id": log_id})
+        conn.execute(text("UPDATE chat_sessions SET last_active = :t WHERE title = 'old'"), {"t": created_at})
+
+
+def _snapshot(engine) -> dict:
+    with engine.connect() as conn:
+        messages = conn.execute(text("""
+            SELECT m.message_id, s.user_id, s.title, m.role, m.content, m.created_at,
+                   d.source_path, d.document_type, c.page_number, c.created_at AS cited_at
+            FROM messages m
+            JOIN chat_sessions s ON s.session_id = m.session_id
+            LEFT JOIN citations c ON c.message_id = m.message_id
+            LEFT JOIN documents d ON d.document_id = c.document_id
+            ORDER BY m.message_id, c.citation_id
+        """)).fetchall()
+        logs = conn.execute(text("""
+            SELECT l.log_id, l.user_id, l.question, l.retrieved_docs, l.response_time_ms, l.created_at,
+                   q.total_ms, q.llm_calls
+            FROM query_logs l
+            LEFT JOIN query_metrics q ON q.log_id = l.log_id
+            ORDER BY l.log_id
+        """)).fetchall()
+    return {"messages": [tuple(r) for r in messages], "query_logs": [tuple(r) for r in logs]}
+
+
+def test_archive_and_restore_round_trip(database, tmp_path):
+    engine = database.engine
+    with engine.begin() as conn:
+        user_id = conn.execute(text("""
+            INSERT INTO users (name, email, password, userType, gender)
+            VALUES ('Test', 'test@example.com', 'x', 'taxpayer', 'other')
+        """)).lastrowid
+    for n, created_at in enumerate(OLD_MONTHS, start=1):
+        _write(database, user_id, "old", n)
+        _backdate(engine, n, created_at)
+    _write(database, user_id, "recent", 3)
+    before = _snapshot(engine)
+
+    archive_dir = str(tmp_path / "archives")
+    result = run_retention(engine, days=365, archive_dir=archive_dir, batch_size=3)
+    assert (result["messages"], result["query_logs"], result["sessions"]) == (4, 2, 1)
+
+    after = _snapshot(engine)
+    assert [m[0] for m in after["messages"]] == [5, 6]
+    assert [log[0] for log in after["query_logs"]] == [3]
+
+    paths = sorted((tmp_path / "archives").iterdir())
+    assert [p.name for p in paths] == [
+        "messages-2024-01.jsonl.zst", "messages-2024-02.jsonl.zst",
+        "query_logs-2024-01.jsonl.zst", "query_logs-2024-02.jsonl.zst",
+    ]
+    assert [r["message_id"] for r in read_archive(str(paths[0]))] == [1, 2]
+
+    assert sum(restore(engine, str(p), batch_size=1) for p in paths) == 6
+    assert _snapshot(engine) == before
+
+    # Restoring again is harmless
+    assert sum(restore(engine, str(p)) for p in paths) == 0
+    assert _snapshot(engine) == before
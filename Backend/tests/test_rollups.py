@@ -0,0 +1,145 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from rollups import LatencySketch, Rollup, read_rollups, rebuild, refresh
+
+START = datetime(2026, 3, 2, 9, 58)
+
+
+def _log(engine, log_id: int, minute: int, response_time_ms: int, retrieved_docs: int = 3, question: str = "VAT rate?"):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO query_logs (log_id, question, retrieved_docs, response_time_ms, created_at)
+            VALUES (:log_id, :question, :retrieved_docs, :response_time_ms, :created_at)
+        """), {
+            "log_id": log_id, "question": question, "retrieved_docs": retrieved_docs,
+            "response_time_ms": response_time_ms, "created_at": START + timedelta(minutes=minute)
+        })
+
+
+def _read(database, granularity: str) -> dict:
+    with database.Session() as db:
+        return read_rollups(db, granularity)
+
+
+def test_merged_sketches_match_one_sketch_of_all_values():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(6, 1) for _ in range(5000)]
+    whole = LatencySketch()
+    parts = [LatencySketch() for _ in range(4)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 4].add(value)
+
+    merged = LatencySketch()
+    for part in parts:
+        merged.merge(part)
+    assert merged.bins == whole.bins
+    assert merged.count == len(values)
+
+    values.sort()
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(merged.quantile(q) - exact) <= 0.01 * exact + 1e-9
+
+
+def test_rollup_merge_adds_counts():
+    a, b = Rollup(), Rollup()
+    a.add(100, 2, "What is  the VAT rate?")
+    b.add(300, 2, "what is the vat rate?")
+    b.add(50, 0, "PIT bands")
+    a.merge(b)
+    summary = a.summary()
+    assert summary["queries"] == 3
+    assert summary["avg_ms"] == 150.0
+    assert summary["max_ms"] == 300
+    assert summary["retrieved_docs"] == {"0": 1, "2": 2}
+    assert summary["top_questions"][0] == {"question": "what is the vat rate?", "count": 2}
+
+
+def test_hour_and_day_buckets_merge_their_minutes(database):
+    engine = database.engine
+    # 09:58, 09:59 and 10:00, 10:01: two hours, one day
+    for log_id, (minute, ms) in enumerate([(0, 100), (0, 200), (1, 400), (2, 800), (3, 1600)], start=1):
+        _log(engine, log_id, minute, ms, retrieved_docs=log_id % 2)
+    assert refresh(engine, batch_size=2) == 5  # several batches merge into stored buckets
+
+    minutes = _read(database, "minute")
+    hours = _read(database, "hour")
+    day = _read(database, "day")
+    assert [b["queries"] for b in minutes["buckets"]] == [2, 1, 1, 1]
+    assert [b["queries"] for b in hours["buckets"]] == [3, 2]
+    assert [b["queries"] for b in day["buckets"]] == [5]
+    for totals in (minutes["total"], hours["total"], day["buckets"][0]):
+        assert totals["queries"] == 5
+        assert totals["max_ms"] == 1600
+        assert totals["retrieved_docs"] == {"0": 2, "1": 3}
+        assert abs(totals["p50_ms"] - 400) <= 4
+
+    # Nothing new: a second refresh changes nothing, and a rebuild gives the same rollups
+    assert refresh(engine) == 0
+    assert rebuild(engine) == 5
+    assert _read(database, "hour") == hours
+
+
+def test_late_commits_are_counted_once(database):
+    engine = database.engine
+    _log(engine, 1, 0, 100)
+    _log(engine, 2, 0, 100)
+    _log(engine, 4, 0, 100)  # id 3 still in an open transaction
+    assert refresh(engine) == 3
+
+    _log(engine, 3, 0, 100)
+    _log(engine, 5, 0, 100)
+    assert refresh(engine) == 2
+    assert refresh(engine) == 0
+    assert _read(database, "day")["total"]["queries"] == 5
+
+
+def test_missing_ids_are_given_up_after_the_gap(database):
+    engine = database.engine
+    _log(engine, 1, 0, 100)
+    _log(engine, 3, 0, 100)
+    refresh(engine, gap_seconds=0)  # id 2 is taken to be rolled back straight away
+
+    _log(engine, 2, 0, 100)
+    assert refresh(engine) == 0
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT missing_log_ids FROM rollup_state")).scalar() == "[]"
+
+
+def test_large_gaps_are_stored_as_ranges(database):
+    engine = database.engine
+    _log(engine, 1, 0, 100)
+    _log(engine, 12003, 0, 100)  # 12001 ids burned by rolled-back batches, or still open
+    _log(engine, 12005, 0, 100)
+    assert refresh(engine) == 3
+
+    _log(engine, 6000, 0, 100)  # a late commit inside the gap
+    assert refresh(engine) == 1
+    with engine.connect() as conn:
+        missing = json.loads(conn.execute(text("SELECT missing_log_ids FROM rollup_state")).scalar())
+    assert [gap[:2] for gap in missing] == [[2, 5999], [6001, 12002], [12004, 12004]]
+    assert _read(database, "day")["total"]["queries"] == 4
+
+
+def test_missing_ids_are_capped_oldest_first(database):
+    engine = database.engine
+    _log(engine, 1, 0, 100)
+    _log(engine, 10002, 0, 100)
+    refresh(engine, max_missing=1000)
+
+    _log(engine, 20003, 0, 100)
+    refresh(engine, max_missing=1000)
+    with engine.connect() as conn:
+        missing = json.loads(conn.execute(text("SELECT missing_log_ids FROM rollup_state")).scalar())
+    # The newer gap is kept, trimmed from its low end; the older one is dropped
+    assert [gap[:2] for gap in missing] == [[19003, 20002]]
+
+    # Ids that are no longer tracked are not counted when they show up
+    _log(engine, 500, 0, 100)
+    _log(engine, 19500, 0, 100)
+    assert refresh(engine) == 1
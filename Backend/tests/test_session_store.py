@@ -0,0 +1,81 @@
+from sqlalchemy import text
+
+from session_store import SessionCache, get_session_history, session_cache
+from write_behind import turn_record, write_turns
+
+
+def _user(engine) -> int:
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO users (name, email, password, userType, gender)
+            VALUES ('Test', 'test@example.com', 'x', 'taxpayer', 'other')
+        """)).lastrowid
+
+
+def _write_turns(database, user_id: int, numbers):
+    with database.Session() as db:
+        write_turns(db, [
+            turn_record(user_id, "thread-1", f"question {n}", f"answer {n}",
+                        [{"source_path": "acts/vat_act.pdf", "page_number": n, "document_type": "acts"}], 100, {})
+            for n in numbers
+        ])
+        db.commit()
+    session_cache.invalidate(user_id, "thread-1")
+
+
+def _history(database, user_id: int, before=None, limit=50):
+    with database.Session() as db:
+        return get_session_history(db, user_id, "thread-1", before, limit)
+
+
+def test_pages_walk_back_by_message_id(database):
+    user_id = _user(database.engine)
+    _write_turns(database, user_id, range(3))
+
+    contents = []
+    before = None
+    while True:
+        page = _history(database, user_id, before, limit=4)
+        contents = [m["content"] for m in page["messages"]] + contents
+        before = page["next_before"]
+        if before is None:
+            break
+        assert before == page["messages"][0]["message_id"]
+
+    assert contents == [text for n in range(3) for text in (f"question {n}", f"answer {n}")]
+    newest = _history(database, user_id, limit=2)["messages"]
+    assert [m["role"] for m in newest] == ["user", "assistant"]
+    assert newest[1]["metadata"]["citations"][0]["page_number"] == 2
+
+
+def test_a_new_turn_invalidates_the_cached_pages(database):
+    user_id = _user(database.engine)
+    _write_turns(database, user_id, [0])
+    assert len(_history(database, user_id)["messages"]) == 2
+    hits = session_cache.hits
+    assert len(_history(database, user_id)["messages"]) == 2
+    assert session_cache.hits == hits + 1
+
+    _write_turns(database, user_id, [1])
+    assert [m["content"] for m in _history(database, user_id)["messages"]][-1] == "answer 1"
+
+
+def test_a_page_read_before_an_invalidation_is_not_cached():
+    cache = SessionCache(maxsize=2)
+    generation = cache.generation()
+    cache.invalidate(1, "thread-1")  # a turn lands while the page is being read
+    cache.put(1, "thread-1", (None, 50), {"messages": []}, generation)
+    assert cache.get(1, "thread-1", (None, 50)) is None
+
+    # Other threads are unaffected, and a reader that started afterwards may cache
+    cache.put(1, "thread-2", (None, 50), {"messages": []}, generation)
+    assert cache.get(1, "thread-2", (None, 50)) is not None
+    cache.put(1, "thread-1", (None, 50), {"messages": []}, cache.generation())
+    assert cache.get(1, "thread-1", (None, 50)) is not None
+
+    # Once the invalidation is no longer tracked per thread, older readers are turned away
+    generation = cache.generation()
+    for thread_id in ("a", "b", "c"):
+        cache.invalidate(2, thread_id)
+    cache.put(2, "a", (None, 50), {"messages": []}, generation)
+    assert cache.get(2, "a", (None, 50)) is None
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from singleflight import SingleFlight, normalize_question
+
+
+QUESTIONS = ["What is VAT?", "what is vat", "  What   is VAT?! ", "WHAT IS VAT."]
+
+
+def _run_concurrently(flight, fn):
+    """Call flight.do() once per question from its own thread; the leader's fn blocks until all have joined."""
+    release = threading.Event()
+    calls = []
+    results = {}
+
+    def blocking():
+        calls.append(1)
+        release.wait(5)
+        return fn()
+
+    def ask(question):
+        try:
+            results[question] = flight.do(normalize_question(question), blocking)
+        except Exception as e:
+            results[question] = e
+
+    threads = [threading.Thread(target=ask, args=(q,)) for q in QUESTIONS]
+    threads[0].start()
+    while not calls:
+        time.sleep(0.001)
+    for t in threads[1:]:
+        t.start()
+
+    deadline = time.monotonic() + 5
+    while flight.stats()["coalesced"] < len(QUESTIONS) - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return calls, results
+
+
+def test_normalize_question():
+    assert {normalize_question(q) for q in QUESTIONS} == {"what is vat"}
+    assert normalize_question("What is VAT?") != normalize_question("What is WHT?")
+
+
+def test_concurrent_identical_questions_run_once():
+    flight = SingleFlight()
+    calls, results = _run_concurrently(flight, lambda: "answer")
+
+    assert len(calls) == 1
+    assert results[QUESTIONS[0]] == ("answer", False)
+    assert all(results[q] == ("answer", True) for q in QUESTIONS[1:])
+    assert flight.stats() == {"executions": 1, "coalesced": len(QUESTIONS) - 1, "in_flight": 0}
+
+
+def test_error_reaches_every_waiter():
+    def fail():
+        raise RuntimeError("graph failed")
+
+    flight = SingleFlight()
+    calls, results = _run_concurrently(flight, fail)
+
+    assert len(calls) == 1
+    assert all(isinstance(results[q], RuntimeError) for q in QUESTIONS)
+
+    # The failed call is not cached: the next caller runs fn again
+    assert flight.do(normalize_question(QUESTIONS[0]), lambda: "retry") == ("retry", False)
+
@@ -0,0 +1,169 @@
+import json
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from write_behind import WriteBehindQueue, turn_record, write_turns
+
+
+def _user(engine) -> int:
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO users (name, email, password, userType, gender)
+            VALUES ('Test', 'test@example.com', 'x', 'taxpayer', 'other')
+        """)).lastrowid
+
+
+def _turn(user_id: int, n: int) -> dict:
+    return turn_record(
+        user_id, "thread-1", f"question {n}", f"answer {n}",
+        [{"source_path": "acts/vat_act.pdf", "page_number": n, "document_type": "acts"}],
+        100 + n, {"total_ms": 100 + n, "llm_calls": 1}
+    )
+
+
+def _counts(engine) -> dict:
+    with engine.connect() as conn:
+        return {
+            table: conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+            for table in ("chat_sessions", "messages", "citations", "query_logs", "query_metrics")
+        }
+
+
+def test_failed_batches_are_journaled_and_replayed(database, tmp_path):
+    user_id = _user(database.engine)
+    journal = str(tmp_path / "write_journal.jsonl")
+
+    # Database unreachable: the batch is journaled instead of lost
+    broken = sessionmaker(bind=create_engine(f"sqlite:///{tmp_path}/missing/dir/tax.sqlite"))
+    failing = WriteBehindQueue(broken, retries=0, journal=journal)
+    for n in range(3):
+        assert failing.submit(_turn(user_id, n))
+    failing.close()
+    assert failing.stats()["journaled"] == 3
+    with open(journal, encoding="utf-8") as f:
+        assert [json.loads(line)["question"] for line in f] == ["question 0", "question 1", "question 2"]
+
+    # The next worker replays the journal before taking new turns
+    replaying = WriteBehindQueue(database.Session, journal=journal)
+    assert replaying.submit(_turn(user_id, 3))
+    replaying.close()
+
+    assert _counts(database.engine) == {
+        "chat_sessions": 1, "messages": 8, "citations": 4, "query_logs": 4, "query_metrics": 4
+    }
+    assert not (tmp_path / "write_journal.jsonl").exists()
+    assert not list(tmp_path.glob("write_journal.jsonl.*.replay"))
+    assert not replaying.pending(user_id, "thread-1")
+
+
+def test_interrupted_replay_is_picked_up(database, tmp_path):
+    user_id = _user(database.engine)
+    journal_dir = tmp_path / "journal"
+    journal_dir.mkdir()
+    journal = journal_dir / "write_journal.jsonl"
+    (journal_dir / "write_journal.jsonl.1700000000000.replay").write_text(
+        json.dumps(_turn(user_id, 0)) + "\n", encoding="utf-8"
+    )
+    journal.write_text(json.dumps(_turn(user_id, 1)) + "\n", encoding="utf-8")
+
+    queue = WriteBehindQueue(database.Session, journal=str(journal))
+    queue.start()
+    queue.close()
+
+    with database.engine.connect() as conn:
+        questions = conn.execute(text("SELECT question FROM query_logs ORDER BY log_id")).scalars().all()
+    assert questions == ["question 0", "question 1"]
+    assert not list(journal_dir.iterdir())
+
+
+def test_citations_and_metrics_reference_their_own_turn(database):
+    user_id = _user(database.engine)
+    db = database.Session()
+    try:
+        write_turns(db, [_turn(user_id, n) for n in range(5)])
+        db.commit()
+    finally:
+        db.close()
+
+    with database.engine.connect() as conn:
+        cited = conn.execute(text("""
+            SELECT m.role, m.content, c.page_number FROM citations c
+            JOIN messages m ON m.message_id = c.message_id
+        """)).fetchall()
+        logged = conn.execute(text("""
+            SELECT l.question, l.response_time_ms, q.total_ms FROM query_metrics q
+            JOIN query_logs l ON l.log_id = q.log_id
+        """)).fetchall()
+    assert sorted(cited) == [("assistant", f"answer {n}", n) for n in range(5)]
+    assert all(total_ms == response_time_ms for _, response_time_ms, total_ms in logged)
+    assert len(logged) == 5
+
+
+def test_close_journals_the_batch_a_hung_worker_is_writing(tmp_path):
+    journal = tmp_path / "write_journal.jsonl"
+    entered, release = threading.Event(), threading.Event()
+
+    class HungSession:
+        def get_bind(self):
+            entered.set()
+            release.wait()
+            raise OSError("database unreachable")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    queue = WriteBehindQueue(HungSession, journal=str(journal))
+    assert queue.submit(_turn(1, 0))
+    assert entered.wait(5)
+    queue.close(timeout=0.2)
+
+    # Journaled by close() while the worker is still stuck in the database call
+    assert [json.loads(line)["question"] for line in journal.read_text(encoding="utf-8").splitlines()] == [
+        "question 0"
+    ]
+
+    # The worker gives up without retrying or journaling the batch a second time
+    release.set()
+    queue._thread.join(5)
+    assert not queue._thread.is_alive()
+    assert len(journal.read_text(encoding="utf-8").splitlines()) == 1
+
+
+def test_start_replays_without_a_submit(database, tmp_path):
+    user_id = _user(database.engine)
+    journal = tmp_path / "write_journal.jsonl"
+    journal.write_text(json.dumps(_turn(user_id, 0)) + "\n", encoding="utf-8")
+
+    queue = WriteBehindQueue(database.Session, journal=str(journal))
+    queue.start()
+    # Readers that wait for the thread see the replayed turn
+    assert queue.wait_for(user_id, "thread-1")
+    assert _counts(database.engine)["messages"] == 2
+    queue.close()
+
+
+def test_waiting_for_all_of_a_users_threads(database, tmp_path):
+    user_id = _user(database.engine)
+    release = threading.Event()
+
+    def slow_session():
+        release.wait(5)
+        return database.Session()
+
+    queue = WriteBehindQueue(slow_session, journal=str(tmp_path / "write_journal.jsonl"))
+    assert queue.submit(_turn(user_id, 0))
+    assert queue.pending(user_id)
+    assert queue.pending(user_id, "thread-1")
+    assert not queue.pending(user_id, "thread-2")
+    assert not queue.pending(user_id + 1)
+    assert not queue.wait_for(user_id, timeout=0.05)
+
+    release.set()
+    assert queue.wait_for(user_id)
+    assert _counts(database.engine)["messages"] == 2
+    queue.close()
@@ -0,0 +1,52 @@
+# Local stand-in for an OTLP/HTTP trace collector
+
+# Accepts OTLP/JSON on POST /v1/traces and appends every span as one JSON line
+# to the output file. Point the API at it with TRACE_EXPORT=otlp.
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(output: str):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/v1/traces":
+                self.send_error(404)
+                return
+
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.send_error(400, "Expected OTLP/JSON")
+                return
+
+            with open(output, "a", encoding="utf-8") as f:
+                for resource in payload.get("resourceSpans", []):
+                    for scope in resource.get("scopeSpans", []):
+                        for s in scope.get("spans", []):
+                            f.write(json.dumps(s) + "\n")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default="collected_spans.jsonl")
+    args = parser.parse_args()
+
+    print(f"Collecting spans on http://127.0.0.1:{args.port}/v1/traces -> {args.output}")
+    ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.output)).serve_forever()
+
+# To run the collector, use the command:
+# python trace_collector.py
@@ -0,0 +1,270 @@
+# Per-request tracing
+
+# A trace is started per /query request. Graph nodes, tool calls, embedding
+# calls, LLM calls and DB writes open child spans carrying their duration and
+# attributes (tokens, retrieved chunks, ...). When the trace ends its spans are
+# summarized for the query_metrics table and optionally exported:
+#
+#   TRACE_EXPORT=jsonl  append one JSON object per span to TRACE_FILE
+#   TRACE_EXPORT=otlp   POST OTLP/JSON to TRACE_OTLP_ENDPOINT (see trace_collector.py)
+#
+# Outside a trace, span() is a no-op.
+
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+
+from langchain_core.embeddings import Embeddings
+
+
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")  # "", "jsonl" or "otlp"
+TRACE_FILE = os.getenv(
+    "TRACE_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl")
+)
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+
+_trace_listeners = []  # called with each finished Trace
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_id: str | None, name: str, kind: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attributes: dict):
+        self.trace_id = uuid.uuid4().hex
+        self.spans = []
+        self.profiler = None  # set while the request is profiled (profiler.py)
+        self.root = Span(self.trace_id, None, name, "request", attributes)
+        self.spans.append(self.root)
+
+    def summary(self) -> dict:
+        """Per-request totals used for the query_metrics table."""
+        s = {
+            "trace_id": self.trace_id,
+            "total_ms": int(self.root.duration_ms),
+            "llm_ms": 0, "llm_calls": 0, "llm_cache_hits": 0,
+            "input_tokens": 0, "output_tokens": 0,
+            "tool_ms": 0, "tool_calls": 0, "retrieved_chunks": 0,
+            "embedding_ms": 0, "embedding_calls": 0,
+            "multilingual_ms": 0, "db_ms": 0,
+        }
+        for span in self.spans:
+            a = span.attributes
+            if span.kind == "llm":
+                s["llm_ms"] += span.duration_ms
+                s["llm_calls"] += 1
+                s["llm_cache_hits"] += 1 if a.get("cache_hit") else 0
+                s["input_tokens"] += a.get("input_tokens", 0)
+                s["output_tokens"] += a.get("output_tokens", 0)
+            elif span.kind == "tool":
+                s["tool_ms"] += span.duration_ms
+                s["tool_calls"] += 1
+                s["retrieved_chunks"] += a.get("retrieved_chunks", 0)
+            elif span.kind == "embedding":
+                s["embedding_ms"] += span.duration_ms
+                s["embedding_calls"] += 1
+            elif span.kind == "db":
+                s["db_ms"] += span.duration_ms
+            elif span.kind == "node" and span.name == "multilingual":
+                s["multilingual_ms"] += span.duration_ms
+        return {k: int(v) if isinstance(v, float) else v for k, v in s.items()}
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except Exception as e:
+        trace.root.error = repr(e)
+        raise
+    finally:
+        trace.root.end = time.time()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        for listener in _trace_listeners:
+            listener(trace)
+        if TRACE_EXPORT:
+            exporter.submit(trace)
+
+
+def add_trace_listener(fn):
+    _trace_listeners.append(fn)
+    return fn
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(trace.trace_id, parent.span_id if parent else None, name, kind, attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    profiler = trace.profiler
+    if profiler:
+        profiler.enter()
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+        if profiler:
+            profiler.exit()
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def traced_node(name: str, fn):
+    """Wrap a graph node so each run opens a span."""
+    def run(state):
+        with span(name, "node"):
+            return fn(state)
+    return run
+
+
+def submit(executor, fn, *args):
+    """executor.submit() that keeps the caller's trace context in the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class TracedEmbeddings(Embeddings):
+    """Embeddings wrapper that records a span per embedding call."""
+
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
+
+    def embed_query(self, text: str) -> list[float]:
+        with span("embed_query", "embedding", texts=1):
+            return self.inner.embed_query(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with span("embed_documents", "embedding", texts=len(texts)):
+            return self.inner.embed_documents(texts)
+
+
+# --------------------------------------------------
+# EXPORT
+# --------------------------------------------------
+def _otlp_payload(trace: Trace) -> dict:
+    def value(v):
+        if isinstance(v, bool):
+            return {"boolValue": v}
+        if isinstance(v, int):
+            return {"intValue": str(v)}
+        if isinstance(v, float):
+            return {"doubleValue": v}
+        return {"stringValue": str(v)}
+
+    spans = []
+    for s in trace.spans:
+        spans.append({
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "parentSpanId": s.parent_id or "",
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(s.start * 1e9)),
+            "endTimeUnixNano": str(int((s.end or s.start) * 1e9)),
+            "attributes": [{"key": k, "value": value(v)} for k, v in {"kind": s.kind, **s.attributes}.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+        })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "tax-rag-api"}}]},
+            "scopeSpans": [{"scope": {"name": "tax_rag.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class TraceExporter:
+    """Exports finished traces from a background thread so requests never wait on it."""
+
+    def __init__(self, mode: str = TRACE_EXPORT, maxsize: int = 1000):
+        self.mode = mode
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._thread = None
+
+    def submit(self, trace: Trace):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            trace = self.queue.get()
+            try:
+                if self.mode == "jsonl":
+                    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                        for s in trace.spans:
+                            f.write(json.dumps(s.to_dict(), default=str) + "\n")
+                elif self.mode == "otlp":
+                    request = urllib.request.Request(
+                        TRACE_OTLP_ENDPOINT,
+                        data=json.dumps(_otlp_payload(trace), default=str).encode("utf-8"),
+                        headers={"Content-Type": "application/json"},
+                        method="POST"
+                    )
+                    urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                print(f"Trace export error: {e}")
+
+
+exporter = TraceExporter()
@@ -0,0 +1,364 @@
+# Write-behind persistence for /query turns
+
+# /query hands the finished turn (messages, citations, query log, metrics) to
+# a bounded in-process queue and returns. A background worker writes turns in
+# micro-batches: up to WRITE_BATCH_SIZE turns, or whatever arrived within
+# WRITE_FLUSH_INTERVAL_MS, in one transaction. Failed batches are retried with
+# backoff, then appended to a local journal (WRITE_JOURNAL, JSON lines). The
+# journal is replayed when the worker starts (the API's lifespan startup, or the
+# first submit() for other users). On shutdown (the API's lifespan, or
+# interpreter exit for other users) the queue is drained or spilled to the
+# journal.
+#
+# When the queue is full, submit() returns False and the caller writes the
+# turn itself, so a slow database applies back-pressure instead of losing data.
+
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import bindparam, text
+
+from documents import document_registry
+from session_store import session_cache
+
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") == "1"
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", 10000))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))
+WRITE_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_FLUSH_INTERVAL_MS", 50))
+WRITE_RETRIES = int(os.getenv("WRITE_RETRIES", 3))
+WRITE_DRAIN_SECONDS = float(os.getenv("WRITE_DRAIN_SECONDS", 10))
+WRITE_JOURNAL = os.getenv(
+    "WRITE_JOURNAL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "write_journal.jsonl")
+)
+
+METRIC_COLUMNS = [
+    "trace_id", "total_ms", "llm_ms", "llm_calls", "llm_cache_hits", "input_tokens", "output_tokens",
+    "tool_ms", "tool_calls", "retrieved_chunks", "embedding_ms", "embedding_calls", "multilingual_ms", "db_ms"
+]
+
+_STOP = object()
+
+
+def turn_record(user_id: int, thread_id: str, question: str, answer: str, sources: list[dict],
+                response_time_ms: int, metrics: dict) -> dict:
+    """Everything written for one /query turn, JSON-serializable for the journal."""
+    return {
+        "user_id": user_id,
+        "thread_id": thread_id,
+        "question": question,
+        "answer": answer,
+        "sources": sources,
+        "response_time_ms": response_time_ms,
+        "metrics": metrics,
+    }
+
+
+def _insert_rows(db, table: str, columns: list[str], rows: list[dict]) -> list[int]:
+    """INSERT each row and return the generated ids in row order."""
+    # One statement per row: a multi-row INSERT only reports one id, and the
+    # rest are not guaranteed to be consecutive (auto_increment_increment > 1,
+    # interleaved autoinc locks, concurrent writers such as the synchronous
+    # fallback in tax_app.py). The rows still share the batch's transaction.
+    statement = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+    return [db.execute(statement, {c: row[c] for c in columns}).lastrowid for row in rows]
+
+
+def write_turns(db, records: list[dict]):
+    """Write a batch of turn records in the caller's transaction (the caller commits)."""
+    sqlite = db.get_bind().dialect.name == "sqlite"
+
+    # Resolved before the turn's own writes: unknown documents are committed separately
+    document_ids = document_registry.resolve(db.get_bind(), [s for r in records for s in r["sources"]])
+
+    # Sessions: create missing ones, touch last_active on the rest
+    keys = sorted({(r["user_id"], r["thread_id"]) for r in records})
+    db.execute(text(
+        """
+        INSERT INTO chat_sessions (user_id, title) VALUES (:user_id, :thread_id)
+        ON CONFLICT (user_id, title) DO UPDATE SET last_active = CURRENT_TIMESTAMP
+        """ if sqlite else """
+        INSERT INTO chat_sessions (user_id, title) VALUES (:user_id, :thread_id)
+        ON DUPLICATE KEY UPDATE last_active = CURRENT_TIMESTAMP
+        """
+    ), [{"user_id": u, "thread_id": t} for u, t in keys])
+
+    rows = db.execute(text("""
+        SELECT session_id, user_id, title FROM chat_sessions
+        WHERE user_id IN :user_ids AND title IN :titles
+    """).bindparams(bindparam("user_ids", expanding=True), bindparam("titles", expanding=True)), {
+        "user_ids": sorted({u for u, _ in keys}),
+        "titles": sorted({t for _, t in keys}),
+    }).fetchall()
+    session_ids = {(r.user_id, r.title): r.session_id for r in rows}
+
+    # Messages: question then answer for each turn
+    message_ids = _insert_rows(db, "messages", ["session_id", "role", "content"], [
+        {"session_id": session_ids[(r["user_id"], r["thread_id"])], "role": role, "content": content}
+        for r in records
+        for role, content in (("user", r["question"]), ("assistant", r["answer"]))
+    ])
+
+    citations = [
+        {
+            "message_id": message_ids[2 * i + 1],
+            "document_id": document_ids.get(source.get("source_path")),
+            "page_number": source.get("page_number")
+        }
+        for i, r in enumerate(records)
+        for source in r["sources"]
+    ]
+    if citations:
+        db.execute(text("""
+            INSERT INTO citations (message_id, document_id, page_number)
+            VALUES (:message_id, :document_id, :page_number)
+        """), citations)
+
+    # Query logs and their per-stage metrics
+    log_ids = _insert_rows(db, "query_logs", ["user_id", "question", "retrieved_docs", "response_time_ms"], [
+        {
+            "user_id": r["user_id"],
+            "question": r["question"],
+            "retrieved_docs": len(r["sources"]),
+            "response_time_ms": r["response_time_ms"]
+        }
+        for r in records
+    ])
+    metrics = [{"log_id": log_id, **r["metrics"]} for log_id, r in zip(log_ids, records) if r.get("metrics")]
+    if metrics:
+        db.execute(text(f"""
+            INSERT INTO query_metrics (log_id, {", ".join(METRIC_COLUMNS)})
+            VALUES (:log_id, {", ".join(":" + c for c in METRIC_COLUMNS)})
+        """), [{"log_id": m["log_id"], **{c: m.get(c) for c in METRIC_COLUMNS}} for m in metrics])
+
+
+class WriteBehindQueue:
+    def __init__(self, session_factory, maxsize: int = WRITE_QUEUE_SIZE, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval_ms: float = WRITE_FLUSH_INTERVAL_MS, retries: int = WRITE_RETRIES,
+                 journal: str = WRITE_JOURNAL):
+        self.session_factory = session_factory
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.retries = retries
+        self.journal = journal
+
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.journaled = 0
+        self.rejected = 0
+
+        self._pending = Counter()  # (user_id, thread_id) -> turns not yet written
+        self._cond = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._closing = threading.Event()  # cuts retry backoff short on shutdown
+        self._inflight = None  # batch the worker is writing; close() journals it if the worker hangs
+
+    # ---------------------------------------------
+    # Producer side
+    # ---------------------------------------------
+    def submit(self, record: dict) -> bool:
+        """Queue a turn. False when the queue is full or closed: write it synchronously instead."""
+        if self._closed:
+            return False
+        self.start()
+        key = (record["user_id"], record["thread_id"])
+        with self._cond:
+            self._pending[key] += 1
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._done([record])
+            self.rejected += 1
+            return False
+        return True
+
+    def pending(self, user_id: int, thread_id: str | None = None) -> bool:
+        """True while turns of this thread (any of the user's threads when None) are queued or being written."""
+        with self._cond:
+            return self._has_pending(user_id, thread_id)
+
+    def wait_for(self, user_id: int, thread_id: str | None = None, timeout: float = 5.0) -> bool:
+        """Block until queued turns of this thread (or user) are written (read-your-writes for /session, /export)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._has_pending(user_id, thread_id), timeout=timeout)
+
+    def _has_pending(self, user_id: int, thread_id: str | None) -> bool:
+        if thread_id is not None:
+            return bool(self._pending[(user_id, thread_id)])
+        return any(user == user_id for user, _ in self._pending)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "journaled": self.journaled,
+            "rejected": self.rejected,
+        }
+
+    # ---------------------------------------------
+    # Worker
+    # ---------------------------------------------
+    def start(self):
+        """Start the worker and replay the journal of an earlier run.
+
+        Journaled turns count as pending before this returns, so /session and
+        /export wait for their replay instead of reading around them.
+        """
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            journals = self._claim_journal()
+            for _, records in journals:
+                for r in records:
+                    self._pending[(r["user_id"], r["thread_id"])] += 1
+            self._thread = threading.Thread(target=self._run, args=(journals,), name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self, journals: list[tuple[str, list[dict]]]):
+        self._replay_journal(journals)
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    self._flush(batch)
+                    return
+                batch.append(record)
+            self._flush(batch)
+
+    def _flush(self, batch: list[dict]):
+        with self._cond:
+            self._inflight = batch
+        written = False
+        for attempt in range(self.retries + 1):
+            if attempt and self._closed:
+                break  # shutting down: journal now rather than keep retrying
+            db = self.session_factory()
+            try:
+                write_turns(db, batch)
+                db.commit()
+                written = True
+                self.written += len(batch)
+                self.batches += 1
+                break
+            except Exception as e:
+                db.rollback()
+                self.failed_batches += 1
+                print(f"Write-behind batch of {len(batch)} failed (attempt {attempt + 1}): {e}")
+                if attempt < self.retries:
+                    self._closing.wait(min(0.5 * 2 ** attempt, 10))
+            finally:
+                db.close()
+
+        with self._cond:
+            claimed = self._inflight is batch  # False when close() journaled it already
+            self._inflight = None
+        if not written and claimed:
+            self._append_journal(batch)
+        self._done(batch)
+
+    def _done(self, records: list[dict]):
+        with self._cond:
+            for r in records:
+                key = (r["user_id"], r["thread_id"])
+                self._pending[key] -= 1
+                if self._pending[key] <= 0:
+                    del self._pending[key]
+                session_cache.invalidate(*key)
+            self._cond.notify_all()
+
+    # ---------------------------------------------
+    # Journal
+    # ---------------------------------------------
+    def _append_journal(self, records: list[dict]):
+        with self._journal_lock, open(self.journal, "a", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, default=str) + "\n")
+        self.journaled += len(records)
+        print(f"Write-behind: {len(records)} turns appended to {self.journal}")
+
+    def _claim_journal(self) -> list[tuple[str, list[dict]]]:
+        """Move the journal aside for replay; returns (path, records) per journal file."""
+        with self._journal_lock:
+            paths = sorted(glob.glob(glob.escape(self.journal) + ".*.replay"))  # interrupted earlier replays
+            if os.path.exists(self.journal):
+                paths.append(f"{self.journal}.{int(time.time() * 1000)}.replay")
+                os.replace(self.journal, paths[-1])
+
+        journals = []
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                journals.append((path, [json.loads(line) for line in f if line.strip()]))
+        return journals
+
+    def _replay_journal(self, journals: list[tuple[str, list[dict]]]):
+        # Replay is at-least-once: a crash mid-replay can write a batch twice
+        for path, records in journals:
+            print(f"Write-behind: replaying {len(records)} journaled turns from {path}")
+            for i in range(0, len(records), self.batch_size):
+                self._flush(records[i:i + self.batch_size])
+            os.remove(path)
+
+    # ---------------------------------------------
+    # Shutdown
+    # ---------------------------------------------
+    def close(self, timeout: float = WRITE_DRAIN_SECONDS):
+        """Stop accepting turns, drain the queue, and journal whatever could not be written in time."""
+        if self._closed:
+            return
+        self._closed = True
+        self._closing.set()
+        if self._thread is None:
+            return
+
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+        # Still writing (e.g. blocked on the database): journal the batch in hand,
+        # since the daemon worker dies with the interpreter. Replay may then write
+        # it twice if the write does commit, as with any at-least-once replay.
+        if self._thread.is_alive():
+            with self._cond:
+                inflight, self._inflight = self._inflight, None
+            if inflight:
+                self._append_journal(inflight)
+
+        left = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                left.append(record)
+        if left:
+            self._append_journal(left)
+            self._done(left)
+        if self._thread.is_alive():
+            self.queue.put_nowait(_STOP)  # let a stuck worker exit once it gets unstuck